@@ -1,12 +1,33 @@
-from fastapi import FastAPI, HTTPException, UploadFile, Form, Response
+from fastapi import FastAPI, HTTPException, UploadFile, Form, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional
-from utils.db import configure_db, get_database_schema
+from utils.db import configure_db, get_database_schema, normalize_question
 from utils.chat import chat_db
 from utils.rag_service import get_rag_service
 from utils.visualization_validator import get_visualization_validator
-from groq import Groq
+from utils.chart_data import prepare_chart_data, DEFAULT_TARGET_POINTS, DEFAULT_TOP_K
+from utils.viz_query_planner import VisualizationQueryPlanner, DEFAULT_MAX_POINTS
+from utils.anomaly_detection import get_anomaly_detector, DEFAULT_METHOD, MAX_RETURNED_ROWS
+from utils.anomaly_pushdown import AnomalyPushdown
+from utils.schema_cache import get_schema_catalog, database_key_from_config
+from utils.smart_suggestions import get_suggestion_index
+from utils.completion_engine import get_completion_engine, MIN_LOCAL_CANDIDATES
+from utils.recommendation_cache import get_recommendation_cache, parse_recommendations
+from utils.query_templates import get_template_compiler
+from utils.semantic_parser import get_semantic_parser
+from utils.value_index import get_value_index
+from utils.column_stats import get_statistics_catalog
+from utils.llm_gateway import get_llm_gateway
+from utils.llm_scheduler import get_llm_scheduler, BACKGROUND
+from utils.model_router import get_model_router
+from utils.deadline import request_deadline, CHAT_DEADLINE_SECONDS
+from utils.result_cache import get_result_cache
+from utils.cost_guard import get_cost_guard
+from utils.index_advisor import get_index_advisor
+from utils.request_coalescer import get_request_coalescer, coalescing_key, database_identity, question_key
+from utils.anomaly_monitor import get_anomaly_monitor_service, DEFAULT_MIN_HISTORY, DEFAULT_EWMA_ALPHA, MAX_TICK_ROWS
+from fastapi.concurrency import run_in_threadpool
 # Using requests for simple translation instead of googletrans
 import os
 from dotenv import load_dotenv
@@ -16,6 +37,7 @@ from fastapi.responses import FileResponse
 from typing import Optional, List, Dict, Any
 import json
 import re
+import asyncio
 import traceback
 import requests
 from twilio.twiml.messaging_response import MessagingResponse
@@ -31,7 +53,23 @@ if not groq_api_key_2:
     groq_api_key_2 = "dummy_key_for_development"  # Fallback for development
 
 api = FastAPI()
-client = Groq(api_key=groq_api_key_2)
+llm_gateway = get_llm_gateway()
+# Audio endpoints use the Groq SDK on the gateway's pooled connections
+client = llm_gateway.sdk_client("groq", key_env="GROQ_API_KEY_2")
+# Subscribe the per-database indexes and caches to schema catalog builds before any database connects
+suggestion_index = get_suggestion_index()
+completion_engine = get_completion_engine()
+recommendation_cache = get_recommendation_cache()
+template_compiler = get_template_compiler()
+semantic_parser = get_semantic_parser()
+value_index = get_value_index()
+statistics_catalog = get_statistics_catalog()
+request_coalescer = get_request_coalescer()
+result_cache = get_result_cache()
+cost_guard = get_cost_guard()
+
+# A coalesced caller waits this long past its deadline for the shared answer
+COALESCED_WAIT_GRACE_SECONDS = 1.0
 
 # Add CORS middleware
 api.add_middleware(
@@ -41,7 +79,6 @@ api.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-client = Groq(api_key=groq_api_key_2)
 
 class DatabaseConfig(BaseModel):
     dbtype: str
@@ -53,12 +90,19 @@ class DatabaseConfig(BaseModel):
     
 class QueryRequest(BaseModel):
     query: str
+    include_trace: bool = Field(False, description="Return the agent's structured trace (actions and observations)")
+    deadline_seconds: Optional[float] = Field(None, gt=0, description="Time budget for the answer (X-Deadline-Seconds header or CHAT_DEADLINE_SECONDS if omitted)")
 
 class SearchCompletionsRequest(BaseModel):
     term: str = Field(..., description="The partial search term to find completions for")
     limit: int = Field(10, description="Maximum number of completions to return")
     database_config: Optional[DatabaseConfig] = None
 
+class SmartSuggestionsRequest(BaseModel):
+    database_config: DatabaseConfig
+    user_history: List[str] = Field([], description="The user's recent questions, oldest first")
+    current_context: str = Field("", description="Current question or result context for follow-up suggestions")
+
 class GraphRecommendationRequest(BaseModel):
     sql_result_json: List[Dict[str, Any]] = Field(..., description="The result of the SQL query in JSON format (list of dictionaries)")
     user_query: Optional[str] = Field("", description="Original user query in natural language")
@@ -71,12 +115,66 @@ class GraphRecommendationResponse(BaseModel):
     confidence: Optional[float] = 1.0
     validator: Optional[str] = "rule_based"
 
+class ChartDataRequest(BaseModel):
+    sql_result_json: List[Dict[str, Any]] = Field(..., description="The result of the SQL query in JSON format (list of dictionaries)")
+    chart_type: str = Field(..., description="Chart to prepare data for: line, area, scatter, heatmap, pie or bar")
+    x_key: Optional[str] = Field(None, description="Column for the x axis or category labels (auto-detected if omitted)")
+    y_keys: Optional[List[str]] = Field(None, description="Numeric columns to plot (auto-detected if omitted)")
+    target_points: int = Field(DEFAULT_TARGET_POINTS, description="Maximum number of points to return")
+    top_k: int = Field(DEFAULT_TOP_K, description="Categories kept for pie/bar charts before grouping into 'Other'")
+
+class VisualizationQueryRequest(BaseModel):
+    database_config: DatabaseConfig
+    sql_query: str = Field(..., description="Generated SQL query whose result should be charted")
+    chart_type: str = Field(..., description="Recommended chart type (line, area, bar, pie, scatter, heatmap)")
+    x_key: Optional[str] = Field(None, description="Column to bucket on (auto-detected if omitted)")
+    y_keys: Optional[List[str]] = Field(None, description="Numeric columns to aggregate (auto-detected if omitted)")
+    agg: str = Field("sum", description="Aggregate applied to y columns per bucket: sum, avg, min, max or count")
+    max_points: int = Field(DEFAULT_MAX_POINTS, description="Maximum number of aggregated points to return")
+
+class ColumnStatsRequest(BaseModel):
+    database_config: DatabaseConfig
+    table: Optional[str] = Field(None, description="Only return statistics of this table")
+
+class IndexAdvisorRequest(BaseModel):
+    database_config: DatabaseConfig
+    refresh: bool = Field(False, description="Rebuild the report now instead of serving the cached one")
+
+class AnomalyDetectionRequest(BaseModel):
+    sql_result: List[Dict[str, Any]] = Field([], description="Query result rows to analyse (mode 'result')")
+    mode: str = Field("result", description="'result' analyses sql_result in Python, 'database' scores inside the database")
+    database_config: Optional[DatabaseConfig] = Field(None, description="Target database (mode 'database')")
+    table: Optional[str] = Field(None, description="Table to score (mode 'database')")
+    sql_query: Optional[str] = Field(None, description="SELECT to score instead of a table (mode 'database')")
+    group_by: Optional[List[str]] = Field(None, description="Columns defining per-group baselines (mode 'database')")
+    method: Optional[str] = Field(None, description="Detector: mad (default), iqr, zscore or isolation_forest; zscore (default) or iqr in mode 'database'")
+    columns: Optional[List[str]] = Field(None, description="Numeric columns to analyse (all numeric columns if omitted)")
+    threshold: Optional[float] = Field(None, description="Detector threshold (method default if omitted)")
+    contamination: float = Field(0.1, description="Expected anomaly share for isolation_forest")
+    max_rows: int = Field(MAX_RETURNED_ROWS, description="Maximum number of anomalous rows to return")
+
+class AnomalyMonitorRequest(BaseModel):
+    database_config: DatabaseConfig = Field(..., description="Database the monitor reads; ticks must use the same one")
+    sql_query: str = Field(..., description="Saved SELECT producing the monitored rows")
+    timestamp_column: str = Field(..., description="Monotonic column used as the monitor's watermark")
+    value_columns: List[str] = Field(..., description="Numeric columns to watch")
+    series_columns: Optional[List[str]] = Field(None, description="Columns identifying independent series, e.g. store_id")
+    method: str = Field("zscore", description="Scoring method: zscore, ewma or iqr")
+    threshold: Optional[float] = Field(None, description="Score threshold (method default if omitted)")
+    min_history: int = Field(DEFAULT_MIN_HISTORY, description="Observations per series before scoring starts")
+    ewma_alpha: float = Field(DEFAULT_EWMA_ALPHA, description="EWMA smoothing factor")
+    name: Optional[str] = None
+
+class AnomalyMonitorTickRequest(BaseModel):
+    database_config: DatabaseConfig
+    max_rows: int = Field(MAX_TICK_ROWS, gt=0, le=MAX_TICK_ROWS, description="Maximum number of new rows processed in this tick")
+
 async def translate_to_english(text: str) -> str:
     # Since googletrans is not available, we'll use the Groq model for translation
     # This is a simple alternative that doesn't require additional dependencies
     try:
-        response = client.chat.completions.create(
-            messages=[
+        translated_text = await llm_gateway.acomplete(
+            [
                 {"role": "system", "content": "You are a translation assistant. Translate the given text to English."},
                 {"role": "user", "content": f"Translate this text to English: {text}"}
             ],
@@ -84,7 +182,6 @@ async def translate_to_english(text: str) -> str:
             temperature=0.3,
             max_tokens=256
         )
-        translated_text = response.choices[0].message.content
         if translated_text:
             return translated_text.strip()
         return text  # Return original text if translation fails
@@ -98,7 +195,7 @@ def read_root():
 
 
 @api.post("/chat")
-async def chat_with_db(request_data: dict):
+async def chat_with_db(request_data: dict, x_deadline_seconds: Optional[float] = Header(None)):
     print(f"[DEBUG] Incoming /chat payload: {json.dumps(request_data, indent=2)}")
     
     if "database_config" not in request_data or "query_request" not in request_data:
@@ -130,15 +227,35 @@ async def chat_with_db(request_data: dict):
         else:
             connection_host = db_config.host
         
-        db, engine = configure_db(
-            db_config.dbtype, connection_host, db_config.user, 
-            db_config.password, db_config.dbname
-        )
-    
-        result = chat_db(
-            db_config.dbtype, connection_host, db_config.user, 
-            db_config.password, db_config.dbname, query_request.query, db_config_data
-        )
+        deadline_seconds = query_request.deadline_seconds or x_deadline_seconds
+
+        def answer():
+            # Every stage below works within one request budget; optional ones are skipped when it runs short
+            with request_deadline(deadline_seconds):
+                db, engine = configure_db(
+                    db_config.dbtype, connection_host, db_config.user, 
+                    db_config.password, db_config.dbname
+                )
+                if engine is not None:
+                    # First sight of a database (or an expired fingerprint) schedules a background catalog build
+                    get_schema_catalog().ensure(db_config.model_dump(), engine)
+            
+                return chat_db(
+                    db_config.dbtype, connection_host, db_config.user, 
+                    db_config.password, db_config.dbname, query_request.query, db_config_data,
+                    include_trace=query_request.include_trace
+                )
+
+        # Identical questions arriving together share one pipeline run, off the event loop
+        # The deadline decides which stages run, so only callers with the same one share a run
+        key = question_key("chat", db_config_data, query_request.query, query_request.include_trace, deadline_seconds)
+        try:
+            result = await request_coalescer.run(
+                key, lambda: run_in_threadpool(answer),
+                timeout=(deadline_seconds or CHAT_DEADLINE_SECONDS) + COALESCED_WAIT_GRACE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="No answer within the request deadline")
         
         return result
     except HTTPException as e:
@@ -167,114 +284,86 @@ async def recommend_queries(request_data: dict):
         print(f"[ERROR] Invalid request format: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Invalid request format: {str(e)}")
 
+    # Dashboards opening together ask for the same database's recommendations at once
+    key = coalescing_key("recommend", database_identity(data_config_data))
+    return await request_coalescer.run(key, lambda: _recommend_queries(db_config))
+
+
+async def _recommend_queries(db_config: DatabaseConfig):
     try:
         print(f"[DEBUG] Connecting to DB: type={db_config.dbtype}, host={db_config.host}, user={db_config.user}, db={db_config.dbname}")
         
-        if db_config.dbtype == "neo4j":
-            # Handle Neo4j graph database
-            # Use uri field if provided, otherwise construct from host
-            if db_config.uri:
-                neo4j_uri = db_config.uri
-            else:
-                # Fallback: construct URI from host
-                if "://" in db_config.host:
-                    neo4j_uri = db_config.host  # Already a URI
-                else:
-                    neo4j_uri = f"neo4j://{db_config.host}:7687"  # Construct URI
-            
-            print(f"[DEBUG] Using Neo4j URI: {neo4j_uri}")
-            driver, _ = configure_db(db_config.dbtype, neo4j_uri, db_config.user, db_config.password, db_config.dbname)
-            schema = get_database_schema(None, "neo4j", driver)
-            
-            prompt = f"""
-            Given the following Neo4j graph database schema:
-            Node Types: {list(schema['nodes'].keys())}
-            Node Properties: {json.dumps(schema['nodes'], indent=2)}
-            Relationship Types: {list(schema['relationships'].keys())}
-            
-            Generate 10 natural language questions that a business user might ask about this graph database.
-            Focus on relationships, patterns, and insights that can be discovered in the graph.
-            Each question should be clear and answerable using Cypher queries.
-            
-            Return ONLY a JSON array of questions (no Cypher queries, no explanations).
-            
-            Example format:
-            ["Who are my top customers by total spending?", "What products are frequently bought together?", "Which product categories have the highest ratings?"]
-            
-            Generate 10 similar questions for this schema and return as a JSON array:
-            """
-            
-            # Close Neo4j driver
-            try:
-                getattr(driver, 'close')()  # type: ignore
-            except:
-                pass
+        if db_config.dbtype not in ("postgresql", "mysql", "neo4j"):
+            raise HTTPException(status_code=400, detail=f"Unsupported database type: {db_config.dbtype}")
+        if db_config.dbtype != "neo4j":
+            # SQL databases are served from the recommendation cache (stale-while-revalidate)
+            config_data = db_config.model_dump()
+            catalog = get_schema_catalog()
+            snapshot = await run_in_threadpool(catalog.ensure, config_data, None, True)
+            if snapshot is None:
+                raise HTTPException(status_code=500, detail="Could not read the database schema")
+            result = await run_in_threadpool(recommendation_cache.get, snapshot)
+            print(f"[DEBUG] Recommended queries (cached={result['cached']}, stale={result['stale']}): {result['recommended_queries']}")
+            return result
+
+        # Handle Neo4j graph database
+        # Use uri field if provided, otherwise construct from host
+        if db_config.uri:
+            neo4j_uri = db_config.uri
         else:
-            # Handle SQL databases (existing logic)
-            _, engine = configure_db(db_config.dbtype, db_config.host, db_config.user, db_config.password, db_config.dbname)
-            print("[DEBUG] DB connection successful.")
-            schema = get_database_schema(engine)
-            print(f"[DEBUG] Retrieved schema: {schema}")
-            prompt = f"""
-            Given the following database schema:
-            {schema}
-            
-            Generate 10 natural language queries that a business user might ask about this database.
-            Each query should be a single sentence and should be relevant to the schema provided.
-            Avoid complex queries or technical jargon. The query should be simple and understandable.
-            the query should be start with select when coverted to sql query.
-            Return them as a JSON array of strings. Each query should be clear and answerable using SQL.
-            """
+            # Fallback: construct URI from host
+            if "://" in db_config.host:
+                neo4j_uri = db_config.host  # Already a URI
+            else:
+                neo4j_uri = f"neo4j://{db_config.host}:7687"  # Construct URI
+
+        print(f"[DEBUG] Using Neo4j URI: {neo4j_uri}")
+        driver, _ = configure_db(db_config.dbtype, neo4j_uri, db_config.user, db_config.password, db_config.dbname)
+        schema = get_database_schema(None, "neo4j", driver)
+
+        prompt = f"""
+        Given the following Neo4j graph database schema:
+        Node Types: {list(schema['nodes'].keys())}
+        Node Properties: {json.dumps(schema['nodes'], indent=2)}
+        Relationship Types: {list(schema['relationships'].keys())}
+
+        Generate 10 natural language questions that a business user might ask about this graph database.
+        Focus on relationships, patterns, and insights that can be discovered in the graph.
+        Each question should be clear and answerable using Cypher queries.
+
+        Return ONLY a JSON object {{"recommendations": [...]}} holding the questions (no Cypher queries, no explanations).
+
+        Example format:
+        {{"recommendations": ["Who are my top customers by total spending?", "What products are frequently bought together?", "Which product categories have the highest ratings?"]}}
+        """
+
+        # Close Neo4j driver
+        try:
+            getattr(driver, 'close')()  # type: ignore
+        except:
+            pass
+
         print(f"[DEBUG] LLM prompt: {prompt}")
-        response = client.chat.completions.create(
-            messages=[
+        llm_response = await llm_gateway.acomplete(
+            [
                 {"role": "system", "content": "You are a database expert that helps generate natural language queries."},
                 {"role": "user", "content": prompt}
             ],
-            model="llama-3.1-8b-instant", 
+            model="llama-3.1-8b-instant",
             temperature=0.7,
-            max_tokens=1024
+            max_tokens=1024,
+            json_mode=True,
+            priority=BACKGROUND
         )
-        llm_response = response.choices[0].message.content
         print(f"[DEBUG] LLM response: {llm_response}")
-        
-        recommended_queries = []
-        if llm_response:
-            try:
-                # First try to parse as direct JSON
-                recommended_queries = json.loads(llm_response)
-            except json.JSONDecodeError:
-                try:
-                    # Try to find JSON array in the response
-                    json_match = re.search(r'\[.*?\]', llm_response, re.DOTALL)
-                    if json_match:
-                        recommended_queries = json.loads(json_match.group(0))
-                    else:
-                        # Fallback: extract questions manually
-                        lines = llm_response.split('\n')
-                        questions = []
-                        for line in lines:
-                            line = line.strip()
-                            # Look for numbered questions or questions in quotes
-                            if '"' in line and not line.startswith('-'):
-                                # Extract text between quotes
-                                quote_match = re.search(r'"([^"]+)"', line)
-                                if quote_match:
-                                    questions.append(quote_match.group(1))
-                            elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '10.')):
-                                # Extract question after number
-                                question = re.sub(r'^\d+\.\s*', '', line)
-                                question = question.strip('"').strip("'").strip()
-                                if question and not question.startswith('Cypher'):
-                                    questions.append(question)
-                        recommended_queries = questions
-                except:
-                    # Final fallback
-                    recommended_queries = [q.strip().strip('"').strip("'") for q in llm_response.split('\n') if q.strip() and not q.strip().startswith('-')]
+
+        recommended_queries = [item["question"] for item in parse_recommendations(llm_response)]
         print(f"[DEBUG] Recommended queries: {recommended_queries}")
         return {
             "recommended_queries": recommended_queries
         }
+    except HTTPException as e:
+        raise e
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -282,6 +371,28 @@ async def recommend_queries(request_data: dict):
         raise HTTPException(status_code=500, detail=f"Error processing recommendation: {str(e)}\n{error_details}")
 
 
+@api.post("/smart-suggestions")
+async def smart_suggestions(request: SmartSuggestionsRequest):
+    """
+    Schema- and history-driven query suggestions served from the in-memory
+    suggestion index. Only the very first request for a database waits for
+    the background schema build.
+    """
+    config = request.database_config
+    if config.dbtype not in ("postgresql", "mysql"):
+        raise HTTPException(status_code=400, detail="Smart suggestions are only supported for PostgreSQL and MySQL")
+
+    try:
+        config_data = config.model_dump()
+        # Also verifies the credentials before anything cached for this database is served
+        await run_in_threadpool(get_schema_catalog().ensure, config_data, None, True)
+        return suggestion_index.get_suggestions(config_data, request.user_history, request.current_context)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Smart suggestions failed: {str(e)}")
+
+
 @api.post("/speech-to-text")
 async def speech_to_text(file: UploadFile,language: str = Form("en")):
     try:
@@ -353,22 +464,8 @@ async def text_to_speech(text: str, voice: str = Form("Aaliyah-PlayAI")):
         raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
     
     
-@api.post("/search-completions")
-async def search_completions(request: SearchCompletionsRequest):
-    term, limit, config = request.term, request.limit, request.database_config
-    completions, schema = [], None
-
-    
-    if config:
-        try:
-            _, engine = configure_db(
-                config.dbtype, config.host, config.user, config.password, config.dbname
-            )
-            schema = get_database_schema(engine)
-        except Exception as e:
-            print(f"[Warning] Failed to load DB schema: {e}")
-
-    
+def _llm_completions(term: str, limit: int, schema: Optional[str]) -> List[str]:
+    """LLM autocompletion, only used as a background fallback by the completion engine"""
     if schema:
         prompt = (
             f"Given the following database schema:\n{schema}\n\n"
@@ -385,36 +482,59 @@ async def search_completions(request: SearchCompletionsRequest):
             f"Output as a JSON list of strings."
         )
 
-    
-    try:
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            temperature=0.2,
-            max_tokens=256,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": "You are an assistant providing database query autocompletions."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+    content = llm_gateway.complete(
+        [
+            {"role": "system", "content": "You are an assistant providing database query autocompletions."},
+            {"role": "user", "content": prompt}
+        ],
+        model="llama-3.1-8b-instant",
+        temperature=0.2,
+        max_tokens=256,
+        json_mode=True,
+        priority=BACKGROUND
+    )
+    completions = []
+    if content:
+        try:
+            parsed = json.loads(content)
+            completions = parsed.get("suggestions") if isinstance(parsed, dict) else parsed
+        except json.JSONDecodeError:
+            print(f"[Warning] Invalid JSON from LLM: {content}")
+            completions = re.findall(r'"(.*?)"', content)
+    if not isinstance(completions, list):
+        return []
+    return [str(c) for c in completions if c][:limit]
 
-        content = response.choices[0].message.content
-        completions = []
-        if content:
-            try:
-                parsed = json.loads(content)
-                completions = parsed.get("suggestions") if isinstance(parsed, dict) else parsed
-            except json.JSONDecodeError:
-                print(f"[Warning] Invalid JSON from LLM: {content}")
-                completions = re.findall(r'"(.*?)"', content) if content else []
+
+@api.post("/search-completions")
+async def search_completions(request: SearchCompletionsRequest):
+    """
+    Keystroke autocompletion served from the in-memory completion engine.
+    When local candidates are insufficient a debounced LLM lookup is scheduled
+    in the background; its result is returned by later requests for the same term.
+    """
+    term, limit, config = request.term, request.limit, request.database_config
+    config_data = None
+    if config and config.dbtype in ("postgresql", "mysql"):
+        config_data = config.model_dump()
+        try:
+            # Schedules the first build (the engine is filled by the catalog listener) once the credentials connect
+            await run_in_threadpool(get_schema_catalog().ensure, config_data)
+        except Exception as e:
+            # Without verified credentials nothing sampled from the database is served
+            print(f"[Warning] Failed to register database for completions: {e}")
+            config_data = None
+
+    completions = completion_engine.complete(term, limit, config_data)
+    source = "local"
+    if len(completions) < min(limit, MIN_LOCAL_CANDIDATES):
+        llm_completions = completion_engine.cached_llm_completions(term, config_data)
+        if llm_completions:
+            completions.extend(c for c in llm_completions if c not in completions)
+            source = "llm_cache"
         else:
-            completions = []
-    except Exception as e:
-        print(f"[Error] LLM failure for term '{term}': {e}\n{traceback.format_exc()}")
-        completions = [f"Error generating suggestions for '{term}'"]
-    if not isinstance(completions, list):
-        completions = []
-    return {"completions": completions[:limit]}
+            completion_engine.schedule_llm_fallback(term, limit, config_data, _llm_completions)
+    return {"completions": completions[:limit], "source": source}
 
 
 
@@ -433,10 +553,17 @@ async def recommend_graph(request: GraphRecommendationRequest) -> GraphRecommend
     # Get user query and SQL query from request if available
     user_query = getattr(request, 'user_query', '')
     sql_query = getattr(request, 'sql_query', '')
-    
-    # Use Azure OpenAI to validate if visualization is appropriate
+
+    # Widgets rendering the same result ask at once; they share one validation
+    key = coalescing_key("graphrecommender", normalize_question(user_query or ""), sql_query, data)
+    return await request_coalescer.run(key, lambda: _recommend_graph(data, user_query, sql_query))
+
+
+async def _recommend_graph(data: List[Dict[str, Any]], user_query: str, sql_query: str) -> GraphRecommendationResponse:
+    # Use Azure OpenAI to validate if visualization is appropriate (a blocking LLM call, so off the event loop)
     validator = get_visualization_validator()
-    validation_result = validator.should_visualize(
+    validation_result = await run_in_threadpool(
+        validator.should_visualize,
         user_query=user_query,
         sql_query=sql_query,
         result_data=data[:10],  # Send first 10 rows for analysis
@@ -473,6 +600,126 @@ async def recommend_graph(request: GraphRecommendationRequest) -> GraphRecommend
     )
 
 
+@api.post("/chart-data")
+async def chart_data(request: ChartDataRequest):
+    """
+    Reduce a query result to render-ready chart data bounded by target_points.
+    Line/area use LTTB downsampling, scatter/heatmap use 2D binning and
+    pie/bar keep the top-k categories plus an "Other" bucket.
+    """
+    data = request.sql_result_json
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        raise HTTPException(status_code=400, detail="Invalid input: Expected a list of dictionaries.")
+
+    try:
+        # NumPy work runs off the event loop so large results don't stall other requests
+        return await run_in_threadpool(
+            prepare_chart_data,
+            data,
+            request.chart_type,
+            request.x_key,
+            request.y_keys,
+            request.target_points,
+            request.top_k,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[ERROR] /chart-data failed: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error preparing chart data: {str(e)}")
+
+
+@api.post("/visualization-query")
+async def visualization_query(request: VisualizationQueryRequest):
+    """
+    Push chart aggregation down to the database: time trends are grouped by a
+    date bucket and numeric distributions by histogram bins sized from the
+    column's min/max, so only a few hundred points leave the database.
+    """
+    config = request.database_config
+    if config.dbtype not in ("postgresql", "mysql"):
+        raise HTTPException(status_code=400, detail="Visualization push-down is only supported for PostgreSQL and MySQL")
+
+    try:
+        _, engine = configure_db(config.dbtype, config.host, config.user, config.password, config.dbname)
+        # Known databases get their bounds from column statistics; first sight schedules collection
+        config_data = config.model_dump()
+        await run_in_threadpool(get_schema_catalog().ensure, config_data, engine)
+        planner = VisualizationQueryPlanner(engine, config.dbtype, max_points=request.max_points,
+                                            database_key=database_key_from_config(config_data))
+
+        def plan_chart():
+            # Statements are capped by a request budget like chat queries
+            with request_deadline():
+                return planner.execute(request.sql_query, request.chart_type, request.x_key, request.y_keys, request.agg)
+
+        return await run_in_threadpool(plan_chart)
+    except HTTPException as e:
+        raise e
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[ERROR] /visualization-query failed: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error planning visualization query: {str(e)}")
+
+
+@api.post("/column-stats")
+async def column_stats(request: ColumnStatsRequest):
+    """
+    Per-column statistics (row counts, null fractions, n-distinct, min/max and
+    histograms) served from the background statistics catalog.
+    """
+    config = request.database_config
+    if config.dbtype not in ("postgresql", "mysql"):
+        raise HTTPException(status_code=400, detail="Column statistics are only supported for PostgreSQL and MySQL")
+
+    try:
+        snapshot = await run_in_threadpool(get_schema_catalog().ensure, config.model_dump(), None, True)
+        if snapshot is None:
+            raise HTTPException(status_code=500, detail="Could not read the database schema")
+        stats = await run_in_threadpool(statistics_catalog.wait, snapshot)
+        if stats is None:
+            raise HTTPException(status_code=500, detail="Could not collect column statistics")
+        if request.table and stats.table(request.table) is None:
+            raise ValueError(f"Table '{request.table}' not found")
+        result = stats.to_dict(request.table)
+        result["stale"] = stats.fingerprint != snapshot.fingerprint
+        return result
+    except HTTPException as e:
+        raise e
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[ERROR] /column-stats failed: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error reading column statistics: {str(e)}")
+
+
+@api.post("/index-advisor")
+async def index_advisor(request: IndexAdvisorRequest):
+    """
+    Ranked CREATE INDEX recommendations mined from the generated-query history
+    of a database, with HypoPG cost estimates where the extension is installed.
+    """
+    config = request.database_config
+    if config.dbtype not in ("postgresql", "mysql"):
+        raise HTTPException(status_code=400, detail="The index advisor only supports PostgreSQL and MySQL")
+
+    try:
+        config_data = config.model_dump()
+        snapshot = await run_in_threadpool(get_schema_catalog().ensure, config_data, None, True)
+        if snapshot is None:
+            raise HTTPException(status_code=500, detail="Could not read the database schema")
+        report = await run_in_threadpool(get_index_advisor().report, snapshot, config_data, request.refresh)
+        if report is None:
+            raise HTTPException(status_code=500, detail="Could not analyse the query history")
+        return report
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"[ERROR] /index-advisor failed: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error building index recommendations: {str(e)}")
+
+
 async def _fallback_chart_recommendation(data: List[Dict[str, Any]]) -> List[str]:
     """
     Fallback chart recommendation logic when Azure OpenAI doesn't provide specific charts.
@@ -518,6 +765,157 @@ async def _fallback_chart_recommendation(data: List[Dict[str, Any]]) -> List[str
     return recommended_charts[:3]
 
 
+@api.post("/detect-anomalies")
+async def detect_data_anomalies(request: AnomalyDetectionRequest):
+    """
+    Automatically detects unusual patterns in data
+    Perfect for fraud detection, outlier analysis, etc.
+    """
+    try:
+        if request.mode == "database":
+            config = request.database_config
+            if not config:
+                raise HTTPException(status_code=400, detail="database_config is required for mode 'database'")
+            if not request.columns:
+                raise HTTPException(status_code=400, detail="columns are required for mode 'database'")
+            _, engine = configure_db(config.dbtype, config.host, config.user, config.password, config.dbname)
+            pushdown = AnomalyPushdown(engine, config.dbtype)
+
+            def score():
+                # The scoring query runs in the database under a request budget; only flagged rows come back
+                with request_deadline():
+                    return pushdown.detect(request.columns, request.table, request.sql_query, request.group_by,
+                                           request.method or "zscore", request.threshold, request.max_rows)
+
+            return await run_in_threadpool(score)
+        if request.mode != "result":
+            raise HTTPException(status_code=400, detail=f"Unsupported mode: {request.mode}. Choose 'result' or 'database'.")
+
+        detector = get_anomaly_detector()
+        return await detector.detect_async(
+            request.sql_result,
+            method=request.method or DEFAULT_METHOD,
+            columns=request.columns,
+            threshold=request.threshold,
+            contamination=request.contamination,
+            max_rows=request.max_rows,
+        )
+    except HTTPException as e:
+        raise e
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[ERROR] /detect-anomalies failed: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Anomaly detection failed: {str(e)}")
+
+
+@api.post("/anomaly-monitors")
+async def create_anomaly_monitor(request: AnomalyMonitorRequest):
+    """Register a streaming anomaly monitor over a saved query"""
+    config = request.database_config
+    if config.dbtype not in ("postgresql", "mysql"):
+        raise HTTPException(status_code=400, detail="Anomaly monitors are only supported for PostgreSQL and MySQL")
+    try:
+        config_data = config.model_dump()
+        # Verifies the credentials; a known schema also lets the saved query's tables and columns be checked
+        snapshot = await run_in_threadpool(get_schema_catalog().ensure, config_data)
+        monitor = get_anomaly_monitor_service().create(
+            database_key_from_config(config_data),
+            request.sql_query,
+            request.timestamp_column,
+            request.value_columns,
+            series_columns=request.series_columns,
+            method=request.method,
+            threshold=request.threshold,
+            min_history=request.min_history,
+            ewma_alpha=request.ewma_alpha,
+            name=request.name,
+            snapshot=snapshot,
+        )
+        monitor.pop("series", None)
+        return monitor
+    except HTTPException as e:
+        raise e
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@api.get("/anomaly-monitors")
+async def list_anomaly_monitors():
+    return {"monitors": get_anomaly_monitor_service().list()}
+
+
+@api.get("/anomaly-monitors/{monitor_id}")
+async def get_anomaly_monitor(monitor_id: str):
+    try:
+        monitor = get_anomaly_monitor_service().describe(monitor_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if monitor is None:
+        raise HTTPException(status_code=404, detail=f"Monitor {monitor_id} not found")
+    return monitor
+
+
+@api.delete("/anomaly-monitors/{monitor_id}")
+async def delete_anomaly_monitor(monitor_id: str):
+    try:
+        deleted = get_anomaly_monitor_service().delete(monitor_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Monitor {monitor_id} not found")
+    return {"deleted": monitor_id}
+
+
+@api.post("/anomaly-monitors/{monitor_id}/tick")
+async def tick_anomaly_monitor(monitor_id: str, request: AnomalyMonitorTickRequest):
+    """Score rows newer than the monitor's watermark and fold them into its running statistics"""
+    config = request.database_config
+    if config.dbtype not in ("postgresql", "mysql"):
+        raise HTTPException(status_code=400, detail="Anomaly monitors are only supported for PostgreSQL and MySQL")
+    try:
+        _, engine = configure_db(config.dbtype, config.host, config.user, config.password, config.dbname)
+
+        def tick():
+            # The tick's reads are capped by a request budget like other database reads
+            with request_deadline():
+                return get_anomaly_monitor_service().tick(monitor_id, engine, request.max_rows)
+
+        return await run_in_threadpool(tick)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Monitor {monitor_id} not found")
+    except HTTPException as e:
+        raise e
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[ERROR] Monitor tick failed: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Monitor tick failed: {str(e)}")
+
+
+@api.get("/llm-metrics")
+async def get_llm_metrics():
+    """
+    LLM scheduler queue depths per priority, in-flight calls and remaining budget per API key,
+    plus circuit breaker states and the effect of hedging on p99 latency
+    """
+    return {**get_llm_scheduler().metrics(), "resilience": get_llm_gateway().metrics()}
+
+@api.get("/result-cache")
+async def get_result_cache_metrics():
+    """Query result cache size and hit/miss/stale/eviction counters"""
+    return result_cache.metrics()
+
+@api.get("/cost-guard")
+async def get_cost_guard_metrics():
+    """Queries checked by the SQL cost guard, with rewrite/reject counters and cached plans"""
+    return cost_guard.metrics()
+
+@api.get("/model-routes")
+async def get_model_routes():
+    """Model tier per pipeline stage, with per-stage model choice, latency percentiles, SLO misses and escalations"""
+    return get_model_router().metrics()
+
 @api.get("/rag-status")
 async def get_rag_status():
     """Get RAG service status and statistics (for debugging/monitoring)"""
@@ -552,6 +950,9 @@ if not all([TWILIO_NUMBER, ACCOUNT_SID, AUTH_TOKEN]):
     print("Please set TWILLIO_NUMBER, ACCOUNT_SID, and AUTH_TOKEN in your .env file")
 
 CHAT_API_URL  = "http://localhost:1111/chat"   
+# Twilio gives up after 30 s; the answer must be back before that
+WHATSAPP_TIMEOUT_SECONDS = 30
+WHATSAPP_DEADLINE_SECONDS = 25
 
 @api.post("/whatsapp")
 async def whatsapp_webhook(From: str = Form(...), Body: str = Form(...)):
@@ -580,7 +981,8 @@ async def whatsapp_webhook(From: str = Form(...), Body: str = Form(...)):
         return Response(content=str(resp), media_type="application/xml")
 
     try:
-        r = requests.post(CHAT_API_URL, json=payload, timeout=30)
+        r = requests.post(CHAT_API_URL, json=payload, timeout=WHATSAPP_TIMEOUT_SECONDS,
+                          headers={"X-Deadline-Seconds": str(WHATSAPP_DEADLINE_SECONDS)})
         r.raise_for_status()
         result = r.json()
     except Exception as e:
@@ -589,7 +991,8 @@ async def whatsapp_webhook(From: str = Form(...), Body: str = Form(...)):
 
     # format and send back
     sql      = result.get("sql_query", "<none>")
-    summary  = result.get("summary", "<none>")
+    # Answers cut short by the deadline come without a summary
+    summary  = result.get("summary") or "<none>"
     title    = result.get("title", "")
     rows     = result.get("sql_result")
     # truncate very long results
@@ -0,0 +1,136 @@
+"""
+Rule-Based Fast Path Benchmark
+Measures coverage, precision and latency of utils.semantic_parser on a corpus
+of questions against the sample MySQL databases (mysql/init/01-init.sql).
+
+Usage (from the services directory):
+    python -m benchmarks.fast_path_benchmark [--corpus benchmarks/fast_path_corpus.jsonl]
+                                             [--heldout benchmarks/fast_path_heldout.jsonl] [--verbose]
+
+Each corpus line is {"database", "question", "shape", "sql"}; shape and sql are
+null for questions the fast path should leave to the LLM. The parser's rules are
+tuned against the main corpus; the held-out corpus holds paraphrases of the same
+intents that were never used for tuning, so its coverage and precision are the
+ones to expect on real questions. Keep it out of rule development.
+"""
+
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, List, Any
+
+from utils.schema_cache import SchemaSnapshot
+from utils.semantic_parser import RuleBasedParser, FAST_PATH_MIN_CONFIDENCE
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent
+INIT_SQL = SERVICES_DIR.parent / "mysql" / "init" / "01-init.sql"
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "fast_path_corpus.jsonl"
+DEFAULT_HELDOUT = Path(__file__).resolve().parent / "fast_path_heldout.jsonl"
+
+_CREATE_TABLE = re.compile(r"CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\n\);", re.DOTALL)
+_FOREIGN_KEY = re.compile(r"FOREIGN KEY \((\w+)\) REFERENCES (\w+)\((\w+)\)")
+
+
+def load_sample_snapshots(path: Path = INIT_SQL) -> Dict[str, SchemaSnapshot]:
+    """Schema snapshots of the sample databases, read from their CREATE TABLE statements"""
+    script = path.read_text()
+    # The init script creates the IPL tables in the default database, then switches to sales_db
+    parts = {"ipl": script.split("CREATE DATABASE IF NOT EXISTS sales_db")[0],
+             "sales_db": script.split("CREATE DATABASE IF NOT EXISTS sales_db")[1]}
+    snapshots = {}
+    for name, part in parts.items():
+        tables, foreign_keys, primary_keys = {}, {}, {}
+        for table, body in _CREATE_TABLE.findall(part):
+            tables[table], foreign_keys[table], primary_keys[table] = [], [], []
+            for line in body.splitlines():
+                line = line.split("--")[0].strip().rstrip(",")
+                fk = _FOREIGN_KEY.match(line)
+                if fk:
+                    foreign_keys[table].append({"columns": [fk.group(1)], "referred_table": fk.group(2),
+                                                "referred_columns": [fk.group(3)]})
+                elif line:
+                    column, data_type = line.split()[:2]
+                    tables[table].append({"name": column, "type": data_type.split("(")[0].lower(), "nullable": "NOT NULL" not in line})
+                    if "PRIMARY KEY" in line:
+                        primary_keys[table].append(column)
+        snapshots[name] = SchemaSnapshot(f"mysql://bench@localhost/{name}", "mysql", name, tables, foreign_keys, primary_keys, {})
+    return snapshots
+
+
+def normalize_sql(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql.strip().rstrip(";"))
+
+
+def evaluate(parsers: Dict[str, RuleBasedParser], corpus: List[Dict[str, Any]], min_confidence: float,
+             repeat: int, verbose: bool) -> Dict[str, Any]:
+    """Coverage, precision, false positives and parse latencies of one corpus"""
+    answerable = sum(1 for item in corpus if item["sql"])
+    covered = correct = false_positives = 0
+    latencies = []
+    for item in corpus:
+        rule_parser = parsers[item["database"]]
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parsed = rule_parser.parse(item["question"])
+            latencies.append(time.perf_counter() - start)
+        confident = parsed is not None and parsed.confidence >= min_confidence
+        if confident and item["sql"]:
+            covered += 1
+            correct += normalize_sql(parsed.sql) == normalize_sql(item["sql"])
+            outcome = "OK " if normalize_sql(parsed.sql) == normalize_sql(item["sql"]) else "BAD"
+        elif confident:
+            false_positives += 1
+            outcome = "FP "
+        else:
+            outcome = "LLM" if not item["sql"] else "MISS"
+        if verbose:
+            detail = f"{parsed.confidence:.2f} {parsed.sql}" if parsed else "-"
+            print(f"[{outcome}] {item['question']}\n       {detail}")
+    latencies.sort()
+    return {"questions": len(corpus), "answerable": answerable, "covered": covered, "correct": correct,
+            "false_positives": false_positives, "latencies": latencies}
+
+
+def report(title: str, result: Dict[str, Any], min_confidence: float):
+    latencies = result["latencies"]
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    answerable, covered, correct = result["answerable"], result["covered"], result["correct"]
+    print(f"{title}")
+    print(f"  Questions:        {result['questions']} ({answerable} answerable by the fast path)")
+    print(f"  Coverage:         {covered}/{answerable} ({covered / max(answerable, 1):.0%}) at confidence >= {min_confidence}")
+    print(f"  Precision:        {correct}/{covered} ({correct / max(covered, 1):.0%}) exact SQL matches")
+    print(f"  False positives:  {result['false_positives']}/{result['questions'] - answerable} questions meant for the LLM")
+    print(f"  Latency:          p50 {percentile(0.5):.3f} ms, p99 {percentile(0.99):.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--heldout", type=Path, default=DEFAULT_HELDOUT,
+                        help="Paraphrases never used for tuning the rules")
+    parser.add_argument("--min-confidence", type=float, default=FAST_PATH_MIN_CONFIDENCE)
+    parser.add_argument("--repeat", type=int, default=20, help="Parses per question for latency percentiles")
+    parser.add_argument("--verbose", action="store_true", help="Print every question with its outcome")
+    args = parser.parse_args()
+
+    parsers = {name: RuleBasedParser(snapshot) for name, snapshot in load_sample_snapshots().items()}
+    results = {}
+    for title, path in (("Tuning corpus", args.corpus), ("Held-out paraphrases", args.heldout)):
+        if path is None or not path.exists():
+            continue
+        corpus = [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+        if args.verbose:
+            print(f"--- {title} ({path.name})")
+        results[title] = evaluate(parsers, corpus, args.min_confidence, args.repeat, args.verbose)
+    for title, result in results.items():
+        report(title, result, args.min_confidence)
+    # Misses only cost coverage; wrong SQL or answering a question meant for the LLM is a failure
+    failed = any(r["correct"] != r["covered"] or r["false_positives"] for r in results.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
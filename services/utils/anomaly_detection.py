@@ -1,92 +1,303 @@
-# Add to your FastAPI service
-from sklearn.ensemble import IsolationForest
-import pandas as pd
+"""
+Anomaly Detection Service
+Detects unusual values in query results for fraud detection, outlier analysis, etc.
+1. Robust z-score, IQR and MAD detectors vectorized in NumPy (fast default)
+2. IsolationForest as an opt-in model, fitted in a process pool so it never
+   runs on the request thread
+Fitted models are cached by a fingerprint of the analysed data.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Any, Tuple
+
 import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MIN_ROWS = 10
+DEFAULT_METHOD = "mad"
+DEFAULT_THRESHOLDS = {
+    "zscore": 3.0,    # standard deviations from the mean
+    "iqr": 1.5,       # IQR multiples outside the quartiles
+    "mad": 3.5,       # modified z-score (Iglewicz & Hoaglin)
+}
+DETECTION_METHODS = list(DEFAULT_THRESHOLDS) + ["isolation_forest"]
+MAX_RETURNED_ROWS = 1000
+MAX_VALUES_PER_INSIGHT = 50
+
+
+def zscore_scores(X: np.ndarray) -> np.ndarray:
+    """Absolute z-score of every cell, column-wise (NaNs stay NaN)"""
+    mean = np.nanmean(X, axis=0)
+    std = np.nanstd(X, axis=0)
+    std[std == 0] = np.nan
+    return np.abs(X - mean) / std
+
+
+def iqr_scores(X: np.ndarray) -> np.ndarray:
+    """Distance outside the quartiles in IQR units (0 inside, Tukey fences at 1.5)"""
+    q1, q3 = np.nanpercentile(X, [25, 75], axis=0)
+    iqr = q3 - q1
+    iqr[iqr == 0] = np.nan
+    below = (q1 - X) / iqr
+    above = (X - q3) / iqr
+    return np.maximum(np.maximum(below, above), 0)
+
+
+def mad_scores(X: np.ndarray) -> np.ndarray:
+    """Modified z-score based on the median absolute deviation"""
+    median = np.nanmedian(X, axis=0)
+    mad = np.nanmedian(np.abs(X - median), axis=0)
+    mad[mad == 0] = np.nan
+    return 0.6745 * np.abs(X - median) / mad
+
+
+SCORERS = {
+    "zscore": zscore_scores,
+    "iqr": iqr_scores,
+    "mad": mad_scores,
+}
 
-@api.post("/detect-anomalies")
-async def detect_data_anomalies(request_data: dict):
-    """
-    Automatically detects unusual patterns in data
-    Perfect for fraud detection, outlier analysis, etc.
-    """
+
+def _fit_isolation_forest(X: np.ndarray, contamination: float, random_state: int):
+    """Process pool worker: fit an IsolationForest and label the rows it was fitted on"""
     try:
-        # Get the SQL result data
-        sql_data = request_data.get('sql_result', [])
-        
-        if not sql_data or len(sql_data) < 10:
-            return {"message": "Need at least 10 rows for anomaly detection"}
-        
-        # Convert to DataFrame
-        df = pd.DataFrame(sql_data)
-        
-        # Auto-detect numeric columns for analysis
-        numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-        
-        if len(numeric_cols) == 0:
-            return {"message": "No numeric columns found for analysis"}
-        
-        # Use Isolation Forest for anomaly detection
-        isolation_forest = IsolationForest(contamination=0.1, random_state=42)
-        anomaly_labels = isolation_forest.fit_predict(df[numeric_cols])
-        
-        # Find anomalous rows
-        anomalies = df[anomaly_labels == -1]
-        
-        # Generate insights
+        from sklearn.ensemble import IsolationForest
+    except ImportError:
+        raise ValueError("IsolationForest requires scikit-learn. Install it with: pip install scikit-learn")
+
+    # Column medians stand in for missing values, the forest cannot split on NaN
+    X = np.where(np.isnan(X), np.nanmedian(X, axis=0), X)
+    model = IsolationForest(contamination=contamination, random_state=random_state, n_jobs=1)
+    labels = model.fit_predict(X)
+    return model, labels == -1
+
+
+def fingerprint_matrix(columns: List[str], X: np.ndarray, *params) -> str:
+    """Stable fingerprint of a numeric dataset and the parameters it is analysed with"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((columns, X.shape, params)).encode())
+    digest.update(np.ascontiguousarray(X).tobytes())
+    return digest.hexdigest()
+
+
+class AnomalyDetector:
+    def __init__(self, max_workers: Optional[int] = None, model_cache_size: int = 32):
+        """
+        Args:
+            max_workers: Process pool size for model-based detection
+            model_cache_size: Number of fitted models kept in memory
+        """
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.model_cache_size = model_cache_size
+        self._executor = None
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Process pool for IsolationForest, created on first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _cached_model(self, key: str):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+        return None
+
+    def _cache_model(self, key: str, entry):
+        with self._lock:
+            self._models[key] = entry
+            self._models.move_to_end(key)
+            while len(self._models) > self.model_cache_size:
+                self._models.popitem(last=False)
+
+    def prepare(self, rows: List[Dict[str, Any]], columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, List[str], np.ndarray]:
+        """
+        Build the numeric matrix to analyse.
+
+        Returns:
+            (DataFrame of the rows, analysed column names, float64 matrix of those columns)
+        """
+        df = pd.DataFrame.from_records(rows)
+        if columns:
+            missing = [col for col in columns if col not in df.columns]
+            if missing:
+                raise ValueError(f"Columns not found in result: {', '.join(missing)}")
+            candidates = columns
+        else:
+            candidates = list(df.columns)
+
+        numeric_cols = []
+        for col in candidates:
+            series = df[col]
+            if pd.api.types.is_bool_dtype(series):
+                continue
+            if not pd.api.types.is_numeric_dtype(series):
+                converted = pd.to_numeric(series, errors="coerce")
+                # Only treat text columns as numeric when (almost) all values parse
+                if converted.notna().sum() < max(1, int(series.notna().sum() * 0.9)):
+                    continue
+                df[col] = converted
+            numeric_cols.append(col)
+
+        X = df[numeric_cols].to_numpy(dtype=np.float64, na_value=np.nan) if numeric_cols else np.empty((len(df), 0))
+        return df, numeric_cols, X
+
+    def score(self, X: np.ndarray, method: str, threshold: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run a statistical detector over every column at once.
+
+        Returns:
+            (per-cell scores, per-cell anomaly flags)
+        """
+        scorer = SCORERS[method]
+        threshold = DEFAULT_THRESHOLDS[method] if threshold is None else threshold
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = scorer(X)
+        # NaN scores (missing values, constant columns) compare False and are never flagged
+        return scores, scores > threshold
+
+    def build_report(self, df: pd.DataFrame, columns: List[str], X: np.ndarray, row_flags: np.ndarray,
+                     cell_flags: Optional[np.ndarray], method: str, max_rows: int) -> Dict[str, Any]:
+        """Summarize flagged rows into the response returned by /detect-anomalies"""
+        total = len(df)
+        anomaly_count = int(row_flags.sum())
         insights = []
-        for col in numeric_cols:
-            col_anomalies = anomalies[col]
-            if len(col_anomalies) > 0:
-                insights.append({
-                    "column": col,
-                    "anomaly_count": len(col_anomalies),
-                    "normal_mean": float(df[col].mean()),
-                    "anomaly_values": col_anomalies.tolist(),
-                    "severity": "HIGH" if len(col_anomalies) > len(df) * 0.05 else "MEDIUM"
-                })
-        
-        # AI-generated explanation
-        explanation = generate_anomaly_explanation(insights, df)
-        
+        for i, col in enumerate(columns):
+            col_flags = cell_flags[:, i] if cell_flags is not None else row_flags
+            col_count = int(col_flags.sum())
+            if col_count == 0:
+                continue
+            values = X[col_flags, i]
+            normal = X[~col_flags, i]
+            insights.append({
+                "column": col,
+                "anomaly_count": col_count,
+                "normal_mean": float(np.nanmean(normal)) if np.isfinite(normal).any() else None,
+                "anomaly_values": [None if np.isnan(v) else float(v) for v in values[:MAX_VALUES_PER_INSIGHT]],
+                "severity": "HIGH" if col_count > total * 0.05 else "MEDIUM"
+            })
+
+        flagged = df[row_flags].head(max_rows)
+        anomalous_rows = flagged.astype(object).where(flagged.notna(), None).to_dict('records')
         return {
-            "anomalies_detected": len(anomalies),
-            "total_rows": len(df),
-            "anomaly_percentage": round((len(anomalies) / len(df)) * 100, 2),
+            "method": method,
+            "columns_analyzed": columns,
+            "anomalies_detected": anomaly_count,
+            "total_rows": total,
+            "anomaly_percentage": round((anomaly_count / total) * 100, 2) if total else 0.0,
             "insights": insights,
-            "explanation": explanation,
-            "anomalous_rows": anomalies.to_dict('records'),
+            "explanation": generate_anomaly_explanation(insights, df),
+            "anomalous_rows": anomalous_rows,
+            "rows_truncated": anomaly_count > len(anomalous_rows),
             "recommendations": generate_anomaly_recommendations(insights)
         }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Anomaly detection failed: {str(e)}")
+
+    def detect(self, rows: List[Dict[str, Any]], method: str = DEFAULT_METHOD, columns: Optional[List[str]] = None,
+               threshold: Optional[float] = None, max_rows: int = MAX_RETURNED_ROWS) -> Dict[str, Any]:
+        """Synchronous statistical detection; call from a worker thread for large results"""
+        if method not in SCORERS:
+            raise ValueError(f"Unsupported method: {method}. Choose one of {', '.join(DETECTION_METHODS)}.")
+        if not rows or len(rows) < MIN_ROWS:
+            return {"message": f"Need at least {MIN_ROWS} rows for anomaly detection"}
+
+        df, numeric_cols, X = self.prepare(rows, columns)
+        if not numeric_cols:
+            return {"message": "No numeric columns found for analysis"}
+
+        _, cell_flags = self.score(X, method, threshold)
+        row_flags = cell_flags.any(axis=1)
+        return self.build_report(df, numeric_cols, X, row_flags, cell_flags, method, max_rows)
+
+    async def detect_async(self, rows: List[Dict[str, Any]], method: str = DEFAULT_METHOD,
+                           columns: Optional[List[str]] = None, threshold: Optional[float] = None,
+                           contamination: float = 0.1, max_rows: int = MAX_RETURNED_ROWS) -> Dict[str, Any]:
+        """
+        Detect anomalies without blocking the event loop.
+        Statistical detectors run in a worker thread, IsolationForest in the process pool.
+        """
+        if method != "isolation_forest":
+            return await asyncio.to_thread(self.detect, rows, method, columns, threshold, max_rows)
+
+        if not rows or len(rows) < MIN_ROWS:
+            return {"message": f"Need at least {MIN_ROWS} rows for anomaly detection"}
+        if not 0 < contamination <= 0.5:
+            raise ValueError("contamination must be in (0, 0.5]")
+
+        df, numeric_cols, X = await asyncio.to_thread(self.prepare, rows, columns)
+        # A column without any value has a NaN median, which would leave NaN in the imputed matrix
+        present = ~np.isnan(X).all(axis=0)
+        if not present.all():
+            numeric_cols = [col for col, keep in zip(numeric_cols, present) if keep]
+            X = X[:, present]
+        if not numeric_cols:
+            return {"message": "No numeric columns found for analysis"}
+
+        key = await asyncio.to_thread(fingerprint_matrix, numeric_cols, X, contamination)
+        cached = self._cached_model(key)
+        if cached is not None:
+            logger.info(f"♻️ Reusing cached IsolationForest model ({key[:12]})")
+            _, row_flags = cached
+        else:
+            loop = asyncio.get_running_loop()
+            model, row_flags = await loop.run_in_executor(self.executor, _fit_isolation_forest, X, contamination, 42)
+            self._cache_model(key, (model, row_flags))
+            logger.info(f"✅ Fitted IsolationForest on {X.shape[0]} rows x {X.shape[1]} columns ({key[:12]})")
+
+        report = await asyncio.to_thread(self.build_report, df, numeric_cols, X, row_flags, None, method, max_rows)
+        report["model_fingerprint"] = key
+        return report
+
 
 def generate_anomaly_explanation(insights, df):
     """Generate human-readable explanation of anomalies"""
     if not insights:
         return "No significant anomalies detected in the data."
-    
+
     explanation = f"🚨 Detected unusual patterns in {len(insights)} columns. "
-    
+
     high_severity = [i for i in insights if i['severity'] == 'HIGH']
     if high_severity:
         explanation += f"High-priority anomalies found in: {', '.join([i['column'] for i in high_severity])}. "
-    
+
     explanation += "This could indicate data quality issues, unusual business events, or potential fraud."
-    
+
     return explanation
 
 def generate_anomaly_recommendations(insights):
     """Generate actionable recommendations"""
     recommendations = []
-    
+
     for insight in insights:
         if insight['severity'] == 'HIGH':
             recommendations.append(f"Investigate {insight['column']} - {insight['anomaly_count']} outliers detected")
         else:
             recommendations.append(f"Monitor {insight['column']} for trends")
-    
+
     recommendations.append("Consider setting up automated alerts for future anomalies")
     recommendations.append("Review data collection processes for these columns")
-    
+
     return recommendations
+
+
+# Singleton instance
+_detector_instance = None
+
+def get_anomaly_detector() -> AnomalyDetector:
+    """Get or create the singleton AnomalyDetector instance"""
+    global _detector_instance
+    if _detector_instance is None:
+        _detector_instance = AnomalyDetector()
+    return _detector_instance
@@ -0,0 +1,431 @@
+"""
+Streaming Anomaly Monitors
+Watches a saved query (e.g. hourly revenue per store) for anomalies without
+rescanning history. Each monitor keeps compact per-series running statistics:
+1. Welford mean/variance
+2. EWMA mean/variance for recent behaviour
+3. P² quantile sketches (Q1/median/Q3) for robust IQR fences
+Every tick fetches only rows newer than the monitor's watermark and scores them
+incrementally, so an evaluation costs O(new rows). A monitor is bound to the
+database it was created on, and its saved query must pass the SQL validator.
+"""
+
+import os
+import json
+import math
+import uuid
+import logging
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import List, Dict, Optional, Any, Tuple
+
+from sqlalchemy import text
+
+from utils.anomaly_detection import DEFAULT_THRESHOLDS
+from utils.deadline import statement_timeout
+from utils.result_cache import engine_identity
+from utils.schema_cache import SchemaSnapshot, database_label
+from utils.sql_validator import get_sql_validator
+
+logger = logging.getLogger(__name__)
+
+MONITOR_DIR = os.getenv("ANOMALY_MONITOR_DIR", "anomaly_monitors")
+DEFAULT_MIN_HISTORY = 30
+DEFAULT_EWMA_ALPHA = 0.1
+MAX_TICK_ROWS = 50000
+SKETCH_QUANTILES = (0.25, 0.5, 0.75)
+
+
+class P2Quantile:
+    """P² streaming quantile estimator (Jain & Chlamtac): five markers, O(1) per update"""
+
+    def __init__(self, p: float, state: Optional[Dict[str, Any]] = None):
+        self.p = p
+        if state:
+            self.q = state["q"]
+            self.n = state["n"]
+            self.count = state["count"]
+        else:
+            self.q = []               # marker heights (the first five observations until warm)
+            self.n = [0, 1, 2, 3, 4]  # marker positions
+            self.count = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"q": self.q, "n": self.n, "count": self.count}
+
+    def update(self, x: float):
+        self.count += 1
+        if self.count <= 5:
+            self.q.append(x)
+            self.q.sort()
+            return
+
+        q, n, p = self.q, self.n, self.p
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+
+        total = self.count - 1
+        desired = [0, total * p / 2, total * p, total * (1 + p) / 2, total]
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, falling back to linear when it leaves the bracket
+                candidate = q[i] + step / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = candidate
+                n[i] += step
+
+    def value(self) -> Optional[float]:
+        if not self.q:
+            return None
+        if self.count <= 5:
+            index = min(int(round(self.p * (len(self.q) - 1))), len(self.q) - 1)
+            return self.q[index]
+        return self.q[2]
+
+
+class SeriesState:
+    """Running statistics for one (series, value column) pair"""
+
+    def __init__(self, alpha: float, state: Optional[Dict[str, Any]] = None):
+        self.alpha = alpha
+        state = state or {}
+        self.count = state.get("count", 0)
+        self.mean = state.get("mean", 0.0)
+        self.m2 = state.get("m2", 0.0)
+        self.ewma = state.get("ewma")
+        self.ewm_var = state.get("ewm_var", 0.0)
+        sketches = state.get("sketches", {})
+        self.sketches = {p: P2Quantile(p, sketches.get(str(p))) for p in SKETCH_QUANTILES}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "ewma": self.ewma,
+            "ewm_var": self.ewm_var,
+            "sketches": {str(p): sketch.to_dict() for p, sketch in self.sketches.items()},
+        }
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count > 1 else 0.0
+
+    def score(self, x: float) -> Dict[str, Optional[float]]:
+        """Score x against the history seen so far (before x is added)"""
+        zscore = (x - self.mean) / self.std if self.std > 0 else None
+        ewm_std = math.sqrt(self.ewm_var)
+        ewma_z = (x - self.ewma) / ewm_std if self.ewma is not None and ewm_std > 0 else None
+        q1, q3 = self.sketches[0.25].value(), self.sketches[0.75].value()
+        iqr_score = None
+        if q1 is not None and q3 is not None and q3 > q1:
+            iqr_score = max((q1 - x) / (q3 - q1), (x - q3) / (q3 - q1), 0.0)
+        return {"zscore": zscore, "ewma_z": ewma_z, "iqr": iqr_score}
+
+    def update(self, x: float):
+        # Welford
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        # EWMA mean/variance
+        if self.ewma is None:
+            self.ewma = x
+        else:
+            diff = x - self.ewma
+            increment = self.alpha * diff
+            self.ewma += increment
+            self.ewm_var = (1 - self.alpha) * (self.ewm_var + diff * increment)
+        for sketch in self.sketches.values():
+            sketch.update(x)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": self.std,
+            "ewma": self.ewma,
+            "q1": self.sketches[0.25].value(),
+            "median": self.sketches[0.5].value(),
+            "q3": self.sketches[0.75].value(),
+        }
+
+
+def _encode_watermark(value: Any) -> Optional[Dict[str, Any]]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return {"type": "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {"type": "date", "value": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"type": "number", "value": float(value)}
+    if isinstance(value, (int, float)):
+        return {"type": "number", "value": value}
+    return {"type": "string", "value": str(value)}
+
+
+def _decode_watermark(encoded: Optional[Dict[str, Any]]) -> Any:
+    if not encoded:
+        return None
+    if encoded["type"] == "datetime":
+        return datetime.fromisoformat(encoded["value"])
+    if encoded["type"] == "date":
+        return date.fromisoformat(encoded["value"])
+    return encoded["value"]
+
+
+def _serialize(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if not isinstance(value, (str, int, float, bool, type(None))):
+        return str(value)
+    return value
+
+
+def _validate_query(sql_query: str, dialect: str, snapshot: Optional[SchemaSnapshot] = None):
+    validation = get_sql_validator().validate(sql_query, dialect, snapshot)
+    if not validation.valid:
+        raise ValueError(validation.feedback())
+
+
+class AnomalyMonitorService:
+    def __init__(self, storage_dir: str = MONITOR_DIR):
+        """Monitors are persisted as one small JSON document each under storage_dir"""
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, monitor_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(monitor_id, threading.Lock())
+
+    def _path(self, monitor_id: str) -> Path:
+        if not monitor_id.replace("-", "").isalnum():
+            raise ValueError(f"Invalid monitor id: {monitor_id}")
+        return self.storage_dir / f"{monitor_id}.json"
+
+    def _save(self, monitor: Dict[str, Any]):
+        path = self._path(monitor["id"])
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(monitor, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def get(self, monitor_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(monitor_id)
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def list(self) -> List[Dict[str, Any]]:
+        monitors = []
+        for path in sorted(self.storage_dir.glob("*.json")):
+            with open(path) as f:
+                monitor = json.load(f)
+            monitor.pop("series", None)
+            monitors.append(monitor)
+        return monitors
+
+    def create(self, database_key: str, sql_query: str, timestamp_column: str, value_columns: List[str],
+               series_columns: Optional[List[str]] = None, method: str = "zscore",
+               threshold: Optional[float] = None, min_history: int = DEFAULT_MIN_HISTORY,
+               ewma_alpha: float = DEFAULT_EWMA_ALPHA, name: Optional[str] = None,
+               snapshot: Optional[SchemaSnapshot] = None) -> Dict[str, Any]:
+        """
+        Register a monitor over a saved query.
+
+        Args:
+            database_key: Schema catalog key of the database the monitor reads; ticks on others are rejected
+            sql_query: Saved SELECT producing the monitored rows
+            timestamp_column: Monotonic column used as the watermark
+            value_columns: Numeric columns to score
+            series_columns: Columns identifying independent series (e.g. store_id)
+            method: 'zscore', 'ewma' or 'iqr'
+            threshold: Score threshold (method default if omitted)
+            min_history: Observations per series before scoring starts
+            ewma_alpha: Smoothing factor for the EWMA statistics
+            snapshot: Schema catalog snapshot of the database, to validate tables and columns too
+        """
+        if method not in ("zscore", "ewma", "iqr"):
+            raise ValueError("method must be one of zscore, ewma, iqr")
+        if not value_columns:
+            raise ValueError("At least one value column is required")
+        if not 0 < ewma_alpha < 1:
+            raise ValueError("ewma_alpha must be in (0, 1)")
+        database = database_label(database_key)
+        _validate_query(sql_query, database.split("://", 1)[0], snapshot)
+
+        default_threshold = DEFAULT_THRESHOLDS["iqr"] if method == "iqr" else DEFAULT_THRESHOLDS["zscore"]
+        monitor = {
+            "id": str(uuid.uuid4()),
+            "name": name or f"Monitor on {', '.join(value_columns)}",
+            "database": database,
+            "sql_query": sql_query.strip().rstrip(";"),
+            "timestamp_column": timestamp_column,
+            "value_columns": value_columns,
+            "series_columns": series_columns or [],
+            "method": method,
+            "threshold": default_threshold if threshold is None else threshold,
+            "min_history": min_history,
+            "ewma_alpha": ewma_alpha,
+            "watermark": None,
+            "created_at": datetime.now().isoformat(),
+            "last_tick_at": None,
+            "rows_processed": 0,
+            "series": {},
+        }
+        self._save(monitor)
+        logger.info(f"✅ Created anomaly monitor {monitor['id']} ({monitor['name']})")
+        return monitor
+
+    def delete(self, monitor_id: str) -> bool:
+        path = self._path(monitor_id)
+        with self._lock(monitor_id):
+            if not path.exists():
+                return False
+            path.unlink()
+        return True
+
+    def _fetch_new_rows(self, engine, monitor: Dict[str, Any], max_rows: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Rows newer than the watermark, ending on a complete timestamp: rows sharing the
+        last timestamp of a full page are left for the next tick, so none are skipped.
+
+        Returns:
+            (rows, whether more rows are waiting)
+        """
+        quote = engine.dialect.identifier_preparer.quote
+        ts = quote(monitor["timestamp_column"])
+        # The newline keeps a trailing line comment from swallowing the closing parenthesis
+        source = f"({monitor['sql_query']}\n) AS monitor_src"
+        watermark = _decode_watermark(monitor["watermark"])
+        where = f"WHERE {ts} > :watermark" if watermark is not None else f"WHERE {ts} IS NOT NULL"
+        sql = f"SELECT * FROM {source} {where} ORDER BY {ts} LIMIT {int(max_rows)}"
+        with engine.connect() as connection, statement_timeout(connection):
+            result = connection.execute(text(sql), {"watermark": watermark} if watermark is not None else {})
+            keys = list(result.keys())
+            rows = [dict(zip(keys, row)) for row in result]
+            if len(rows) < max_rows:
+                return rows, False
+
+            last = rows[-1][monitor["timestamp_column"]]
+            complete = [row for row in rows if row[monitor["timestamp_column"]] != last]
+            if complete:
+                return complete, True
+            # A single timestamp with more rows than a page is read whole
+            result = connection.execute(text(f"SELECT * FROM {source} WHERE {ts} = :last"), {"last": last})
+            keys = list(result.keys())
+            return [dict(zip(keys, row)) for row in result], True
+
+    def tick(self, monitor_id: str, engine, max_rows: int = MAX_TICK_ROWS) -> Dict[str, Any]:
+        """
+        Fetch rows newer than the watermark, score them against the running
+        statistics, fold them into the state and advance the watermark.
+        """
+        if not 0 < max_rows <= MAX_TICK_ROWS:
+            raise ValueError(f"max_rows must be between 1 and {MAX_TICK_ROWS}")
+        with self._lock(monitor_id):
+            monitor = self.get(monitor_id)
+            if monitor is None:
+                raise KeyError(monitor_id)
+            database = database_label(engine_identity(engine)[0])
+            if monitor.get("database") is None:
+                # Monitors saved before databases were recorded are bound by their first tick
+                monitor["database"] = database
+            elif monitor["database"] != database:
+                raise ValueError(f"Monitor {monitor_id} watches {monitor['database']}, not {database}")
+            _validate_query(monitor["sql_query"], engine.dialect.name)
+
+            rows, has_more = self._fetch_new_rows(engine, monitor, max_rows)
+            score_key = {"zscore": "zscore", "ewma": "ewma_z", "iqr": "iqr"}[monitor["method"]]
+            threshold = monitor["threshold"]
+            states: Dict[str, SeriesState] = {}
+            anomalies = []
+
+            for row in rows:
+                series_key = json.dumps([_serialize(row.get(col)) for col in monitor["series_columns"]])
+                for col in monitor["value_columns"]:
+                    value = row.get(col)
+                    if value is None:
+                        continue
+                    value = float(value)
+                    state_key = f"{series_key}|{col}"
+                    state = states.get(state_key)
+                    if state is None:
+                        state = SeriesState(monitor["ewma_alpha"], monitor["series"].get(state_key))
+                        states[state_key] = state
+                    if state.count >= monitor["min_history"]:
+                        scores = state.score(value)
+                        score = scores[score_key]
+                        if score is not None and abs(score) > threshold:
+                            anomalies.append({
+                                "row": {k: _serialize(v) for k, v in row.items()},
+                                "series": json.loads(series_key),
+                                "column": col,
+                                "value": value,
+                                "score": score,
+                                "scores": scores,
+                                "baseline": state.summary(),
+                            })
+                    state.update(value)
+
+            for state_key, state in states.items():
+                monitor["series"][state_key] = state.to_dict()
+            if rows:
+                monitor["watermark"] = _encode_watermark(rows[-1][monitor["timestamp_column"]])
+            monitor["rows_processed"] += len(rows)
+            monitor["last_tick_at"] = datetime.now().isoformat()
+            self._save(monitor)
+
+        logger.info(f"⏱️ Monitor {monitor_id}: {len(rows)} new rows, {len(anomalies)} anomalies")
+        return {
+            "monitor_id": monitor_id,
+            "new_rows": len(rows),
+            "has_more": has_more,
+            "watermark": (monitor["watermark"] or {}).get("value"),
+            "anomalies_detected": len(anomalies),
+            "anomalies": anomalies,
+        }
+
+    def describe(self, monitor_id: str) -> Optional[Dict[str, Any]]:
+        """Monitor definition with a readable summary of every series' statistics"""
+        monitor = self.get(monitor_id)
+        if monitor is None:
+            return None
+        series = monitor.pop("series", {})
+        monitor["series"] = {
+            key: SeriesState(monitor["ewma_alpha"], state).summary() for key, state in series.items()
+        }
+        return monitor
+
+
+# Singleton instance
+_monitor_service = None
+
+def get_anomaly_monitor_service() -> AnomalyMonitorService:
+    """Get or create the singleton AnomalyMonitorService instance"""
+    global _monitor_service
+    if _monitor_service is None:
+        _monitor_service = AnomalyMonitorService()
+    return _monitor_service
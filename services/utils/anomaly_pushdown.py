@@ -0,0 +1,276 @@
+"""
+In-Database Anomaly Scoring
+Generates dialect-specific SQL so PostgreSQL/MySQL compute anomaly scores themselves
+and only the flagged rows plus summary statistics cross the network:
+1. Window-function z-scores (AVG/STDDEV_POP OVER, optionally per group)
+2. IQR fences from percentile_cont (PostgreSQL) or PERCENT_RANK (MySQL 8)
+3. Per-group baselines via PARTITION BY / GROUP BY on the requested columns
+A sql_query source must pass the local SQL validator (one read-only SELECT),
+and the scoring statements run under the request's statement timeout.
+"""
+
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import List, Dict, Optional, Any
+
+from sqlalchemy import text
+
+from utils.anomaly_detection import DEFAULT_THRESHOLDS, MAX_RETURNED_ROWS, generate_anomaly_explanation, generate_anomaly_recommendations
+from utils.deadline import statement_timeout
+from utils.sql_validator import get_sql_validator
+
+logger = logging.getLogger(__name__)
+
+PUSHDOWN_METHODS = ["zscore", "iqr"]
+MAX_BASELINE_GROUPS = 100
+
+
+def _serialize(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if not isinstance(value, (str, int, float, bool, type(None))):
+        return str(value)
+    return value
+
+
+def _flagged(method: str, score: Any, threshold: float) -> bool:
+    """Whether a column's score flags it, the same test as build_flagged_query"""
+    if score is None:
+        return False
+    score = float(score)
+    return (abs(score) if method == "zscore" else score) > threshold
+
+
+class AnomalyPushdown:
+    def __init__(self, engine, dbtype: str):
+        """
+        Args:
+            engine: SQLAlchemy engine for the target database
+            dbtype: 'postgresql' or 'mysql'
+        """
+        if dbtype not in ("postgresql", "mysql"):
+            raise ValueError(f"In-database anomaly scoring is only supported for PostgreSQL and MySQL, not {dbtype}")
+        self.engine = engine
+        self.dbtype = dbtype
+        self.quote = engine.dialect.identifier_preparer.quote
+
+    def _source(self, table: Optional[str], sql_query: Optional[str]) -> str:
+        """FROM clause for either a (schema-qualified) table or an arbitrary SELECT"""
+        if sql_query:
+            validation = get_sql_validator().validate(sql_query, self.dbtype)
+            if not validation.valid:
+                raise ValueError(validation.feedback())
+            # The newline keeps a trailing line comment from swallowing the closing parenthesis
+            return f"({sql_query.strip().rstrip(';')}\n) AS anomaly_src"
+        if table:
+            return ".".join(self.quote(part) for part in table.split(".")) + " AS anomaly_src"
+        raise ValueError("Either table or sql_query is required for in-database anomaly scoring")
+
+    def _null_safe_equals(self, left: str, right: str) -> str:
+        if self.dbtype == "postgresql":
+            return f"{left} IS NOT DISTINCT FROM {right}"
+        return f"{left} <=> {right}"
+
+    def _zscore_ctes(self, source: str, columns: List[str], group_by: List[str]) -> str:
+        partition = f"PARTITION BY {', '.join(self.quote(g) for g in group_by)}" if group_by else ""
+        scores = ", ".join(
+            f"({self.quote(col)} - AVG({self.quote(col)}) OVER ({partition})) "
+            f"/ NULLIF(STDDEV_POP({self.quote(col)}) OVER ({partition}), 0) AS {self.quote(col + '_score')}"
+            for col in columns
+        )
+        return f"scored AS (SELECT anomaly_src.*, {scores} FROM {source})"
+
+    def _iqr_fence_cte(self, index: int, source: str, column: str, group_by: List[str]) -> str:
+        col = self.quote(column)
+        groups = [self.quote(g) for g in group_by]
+        group_select = "".join(f"{g}, " for g in groups)
+        group_clause = f" GROUP BY {', '.join(groups)}" if groups else ""
+        if self.dbtype == "postgresql":
+            return (
+                f"fences_{index} AS (SELECT {group_select}"
+                f"percentile_cont(0.25) WITHIN GROUP (ORDER BY {col}) AS q1, "
+                f"percentile_cont(0.75) WITHIN GROUP (ORDER BY {col}) AS q3 "
+                f"FROM {source} WHERE {col} IS NOT NULL{group_clause})"
+            )
+        # MySQL has no percentile_cont; PERCENT_RANK gives nearest-rank quartiles
+        partition = f"PARTITION BY {', '.join(groups)} " if groups else ""
+        return (
+            f"ranked_{index} AS (SELECT {group_select}{col} AS v, "
+            f"PERCENT_RANK() OVER ({partition}ORDER BY {col}) AS pr "
+            f"FROM {source} WHERE {col} IS NOT NULL), "
+            f"fences_{index} AS (SELECT {group_select}"
+            f"MIN(CASE WHEN pr >= 0.25 THEN v END) AS q1, "
+            f"MIN(CASE WHEN pr >= 0.75 THEN v END) AS q3 "
+            f"FROM ranked_{index}{group_clause})"
+        )
+
+    def _iqr_ctes(self, source: str, columns: List[str], group_by: List[str]) -> str:
+        ctes = [self._iqr_fence_cte(i, source, col, group_by) for i, col in enumerate(columns)]
+        joins, scores = [], []
+        for i, col in enumerate(columns):
+            fence = f"fences_{i}"
+            if group_by:
+                condition = " AND ".join(
+                    self._null_safe_equals(f"anomaly_src.{self.quote(g)}", f"{fence}.{self.quote(g)}") for g in group_by
+                )
+                joins.append(f"LEFT JOIN {fence} ON {condition}")
+            else:
+                joins.append(f"CROSS JOIN {fence}")
+            value = f"anomaly_src.{self.quote(col)}"
+            iqr = f"NULLIF({fence}.q3 - {fence}.q1, 0)"
+            # Distance outside the quartiles in IQR units, 0 inside (Tukey fences at 1.5)
+            scores.append(
+                f"CASE WHEN {value} < {fence}.q1 THEN ({fence}.q1 - {value}) / {iqr} "
+                f"WHEN {value} > {fence}.q3 THEN ({value} - {fence}.q3) / {iqr} "
+                f"ELSE 0 END AS {self.quote(col + '_score')}"
+            )
+        ctes.append(f"scored AS (SELECT anomaly_src.*, {', '.join(scores)} FROM {source} {' '.join(joins)})")
+        return ", ".join(ctes)
+
+    def build_flagged_query(self, source: str, columns: List[str], group_by: List[str],
+                            method: str, threshold: float, max_rows: int) -> str:
+        """Query returning only flagged rows, with flagged totals computed by window functions"""
+        if method == "zscore":
+            ctes = self._zscore_ctes(source, columns, group_by)
+            score = lambda col: f"ABS({self.quote(col + '_score')})"
+        else:
+            ctes = self._iqr_ctes(source, columns, group_by)
+            score = lambda col: self.quote(col + '_score')
+
+        conditions = [f"{score(col)} > {threshold!r}" for col in columns]
+        flagged_counts = ", ".join(
+            f"SUM(CASE WHEN {cond} THEN 1 ELSE 0 END) OVER () AS {self.quote('flagged__' + col)}"
+            for col, cond in zip(columns, conditions)
+        )
+        order = f"GREATEST({', '.join(f'COALESCE({score(col)}, 0)' for col in columns)})" if len(columns) > 1 else score(columns[0])
+        return (
+            f"WITH {ctes} "
+            f"SELECT scored.*, COUNT(*) OVER () AS flagged__total, {flagged_counts} "
+            f"FROM scored WHERE {' OR '.join(conditions)} "
+            f"ORDER BY {order} DESC LIMIT {int(max_rows)}"
+        )
+
+    def build_summary_query(self, source: str, columns: List[str], group_by: List[str]) -> str:
+        """Baseline statistics per column (and per group when group_by is given)"""
+        groups = [self.quote(g) for g in group_by]
+        stats = ["COUNT(*) AS row_count"]
+        for col in columns:
+            q = self.quote(col)
+            stats.extend([
+                f"AVG({q}) AS {self.quote(col + '__mean')}",
+                f"STDDEV_POP({q}) AS {self.quote(col + '__std')}",
+                f"MIN({q}) AS {self.quote(col + '__min')}",
+                f"MAX({q}) AS {self.quote(col + '__max')}",
+            ])
+        select = ", ".join(groups + stats)
+        if not groups:
+            return f"SELECT {select} FROM {source}"
+        # Only the largest groups are returned, the window totals still cover all of them
+        select += ", SUM(COUNT(*)) OVER () AS total_rows, COUNT(*) OVER () AS group_count"
+        return (
+            f"SELECT {select} FROM {source} GROUP BY {', '.join(groups)} "
+            f"ORDER BY row_count DESC LIMIT {MAX_BASELINE_GROUPS}"
+        )
+
+    def _column_stats(self, row: Dict[str, Any], column: str) -> Dict[str, Any]:
+        return {
+            "mean": _serialize(row.get(f"{column}__mean")),
+            "std": _serialize(row.get(f"{column}__std")),
+            "min": _serialize(row.get(f"{column}__min")),
+            "max": _serialize(row.get(f"{column}__max")),
+        }
+
+    def detect(self, columns: List[str], table: Optional[str] = None, sql_query: Optional[str] = None,
+               group_by: Optional[List[str]] = None, method: str = "zscore", threshold: Optional[float] = None,
+               max_rows: int = MAX_RETURNED_ROWS) -> Dict[str, Any]:
+        """
+        Score anomalies inside the database.
+
+        Args:
+            columns: Numeric columns to score
+            table: Table to scan (schema-qualified allowed), or
+            sql_query: SELECT whose result is scored instead of a table
+            group_by: Columns defining per-group baselines
+            method: 'zscore' or 'iqr'
+            threshold: Score threshold (method default if omitted)
+            max_rows: Maximum number of flagged rows to return
+
+        Returns:
+            The /detect-anomalies report, with only flagged rows fetched from the database
+        """
+        if method not in PUSHDOWN_METHODS:
+            raise ValueError(f"In-database scoring supports {', '.join(PUSHDOWN_METHODS)}, not {method}")
+        if not columns:
+            raise ValueError("At least one numeric column is required for in-database anomaly scoring")
+        group_by = group_by or []
+        threshold = DEFAULT_THRESHOLDS[method] if threshold is None else float(threshold)
+        source = self._source(table, sql_query)
+
+        flagged_sql = self.build_flagged_query(source, columns, group_by, method, threshold, max_rows)
+        summary_sql = self.build_summary_query(source, columns, group_by)
+
+        with self.engine.connect() as connection, statement_timeout(connection):
+            result = connection.execute(text(flagged_sql))
+            keys = list(result.keys())
+            flagged = [dict(zip(keys, row)) for row in result]
+            result = connection.execute(text(summary_sql))
+            keys = list(result.keys())
+            baselines = [dict(zip(keys, row)) for row in result]
+
+        if group_by:
+            total_rows = int(baselines[0]["total_rows"]) if baselines else 0
+        else:
+            total_rows = int(baselines[0]["row_count"]) if baselines else 0
+        anomaly_count = int(flagged[0]["flagged__total"]) if flagged else 0
+        overall = baselines[0] if baselines and not group_by else None
+
+        insights = []
+        for col in columns:
+            col_count = int(flagged[0][f"flagged__{col}"]) if flagged else 0
+            if col_count == 0:
+                continue
+            insights.append({
+                "column": col,
+                "anomaly_count": col_count,
+                "normal_mean": _serialize(overall.get(f"{col}__mean")) if overall else None,
+                "anomaly_values": [_serialize(row[col]) for row in flagged
+                                   if row.get(col) is not None and _flagged(method, row.get(f"{col}_score"), threshold)][:50],
+                "severity": "HIGH" if col_count > total_rows * 0.05 else "MEDIUM"
+            })
+
+        internal = {"flagged__total"} | {f"flagged__{col}" for col in columns}
+        anomalous_rows = [{k: _serialize(v) for k, v in row.items() if k not in internal} for row in flagged]
+
+        summary = {
+            "overall": {col: self._column_stats(overall, col) for col in columns} if overall else None,
+            "groups": [
+                {
+                    "group": {g: _serialize(row[g]) for g in group_by},
+                    "row_count": int(row["row_count"]),
+                    "columns": {col: self._column_stats(row, col) for col in columns},
+                }
+                for row in baselines
+            ] if group_by else None,
+            "group_count": int(baselines[0]["group_count"]) if group_by and baselines else None,
+        }
+
+        logger.info(f"🧮 In-database anomaly scoring ({method}): {anomaly_count} flagged, {len(flagged)} rows transferred")
+        return {
+            "method": method,
+            "mode": "database",
+            "columns_analyzed": columns,
+            "group_by": group_by,
+            "anomalies_detected": anomaly_count,
+            "total_rows": total_rows,
+            "anomaly_percentage": round((anomaly_count / total_rows) * 100, 2) if total_rows else 0.0,
+            "insights": insights,
+            "explanation": generate_anomaly_explanation(insights, None),
+            "anomalous_rows": anomalous_rows,
+            "rows_truncated": anomaly_count > len(anomalous_rows),
+            "summary_statistics": summary,
+            "recommendations": generate_anomaly_recommendations(insights),
+            "generated_sql": flagged_sql
+        }
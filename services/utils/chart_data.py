@@ -0,0 +1,309 @@
+"""
+Chart Data Service
+Reduces query results to render-ready chart data on the server so the client
+never has to plot (or download) more points than a chart can actually show:
+1. LTTB downsampling for line/area charts
+2. 2D binning for scatter/heatmap charts
+3. Top-k plus an "Other" bucket for pie/bar charts
+"""
+
+import logging
+from typing import List, Dict, Optional, Any, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET_POINTS = 500
+MAX_TARGET_POINTS = 5000
+DEFAULT_TOP_K = 10
+OTHER_LABEL = "Other"
+
+SUPPORTED_CHARTS = ["line", "area", "scatter", "heatmap", "pie", "bar"]
+DATE_HINTS = ['date', 'time', 'created', 'updated', 'year', 'month', 'day']
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Args:
+        x: Monotonic x values (float64)
+        y: y values (float64)
+        threshold: Number of points to keep
+
+    Returns:
+        Sorted indices of the points to keep
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket edges for the n - 2 interior points, first and last are always kept
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    # Average point of every bucket, computed at once from prefix sums
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    counts = np.maximum(edges[1:] - edges[:-1], 1)
+    avg_x = (cx[edges[1:]] - cx[edges[:-1]]) / counts
+    avg_y = (cy[edges[1:]] - cy[edges[:-1]]) / counts
+    # The last bucket looks ahead to the final point
+    avg_x = np.append(avg_x, x[-1])
+    avg_y = np.append(avg_y, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        bx = x[start:end]
+        by = y[start:end]
+        # Twice the triangle area for every candidate in the bucket
+        area = np.abs(
+            (x[prev] - avg_x[bucket + 1]) * (by - y[prev])
+            - (x[prev] - bx) * (avg_y[bucket + 1] - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        selected[bucket + 1] = prev
+    return selected
+
+
+def bin_2d(x: np.ndarray, y: np.ndarray, target_points: int) -> Dict[str, np.ndarray]:
+    """
+    Aggregate a point cloud into a grid with at most target_points non-empty cells.
+
+    Returns:
+        Dictionary with x/y cell centers and per-cell counts for non-empty cells
+    """
+    bins = max(int(np.sqrt(target_points)), 1)
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    xi, yi = np.nonzero(counts)
+    return {
+        "x": x_centers[xi],
+        "y": y_centers[yi],
+        "count": counts[xi, yi].astype(np.int64),
+    }
+
+
+def top_k_with_other(labels: np.ndarray, values: np.ndarray, k: int) -> Tuple[List[Any], List[float]]:
+    """
+    Sum values per label, keep the k largest labels and fold the rest into "Other".
+    """
+    codes, uniques = pd.factorize(labels, use_na_sentinel=False)
+    totals = np.bincount(codes, weights=values, minlength=len(uniques))
+    if len(uniques) <= k:
+        order = np.argsort(-totals, kind="stable")
+        return [uniques[i] for i in order], totals[order].tolist()
+
+    top = np.argpartition(-totals, k - 1)[:k]
+    top = top[np.argsort(-totals[top], kind="stable")]
+    other_total = float(totals.sum() - totals[top].sum())
+    return [uniques[i] for i in top] + [OTHER_LABEL], totals[top].tolist() + [other_total]
+
+
+def _numeric_series(series: pd.Series) -> Optional[pd.Series]:
+    """Return the column as float64 if it is (or parses as) numeric, else None"""
+    if pd.api.types.is_bool_dtype(series):
+        return None
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype("float64")
+    converted = pd.to_numeric(series, errors="coerce")
+    if converted.notna().sum() >= max(1, int(series.notna().sum() * 0.9)):
+        return converted.astype("float64")
+    return None
+
+
+def _temporal_series(name: str, series: pd.Series) -> Optional[pd.Series]:
+    """Return the column as datetime64 if its name hints at a date and it parses"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if not any(hint in name.lower() for hint in DATE_HINTS):
+        return None
+    converted = pd.to_datetime(series, errors="coerce")
+    if converted.notna().sum() >= max(1, int(series.notna().sum() * 0.9)):
+        return converted
+    return None
+
+
+def _detect_keys(df: pd.DataFrame, x_key: Optional[str], y_keys: Optional[List[str]]) -> Tuple[Optional[str], List[str]]:
+    """Pick the x column and numeric y columns the same way the client charts do"""
+    numeric_cols = [col for col in df.columns if _numeric_series(df[col]) is not None]
+    if not x_key:
+        non_numeric = [col for col in df.columns if col not in numeric_cols]
+        temporal = [col for col in df.columns if _temporal_series(col, df[col]) is not None]
+        if temporal:
+            x_key = temporal[0]
+        elif non_numeric:
+            x_key = non_numeric[0]
+        elif numeric_cols:
+            x_key = numeric_cols[0]
+    if not y_keys:
+        y_keys = [col for col in numeric_cols if col != x_key]
+    return x_key, y_keys
+
+
+def _to_python(values) -> List[Any]:
+    """Convert numpy/pandas scalars to JSON-serializable Python values"""
+    result = []
+    for value in values:
+        if isinstance(value, (np.integer,)):
+            result.append(int(value))
+        elif isinstance(value, (np.floating,)):
+            result.append(None if np.isnan(value) else float(value))
+        elif isinstance(value, pd.Timestamp):
+            result.append(value.isoformat())
+        elif value is None or (isinstance(value, float) and np.isnan(value)):
+            result.append(None)
+        else:
+            result.append(value)
+    return result
+
+
+def _downsample_series(df: pd.DataFrame, x_key: str, y_keys: List[str], target_points: int) -> Dict[str, Any]:
+    """LTTB for line/area charts, keeping the original rows of the selected points"""
+    temporal = _temporal_series(x_key, df[x_key])
+    numeric_x = _numeric_series(df[x_key]) if temporal is None else None
+
+    if temporal is not None:
+        valid = temporal.notna().to_numpy()
+        order_key = np.where(valid, temporal.to_numpy(dtype="datetime64[ns]").astype(np.int64), 0).astype(np.float64)
+    elif numeric_x is not None:
+        order_key = numeric_x.to_numpy()
+        valid = ~np.isnan(order_key)
+    else:
+        # Categorical x axis: points are plotted in row order
+        order_key = np.arange(len(df), dtype=np.float64)
+        valid = np.ones(len(df), dtype=bool)
+
+    positions = np.nonzero(valid)[0]
+    positions = positions[np.argsort(order_key[positions], kind="stable")]
+    x = order_key[positions]
+
+    keep = set()
+    per_series = max(target_points // max(len(y_keys), 1), 3)
+    for y_key in y_keys:
+        y = _numeric_series(df[y_key]).to_numpy()[positions]
+        y = np.nan_to_num(y, nan=0.0)
+        keep.update(lttb_indices(x, y, per_series).tolist())
+
+    selected = positions[np.sort(np.fromiter(keep, dtype=np.int64, count=len(keep)))]
+    reduced = df.iloc[selected]
+    return {
+        "data": _records(reduced, [x_key] + y_keys),
+        "method": "lttb",
+    }
+
+
+def _bin_points(df: pd.DataFrame, x_key: str, y_key: str, target_points: int) -> Dict[str, Any]:
+    """2D binning for scatter/heatmap charts"""
+    x = _numeric_series(df[x_key]).to_numpy()
+    y = _numeric_series(df[y_key]).to_numpy()
+    mask = ~(np.isnan(x) | np.isnan(y))
+    cells = bin_2d(x[mask], y[mask], target_points)
+    data = [
+        {x_key: cx, y_key: cy, "count": count}
+        for cx, cy, count in zip(
+            _to_python(cells["x"]), _to_python(cells["y"]), _to_python(cells["count"])
+        )
+    ]
+    return {"data": data, "method": "bin_2d"}
+
+
+def _top_k(df: pd.DataFrame, x_key: str, y_key: Optional[str], top_k: int) -> Dict[str, Any]:
+    """Top-k plus "Other" for pie/bar charts; counts rows when there is no measure"""
+    labels = df[x_key].astype(object).where(df[x_key].notna(), None).to_numpy()
+    if y_key:
+        values = np.nan_to_num(_numeric_series(df[y_key]).to_numpy(), nan=0.0)
+    else:
+        y_key = "count"
+        values = np.ones(len(df), dtype=np.float64)
+    names, totals = top_k_with_other(labels, values, top_k)
+    data = [{x_key: name, y_key: total} for name, total in zip(_to_python(names), totals)]
+    return {"data": data, "method": "top_k", "y_keys": [y_key]}
+
+
+def _records(df: pd.DataFrame, columns: List[str]) -> List[Dict[str, Any]]:
+    """Serialize selected columns of a frame as a list of row dictionaries"""
+    columns = [col for col in columns if col in df.columns]
+    converted = {col: _to_python(df[col].tolist()) for col in columns}
+    return [dict(zip(columns, values)) for values in zip(*(converted[col] for col in columns))]
+
+
+def prepare_chart_data(
+    rows: List[Dict[str, Any]],
+    chart_type: str,
+    x_key: Optional[str] = None,
+    y_keys: Optional[List[str]] = None,
+    target_points: int = DEFAULT_TARGET_POINTS,
+    top_k: int = DEFAULT_TOP_K,
+) -> Dict[str, Any]:
+    """
+    Reduce a query result to render-ready data for the given chart type.
+
+    Args:
+        rows: Query result as a list of dictionaries (sql_result)
+        chart_type: One of SUPPORTED_CHARTS
+        x_key: Column for the x axis / category labels (auto-detected if omitted)
+        y_keys: Numeric measure columns (auto-detected if omitted)
+        target_points: Upper bound on the number of points returned
+        top_k: Number of categories kept for pie/bar before folding into "Other"
+
+    Returns:
+        {
+            "data": List[Dict],  # rows in the same shape the chart components expect
+            "x_key": str,
+            "y_keys": List[str],
+            "method": str,       # lttb | bin_2d | top_k | passthrough
+            "original_points": int,
+            "returned_points": int
+        }
+    """
+    chart_type = (chart_type or "").lower()
+    if chart_type not in SUPPORTED_CHARTS:
+        raise ValueError(f"Unsupported chart type: {chart_type}. Choose one of {', '.join(SUPPORTED_CHARTS)}.")
+
+    target_points = min(max(int(target_points), 3), MAX_TARGET_POINTS)
+    df = pd.DataFrame.from_records(rows)
+    x_key, y_keys = _detect_keys(df, x_key, y_keys)
+
+    for key in [x_key] + list(y_keys):
+        if key is not None and key not in df.columns:
+            raise ValueError(f"Column '{key}' not found in result")
+
+    result = {"data": [], "method": "passthrough"}
+    if df.empty or x_key is None:
+        pass
+    elif chart_type in ("line", "area"):
+        if y_keys and len(df) > target_points:
+            result = _downsample_series(df, x_key, y_keys, target_points)
+        else:
+            result = {"data": _records(df, [x_key] + y_keys), "method": "passthrough"}
+    elif chart_type in ("scatter", "heatmap"):
+        y_key = y_keys[0] if y_keys else None
+        if y_key and _numeric_series(df[x_key]) is not None and len(df) > target_points:
+            result = _bin_points(df, x_key, y_key, target_points)
+        elif y_key and _numeric_series(df[x_key]) is None and df[x_key].nunique() > target_points:
+            # Categorical heatmap: too many cells, keep the heaviest ones
+            result = _top_k(df, x_key, y_key, target_points - 1)
+        else:
+            result = {"data": _records(df, [x_key] + y_keys), "method": "passthrough"}
+    else:
+        y_key = y_keys[0] if y_keys else None
+        if df[x_key].nunique(dropna=False) > top_k or df[x_key].duplicated().any():
+            result = _top_k(df, x_key, y_key, min(top_k, target_points - 1))
+        else:
+            result = {"data": _records(df, [x_key] + y_keys), "method": "passthrough"}
+
+    logger.info(f"📉 Chart data ({chart_type}): {len(df)} → {len(result['data'])} points via {result['method']}")
+    return {
+        "data": result["data"],
+        "x_key": x_key,
+        "y_keys": result.get("y_keys", list(y_keys)),
+        "method": result["method"],
+        "original_points": len(df),
+        "returned_points": len(result["data"]),
+    }
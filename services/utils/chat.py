@@ -1,37 +1,114 @@
 from fastapi import HTTPException
-from langchain_groq import ChatGroq
+from utils.llm_gateway import get_llm_gateway
+from utils.model_router import get_model_router
+from utils.deadline import DeadlineExceeded, current_budget, statement_timeout, rule_based_title
 from utils.db import configure_db, extract_sql_query, is_valid_sql
 from utils.rag_service import get_rag_service
+from utils.recommendation_cache import get_recommendation_cache
+from utils.query_templates import get_template_compiler
+from utils.semantic_parser import get_semantic_parser
+from utils.schema_linker import get_schema_linker
+from utils.value_index import get_value_index, format_value_hints
+from langchain_community.utilities import SQLDatabase
+from utils.schema_cache import get_schema_catalog, database_key_from_config
 from langchain_community.agent_toolkits.sql.base import create_sql_agent
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+from utils.sql_toolkit import CachingSQLDatabaseToolkit
+from utils.result_cache import get_result_cache
+from utils.cost_guard import REWRITE, REJECT, get_cost_guard
+from utils.sql_validator import get_sql_validator
 from sqlalchemy import text
 import json
 from dotenv import load_dotenv
 import os
 from langchain_core.callbacks.base import BaseCallbackHandler
-import io
-import sys
-from pydantic import SecretStr
 import re
+import time
 from typing import Dict, Any
 
 load_dotenv()
-groq_api_key_5 = os.getenv("GROQ_API_KEY_1")
+# Any key of the GROQ_API_KEY_* pool can serve chat
+groq_api_keys = get_llm_gateway().key_pool("groq")
 
-# Custom callback handler to capture agent's thought process
-class CaptureStdoutCallbackHandler(BaseCallbackHandler):
+# Databases with more tables than this only expose the linked tables to the agent
+LARGE_SCHEMA_TABLES = 15
+
+# Longest tool input/output kept per trace step
+TRACE_TEXT_LIMIT = 500
+
+# Request budget (seconds) RAG retrieval needs, and what must be left after it for the agent
+RAG_STAGE_SECONDS = 1.0
+GENERATION_RESERVE_SECONDS = 10.0
+# Kept out of the agent's time so the final SQL can still run
+EXECUTION_RESERVE_SECONDS = 3.0
+
+# Callback handler recording the agent's thought process as a per-request structured trace
+class AgentTraceCallbackHandler(BaseCallbackHandler):
     def __init__(self):
-        self.thought_process = io.StringIO()
-        self.stdout_backup = sys.stdout
-        
-    def start_capturing(self):
-        sys.stdout = self.thought_process
-        
-    def stop_capturing(self):
-        sys.stdout = self.stdout_backup
-        
+        self.steps = []
+        self.started_at = time.perf_counter()
+        self._tool_started = {}
+
+    @staticmethod
+    def _truncate(value) -> str:
+        value = str(value).strip()
+        return value if len(value) <= TRACE_TEXT_LIMIT else value[:TRACE_TEXT_LIMIT] + "…"
+
+    def _elapsed_ms(self) -> int:
+        return int((time.perf_counter() - self.started_at) * 1000)
+
+    def on_agent_action(self, action, **kwargs):
+        # The log holds "Thought: ... Action: ... Action Input: ..."; only the thought is new information
+        thought = re.split(r"\n?Action\s*:", action.log or "", maxsplit=1)[0].replace("Thought:", "").strip()
+        self.steps.append({
+            "type": "action",
+            "thought": self._truncate(thought),
+            "tool": action.tool,
+            "input": self._truncate(action.tool_input),
+            "at_ms": self._elapsed_ms(),
+        })
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._tool_started[run_id] = time.perf_counter()
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        started = self._tool_started.pop(run_id, None)
+        self.steps.append({
+            "type": "observation",
+            "output": self._truncate(getattr(output, "content", output)),
+            "duration_ms": int((time.perf_counter() - started) * 1000) if started else None,
+            "at_ms": self._elapsed_ms(),
+        })
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._tool_started.pop(run_id, None)
+        self.steps.append({"type": "error", "output": self._truncate(error), "at_ms": self._elapsed_ms()})
+
+    def on_agent_finish(self, finish, **kwargs):
+        self.steps.append({
+            "type": "finish",
+            "output": self._truncate(finish.return_values.get("output", "")),
+            "at_ms": self._elapsed_ms(),
+        })
+
+    def get_trace(self):
+        return list(self.steps)
+
     def get_output(self):
-        return self.thought_process.getvalue()
+        """Compact text form of the trace (the agent_thought_process string)"""
+        lines = []
+        for step in self.steps:
+            if step["type"] == "action":
+                if step["thought"]:
+                    lines.append(f"Thought: {step['thought']}")
+                lines.append(f"Action: {step['tool']}[{step['input']}]")
+            elif step["type"] == "observation":
+                lines.append(f"Observation: {step['output']}")
+            elif step["type"] == "error":
+                lines.append(f"Tool error: {step['output']}")
+            else:
+                lines.append(f"Final Answer: {step['output']}")
+        return "\n".join(lines)
 
 def extract_sql_from_response(response_text: str) -> str:
     """
@@ -63,9 +140,234 @@ def extract_sql_from_response(response_text: str) -> str:
     # If all else fails, return the text as is (might be the SQL query)
     return response_text.strip()
 
-def process_database_query(db_name, host, user, password, database, query, llm, engine, db, database_config=None):
+def repair_sql(query, sql_query, validation, db_name, db_version, snapshot, linked_schema=None):
+    """
+    One regeneration of SQL the local validator rejected, with its issues as feedback.
+    Returns the corrected SQL, or the original when no valid correction came back in time.
+    """
+    budget = current_budget()
+    if budget is not None and not budget.allows("sql_repair", get_model_router().slo_seconds("sql_repair")):
+        return sql_query
+
+    schema = linked_schema.ddl if linked_schema is not None else get_schema_linker().link_snapshot(snapshot, query).ddl
+    repair_prompt = f"""
+        This {db_version} query was generated for the question below but fails validation.
+
+        Question: {query}
+        SQL Query: {sql_query}
+
+        {validation.feedback()}
+
+        Database schema:
+        {schema}
+
+        Return ONLY the corrected SQL query, without explanations or markdown.
+        """
+    validator = get_sql_validator()
+    try:
+        content = get_model_router().complete(
+            "sql_repair", [{"role": "user", "content": repair_prompt}],
+            validate=lambda text: validator.validate(extract_sql_from_response(text), db_name, snapshot).valid
+        )
+    except DeadlineExceeded:
+        budget.skip("sql_repair")
+        return sql_query
+    except Exception as e:
+        print(f"⚠️ SQL repair failed: {e}")
+        return sql_query
+    repaired = extract_sql_from_response(content)
+    return repaired if validator.validate(repaired, db_name, snapshot).valid else sql_query
+
+def execute_and_summarize(query, sql_query, engine, thought_process, rag_context=None, describe=None, trace=None):
+    """
+    Run the final SQL and build the chat response (summary, title, RAG metadata).
+    describe(rows) -> (title, summary) replaces the LLM summary/title when given.
+    """
+    budget = current_budget()
+    if budget is not None:
+        budget.check("SQL execution")
+
+    # Execute the SQL query with error handling
+    sql_result_list = []
+    result_cache = get_result_cache()
+    cached_rows = None
+    verdict = None
+    # Writes, multiple statements and side-effecting functions never reach the database
+    validation = get_sql_validator().validate(sql_query, engine.dialect.name)
+    try:
+        if not validation.valid:
+            raise ValueError(validation.feedback())
+        with engine.connect() as connection, statement_timeout(connection):
+            # Plans too expensive to run are rejected; unbounded results get a LIMIT
+            verdict = get_cost_guard().check(connection, sql_query)
+            sql_query = verdict.sql
+            if not verdict.rejected:
+                # Rows of the same SQL are reused while the tables it reads are unchanged
+                cached_rows, cache_ticket = result_cache.lookup(engine, connection, sql_query)
+            if verdict.rejected:
+                sql_result_str = f"SQL rejected by cost guard: {verdict.feedback()}"
+            elif cached_rows is not None:
+                sql_result_list = cached_rows
+                sql_result_str = json.dumps(sql_result_list)
+            else:
+                result = connection.execute(text(sql_query))
+                if result.returns_rows:
+                    columns = list(result.keys())
+                    for row in result:
+                        row_dict = {col: value for col, value in zip(columns, row)}
+                        for key, value in row_dict.items():
+                            if not isinstance(value, (str, int, float, bool, type(None))):
+                                row_dict[key] = str(value)
+                        sql_result_list.append(row_dict)
+                    sql_result_str = json.dumps(sql_result_list)
+                    result_cache.store(cache_ticket, columns, sql_result_list)
+                else:
+                    sql_result_str = "Query executed successfully. No rows returned."
+    except Exception as sql_error:
+        # If SQL execution fails, provide error details
+        sql_result_str = f"SQL execution error: {str(sql_error)}"
+        sql_result_list = []
+
+    rejected = verdict is not None and verdict.rejected
+    failed = rejected or "SQL execution error:" in sql_result_str
+    described = describe(sql_result_list) if describe is not None and not failed else None
+
+    # Generate summary with enhanced prompt for better insights
+    if described:
+        summary = described[1]
+    elif sql_result_list and budget is not None and not budget.allows("summary", get_model_router().slo_seconds("sql_summary")):
+        # Out of time: the rows are returned without a summary
+        summary = None
+    elif sql_result_list and len(sql_result_list) > 0:
+        # Successful query with results
+        summary_prompt = f"""
+        Based on the following database query and results, provide a smart, concise summary (2-3 sentences) that highlights the most relevant insights:
+
+        Question: {query}
+        SQL Query: {sql_query}
+        SQL Results: {sql_result_str}
+
+        Focus on:
+        - Key findings and patterns in the data
+        - Notable trends, highest/lowest values, or standout metrics
+        - Actionable insights from the results
+
+        Provide a clear, contextual summary that explains what these results mean in practical terms.
+        """
+        try:
+            summary = get_model_router().complete(
+                "sql_summary", [{"role": "user", "content": summary_prompt}], validate=lambda text: bool(text.strip())
+            )
+        except DeadlineExceeded:
+            budget.skip("summary")
+            summary = None
+    elif rejected:
+        # The plan was too expensive to run: explain why and what to narrow down
+        summary = verdict.feedback()
+    elif "SQL execution error:" in sql_result_str:
+        # SQL execution failed
+        summary = "The query encountered an error during execution. Please check the query syntax and try again."
+    else:
+        # Query executed successfully but returned no results
+        summary = "No matching records were found for your query."
+
+    # Generate title with enhanced prompt
+    if described:
+        title = described[0]
+    elif sql_result_list and budget is not None and not budget.allows("llm_title", get_model_router().slo_seconds("sql_title")):
+        title = rule_based_title(query)
+    elif sql_result_list and len(sql_result_list) > 0:
+        title_prompt = f"""
+        Based on the following question and results, create a brief, descriptive title (5-8 words):
+
+        Question: {query}
+        SQL Results: {sql_result_str}
+
+        Create a concise title that captures the key finding or main topic of the query results.
+        Focus on what was discovered, not just what was asked.
+        """
+        try:
+            title = get_model_router().complete("sql_title", [{"role": "user", "content": title_prompt}])
+        except DeadlineExceeded:
+            budget.skip("llm_title")
+            title = rule_based_title(query)
+    elif rejected:
+        title = "Query Too Expensive"
+    elif "SQL execution error:" in sql_result_str:
+        title = "Query Execution Error"
+    else:
+        title = "No Results Found"
+
+    # Prepare response with RAG metadata (optional, for debugging)
+    response = {
+        "user_query": query,
+        "sql_query": sql_query,
+        "sql_result": sql_result_list if sql_result_list else sql_result_str,
+        "summary": summary,
+        "title": title,
+        "agent_thought_process": thought_process
+    }
+    if trace is not None:
+        response["agent_trace"] = trace
+    if cached_rows is not None:
+        response["cached_result"] = True
+    if not validation.valid:
+        response["validation"] = validation.to_dict()
+    if verdict is not None and verdict.action in (REWRITE, REJECT):
+        response["cost_guard"] = verdict.to_dict()
+    if budget is not None:
+        response["budget"] = budget.report()
+
+    # Add RAG metadata if context was used (optional for debugging)
+    if rag_context:
+        response["rag_metadata"] = {
+            "context_used": True,
+            "relevant_examples": len(rag_context['relevant_queries']),
+            "avg_similarity": rag_context['retrieval_info']['avg_similarity']
+        }
+
+    return response
+
+def process_database_query(db_name, host, user, password, database, query, llm, engine, db, database_config=None,
+                           include_trace=False):
     """Helper function to process database queries for both PostgreSQL and MySQL with RAG enhancement"""
     
+    # Questions with known-good SQL (pre-validated recommendations) skip RAG and the agent
+    precompiled_sql = get_recommendation_cache().lookup_sql(database_config or {}, query)
+    if precompiled_sql:
+        print("⚡ Using pre-validated recommendation SQL")
+        response = execute_and_summarize(query, precompiled_sql, engine,
+                                         "Answered with the pre-validated SQL of a cached recommendation.")
+        # Cached SQL can go bad within its TTL; a failure falls through and is not served again
+        if not str(response["sql_result"]).startswith("SQL execution error:"):
+            return response
+        get_recommendation_cache().discard_sql(database_config, query)
+        print(f"⚠️ Recommendation SQL failed, falling back: {response['sql_result']}")
+
+    # Template questions (see db.generate_natural_language_queries) compile straight to SQL
+    template = get_template_compiler().match(database_config or {}, query)
+    if template is not None:
+        print(f"⚡ Answering template question ({template.kind}) with compiled SQL")
+        response = execute_and_summarize(query, template.sql, engine,
+                                         f"Answered with compiled SQL for the '{template.kind}' question template.",
+                                         describe=template.describe)
+        # Compiled SQL that fails to execute (e.g. a schema change since compilation) falls through like the fast path
+        if not str(response["sql_result"]).startswith("SQL execution error:"):
+            return response
+        print(f"⚠️ Template SQL failed, falling back to the parser and the agent: {response['sql_result']}")
+
+    # Common shapes (top N, counts per group, aggregates, recent rows) parsed without the agent
+    parsed = get_semantic_parser().fast_path(database_config or {}, query)
+    if parsed is not None:
+        print(f"⚡ Rule-based fast path: {parsed.shape} (confidence {parsed.confidence})")
+        response = execute_and_summarize(query, parsed.sql, engine,
+                                         f"Answered by the rule-based parser ({parsed.shape}, confidence {parsed.confidence}).")
+        # A parse that fails to execute falls through to the agent
+        if not str(response["sql_result"]).startswith("SQL execution error:"):
+            response["fast_path"] = parsed.to_dict()
+            return response
+        print(f"⚠️ Rule-based SQL failed, falling back to the agent: {response['sql_result']}")
+
     # Initialize RAG service
     rag_service = get_rag_service()
     
@@ -73,31 +375,58 @@ def process_database_query(db_name, host, user, password, database, query, llm,
     rag_context = None
     enhanced_query = query
     
-    try:
-        rag_context = rag_service.retrieve_relevant_context(query, database_config or {})
-        if rag_context:
-            enhanced_query = rag_service.build_enhanced_prompt(query, rag_context)
-            print(f"✅ RAG: Enhanced query with {len(rag_context['relevant_queries'])} relevant examples")
-        else:
-            print("🔍 RAG: No relevant context found, proceeding without enhancement")
-    except Exception as e:
-        print(f"⚠️ RAG: Context retrieval failed ({e}), proceeding without enhancement")
+    budget = current_budget()
+    if budget is not None and not budget.allows("rag", RAG_STAGE_SECONDS + GENERATION_RESERVE_SECONDS):
+        print(f"⏱️ RAG: Skipped, {budget.remaining():.1f}s of the request budget left")
+    else:
+        try:
+            rag_context = rag_service.retrieve_relevant_context(query, database_config or {})
+            if rag_context:
+                enhanced_query = rag_service.build_enhanced_prompt(query, rag_context)
+                print(f"✅ RAG: Enhanced query with {len(rag_context['relevant_queries'])} relevant examples")
+            else:
+                print("🔍 RAG: No relevant context found, proceeding without enhancement")
+        except Exception as e:
+            print(f"⚠️ RAG: Context retrieval failed ({e}), proceeding without enhancement")
     
-    # Setup to capture agent's thought process
-    capture_handler = CaptureStdoutCallbackHandler()
-    capture_handler.start_capturing()
-   
+    # Per-request trace of the agent's actions and observations (safe with concurrent requests)
+    trace_handler = AgentTraceCallbackHandler()
+
     try:
-        toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+        # Schema linking: the tables (and join paths) this question most likely needs
+        linked_schema = get_schema_linker().link(database_config or {}, query)
+        # Entity linking: literals in the question resolved to the columns holding them
+        value_hints = get_value_index().hints(database_config or {}, query)
+        if value_hints:
+            print(f"🔤 Value index: {len(value_hints)} literal(s) resolved")
+        if linked_schema is not None and linked_schema.pruned and linked_schema.database_tables > LARGE_SCHEMA_TABLES:
+            # On large databases the agent only sees the linked tables (and those holding question literals)
+            include_tables = list(dict.fromkeys(linked_schema.tables + [hint["table"] for hint in value_hints]))
+            db = SQLDatabase(engine, include_tables=include_tables)
+            print(f"🔗 Schema linking: agent restricted to {len(include_tables)} tables")
+
+        # Cataloged databases get list-tables/schema answers from the catalog and memoized checker verdicts
+        database_key = database_key_from_config(database_config or {})
+        if get_schema_catalog().get(database_key) is not None:
+            toolkit = CachingSQLDatabaseToolkit(db=db, llm=llm, database_key=database_key)
+        else:
+            toolkit = SQLDatabaseToolkit(db=db, llm=llm)
         
+        # The agent stops in time for the final SQL to run within the request budget
+        max_execution_time = None
+        if budget is not None:
+            budget.check("SQL generation")
+            max_execution_time = max(1.0, budget.remaining() - EXECUTION_RESERVE_SECONDS)
+
         # Create agent with enhanced error handling
         agent = create_sql_agent(
             llm=llm,
             toolkit=toolkit,
-            verbose=True,
+            verbose=False,
             agent_type="zero-shot-react-description",
             handle_parsing_errors=True,
             max_iterations=10,
+            max_execution_time=max_execution_time,
             early_stopping_method="force",
             return_intermediate_steps=True
         )
@@ -128,10 +457,20 @@ def process_database_query(db_name, host, user, password, database, query, llm,
         - Use appropriate quoting for table/column names if they contain special characters
         - Follow {db_version} date/time function syntax
         """
+        if linked_schema is not None:
+            sql_generation_prompt += f"""
+        Most relevant tables for this question (column types, keys and join paths):
+        {linked_schema.ddl}
+        """
+        if value_hints:
+            sql_generation_prompt += f"""
+        Values mentioned in the question, as stored in the database (use these exact values in filters):
+        {format_value_hints(value_hints)}
+        """
         
         # Run the agent with better error handling
         try:
-            agent_response = agent.invoke({"input": sql_generation_prompt})
+            agent_response = agent.invoke({"input": sql_generation_prompt}, config={"callbacks": [trace_handler]})
             
             # Extract the output from the invoke response
             if isinstance(agent_response, dict):
@@ -150,17 +489,17 @@ def process_database_query(db_name, host, user, password, database, query, llm,
             else:
                 agent_output = str(agent_response)
                 
+        except DeadlineExceeded:
+            raise
         except Exception as agent_error:
             # Fallback to run method without additional arguments
             try:
-                agent_output = agent.run(sql_generation_prompt)
+                agent_output = agent.run(sql_generation_prompt, callbacks=[trace_handler])
             except Exception as run_error:
                 # If both methods fail, provide a more helpful error
                 raise ValueError(f"Agent execution failed: {str(run_error)}. Original error: {str(agent_error)}")
        
-        # Capture output and restore stdout
-        thought_process = capture_handler.get_output()
-        capture_handler.stop_capturing()
+        thought_process = trace_handler.get_output()
         
         # Extract and validate SQL query
         sql_query = extract_sql_from_response(agent_output)
@@ -175,96 +514,22 @@ def process_database_query(db_name, host, user, password, database, query, llm,
             if not is_valid_sql(sql_query):
                 # If still not valid, create a simple query
                 sql_query = f"SELECT * FROM information_schema.tables LIMIT 5"
+
+        # Unknown tables or columns are caught locally; the generator gets one try to fix them
+        snapshot = get_schema_catalog().get(database_key)
+        validation = get_sql_validator().validate(sql_query, db_name, snapshot)
+        if not validation.valid and snapshot is not None:
+            print(f"🧪 SQL validation: {[issue.code for issue in validation.issues]}, asking for a corrected query")
+            sql_query = repair_sql(query, sql_query, validation, db_name, db_version, snapshot, linked_schema)
         
-        # Execute the SQL query with error handling
-        sql_result_list = []
-        try:
-            with engine.connect() as connection:
-                result = connection.execute(text(sql_query))
-                if result.returns_rows:
-                    columns = result.keys()
-                    for row in result:
-                        row_dict = {col: value for col, value in zip(columns, row)}
-                        for key, value in row_dict.items():
-                            if not isinstance(value, (str, int, float, bool, type(None))):
-                                row_dict[key] = str(value)
-                        sql_result_list.append(row_dict)
-                    sql_result_str = json.dumps(sql_result_list)
-                else:
-                    sql_result_str = "Query executed successfully. No rows returned."
-        except Exception as sql_error:
-            # If SQL execution fails, provide error details
-            sql_result_str = f"SQL execution error: {str(sql_error)}"
-            sql_result_list = []
-        
-        # Generate summary with enhanced prompt for better insights
-        if sql_result_list and len(sql_result_list) > 0:
-            # Successful query with results
-            summary_prompt = f"""
-            Based on the following database query and results, provide a smart, concise summary (2-3 sentences) that highlights the most relevant insights:
-            
-            Question: {query}
-            SQL Query: {sql_query}
-            SQL Results: {sql_result_str}
-            
-            Focus on:
-            - Key findings and patterns in the data
-            - Notable trends, highest/lowest values, or standout metrics
-            - Actionable insights from the results
-            
-            Provide a clear, contextual summary that explains what these results mean in practical terms.
-            """
-            summary = llm.invoke(summary_prompt).content
-        elif "SQL execution error:" in sql_result_str:
-            # SQL execution failed
-            summary = "The query encountered an error during execution. Please check the query syntax and try again."
-        else:
-            # Query executed successfully but returned no results
-            summary = "No matching records were found for your query."
-        
-        # Generate title with enhanced prompt
-        if sql_result_list and len(sql_result_list) > 0:
-            title_prompt = f"""
-            Based on the following question and results, create a brief, descriptive title (5-8 words):
-            
-            Question: {query}
-            SQL Results: {sql_result_str}
-            
-            Create a concise title that captures the key finding or main topic of the query results.
-            Focus on what was discovered, not just what was asked.
-            """
-            title = llm.invoke(title_prompt).content
-        elif "SQL execution error:" in sql_result_str:
-            title = "Query Execution Error"
-        else:
-            title = "No Results Found"
-        
-        # Prepare response with RAG metadata (optional, for debugging)
-        response = {
-            "user_query": query,
-            "sql_query": sql_query,
-            "sql_result": sql_result_list if sql_result_list else sql_result_str,
-            "summary": summary,
-            "title": title,
-            "agent_thought_process": thought_process
-        }
-        
-        # Add RAG metadata if context was used (optional for debugging)
-        if rag_context:
-            response["rag_metadata"] = {
-                "context_used": True,
-                "relevant_examples": len(rag_context['relevant_queries']),
-                "avg_similarity": rag_context['retrieval_info']['avg_similarity']
-            }
-        
-        return response
+        return execute_and_summarize(query, sql_query, engine, thought_process, rag_context,
+                                     trace=trace_handler.get_trace() if include_trace else None)
         
     except Exception as e:
-        # Ensure stdout is restored even if an error occurs
-        capture_handler.stop_capturing()
+        print(f"⚠️ Agent failed after {len(trace_handler.steps)} trace steps: {e}")
         raise e
 
-def chat_db(db_name, host, user, password, database, query, database_config=None):
+def chat_db(db_name, host, user, password, database, query, database_config=None, include_trace=False):
     """Main function to handle database chat queries with RAG enhancement"""
     if db_name == "neo4j":
         # Handle Neo4j graph database queries
@@ -273,23 +538,23 @@ def chat_db(db_name, host, user, password, database, query, database_config=None
     elif db_name not in ["postgresql", "mysql"]:
         raise HTTPException(status_code=400, detail=f"Unsupported database type: {db_name}")
     
-    if not groq_api_key_5:
+    if not groq_api_keys:
         raise HTTPException(status_code=500, detail="GROQ API key not found in environment variables")
     
     try:
-        # Initialize LLM
-        llm_api_key = groq_api_key_5 if groq_api_key_5 is not None else ""
-        llm = ChatGroq(
-            api_key=SecretStr(llm_api_key),
-            model="llama-3.3-70b-versatile",  # Start with smaller model
-            streaming=False,
+        # LangChain chat model for the agent, on the tier routed to SQL generation
+        llm = get_model_router().chat_model(
+            "sql_generation",
             temperature=0.1  # Lower temperature for more deterministic SQL generation
         )
         
         db, engine = configure_db(db_name, host, user, password, database)
         
-        return process_database_query(db_name, host, user, password, database, query, llm, engine, db, database_config)
+        return process_database_query(db_name, host, user, password, database, query, llm, engine, db, database_config,
+                                      include_trace)
         
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -0,0 +1,347 @@
+"""
+Column Statistics Catalog
+Keeps per-column statistics of every connected database in memory, next to the
+schema catalog, so features can read them instead of scanning live data:
+1. Row counts come from the planner's own estimates (pg_class.reltuples on
+   PostgreSQL, information_schema.tables on MySQL)
+2. Null fractions, n-distinct, min/max and histograms come from pg_stats on
+   PostgreSQL; on MySQL from stored histograms (information_schema.column_statistics)
+   where present, otherwise from bounded sampled queries
+3. Statistics are collected in the background after every schema build and
+   re-collected on a schedule
+"""
+
+import csv
+import json
+import time
+import logging
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional, Any
+
+from sqlalchemy import text
+
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, is_numeric_type, is_temporal_type
+
+logger = logging.getLogger(__name__)
+
+STATS_REFRESH_SECONDS = 1800
+STATS_SAMPLE_ROWS = 100000
+HISTOGRAM_BUCKETS = 10
+MAX_SAMPLED_COLUMNS = 60
+
+ROW_COUNT_QUERY = {
+    "postgresql": """
+        SELECT c.relname, c.reltuples
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+    """,
+    "mysql": """
+        SELECT TABLE_NAME, TABLE_ROWS
+        FROM information_schema.tables
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+    """,
+}
+
+PG_STATS_QUERY = """
+    SELECT tablename, attname, null_frac, n_distinct, most_common_vals::text, histogram_bounds::text
+    FROM pg_stats
+    WHERE schemaname = current_schema()
+"""
+
+MYSQL_HISTOGRAM_QUERY = """
+    SELECT TABLE_NAME, COLUMN_NAME, HISTOGRAM
+    FROM information_schema.column_statistics
+    WHERE SCHEMA_NAME = DATABASE()
+"""
+
+
+def parse_pg_array(value: Optional[str]) -> List[str]:
+    """'{a,"b c",d}' (text output of an anyarray) to a list of strings"""
+    if not value or len(value) < 2:
+        return []
+    return next(csv.reader([value[1:-1]], quotechar='"', escapechar="\\"), [])
+
+
+def _coerce(value: Any, type_name: str) -> Any:
+    """Bring a text-typed statistic back to the column's Python type"""
+    if value is None or not isinstance(value, str):
+        return value
+    try:
+        if is_numeric_type(type_name):
+            return float(value)
+        if is_temporal_type(type_name) and "-" in value:
+            return datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    return value
+
+
+def _serialize(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if not isinstance(value, (str, int, float, bool, type(None))):
+        return str(value)
+    return value
+
+
+class StatisticsSnapshot:
+    def __init__(self, key: str, fingerprint: str, tables: Dict[str, Dict[str, Any]]):
+        self.key = key
+        self.fingerprint = fingerprint
+        # table -> {"row_count", "source", "columns": {column -> {"null_frac", "n_distinct", "min", "max", "histogram"}}}
+        self.tables = tables
+        self.collected_at = time.time()
+
+    def table(self, table: str) -> Optional[Dict[str, Any]]:
+        return self.tables.get(table)
+
+    def row_count(self, table: str) -> Optional[int]:
+        return (self.tables.get(table) or {}).get("row_count")
+
+    def column(self, table: str, column: str) -> Optional[Dict[str, Any]]:
+        return (self.tables.get(table) or {}).get("columns", {}).get(column)
+
+    def to_dict(self, table: Optional[str] = None) -> Dict[str, Any]:
+        tables = {table: self.tables[table]} if table else self.tables
+        return {
+            "key": self.key,
+            "fingerprint": self.fingerprint,
+            "collected_at": self.collected_at,
+            "tables": {
+                name: {
+                    "row_count": stats["row_count"],
+                    "source": stats["source"],
+                    "columns": {
+                        column: {
+                            **values,
+                            "min": _serialize(values["min"]),
+                            "max": _serialize(values["max"]),
+                            "histogram": [_serialize(bound) for bound in values["histogram"]],
+                        }
+                        for column, values in stats["columns"].items()
+                    },
+                }
+                for name, stats in tables.items()
+            },
+        }
+
+
+def _column_stats(null_frac=None, n_distinct=None, min_value=None, max_value=None, histogram=None) -> Dict[str, Any]:
+    return {"null_frac": null_frac, "n_distinct": n_distinct, "min": min_value, "max": max_value,
+            "histogram": histogram or []}
+
+
+class StatisticsCatalog:
+    def __init__(self, refresh_interval: int = STATS_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._stats: Dict[str, StatisticsSnapshot] = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="column-stats")
+        self._scheduler: Optional[threading.Thread] = None
+
+    # ---- collection (background) ----
+
+    def _row_counts(self, connection, dbtype: str) -> Dict[str, Optional[int]]:
+        if dbtype not in ROW_COUNT_QUERY:
+            return {}
+        counts = {}
+        for table, rows in connection.execute(text(ROW_COUNT_QUERY[dbtype])):
+            # reltuples is -1 for tables that were never analyzed
+            counts[table] = int(rows) if rows is not None and rows >= 0 else None
+        return counts
+
+    def _postgres_stats(self, connection, snapshot: SchemaSnapshot, row_counts: Dict[str, Optional[int]]) -> Dict[str, Dict[str, Any]]:
+        columns: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        types = {(table, col["name"]): col["type"] for table, cols in snapshot.tables.items() for col in cols}
+        for table, column, null_frac, n_distinct, common, bounds in connection.execute(text(PG_STATS_QUERY)):
+            if (table, column) not in types:
+                continue
+            type_name = types[(table, column)]
+            histogram = [_coerce(v, type_name) for v in parse_pg_array(bounds)]
+            # Histogram bounds exclude the most common values, so both bound min/max
+            candidates = [v for v in histogram + [_coerce(v, type_name) for v in parse_pg_array(common)] if v is not None]
+            ordered = candidates if (is_numeric_type(type_name) or is_temporal_type(type_name)) else []
+            rows = row_counts.get(table)
+            # Negative n_distinct is a fraction of the row count
+            distinct = float(n_distinct) if n_distinct is not None else None
+            if distinct is not None and distinct < 0:
+                distinct = round(-distinct * rows) if rows else None
+            columns.setdefault(table, {})[column] = _column_stats(
+                float(null_frac) if null_frac is not None else None, distinct,
+                min(ordered) if ordered else None, max(ordered) if ordered else None, histogram
+            )
+        return columns
+
+    def _mysql_histograms(self, connection, snapshot: SchemaSnapshot) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        columns: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        types = {(table, col["name"]): col["type"] for table, cols in snapshot.tables.items() for col in cols}
+        try:
+            rows = list(connection.execute(text(MYSQL_HISTOGRAM_QUERY)))
+        except Exception as e:
+            logger.debug(f"No stored histograms for {snapshot.key}: {e}")
+            return columns
+        for table, column, histogram in rows:
+            type_name = types.get((table, column))
+            if type_name is None or not (is_numeric_type(type_name) or is_temporal_type(type_name)):
+                continue
+            histogram = json.loads(histogram) if isinstance(histogram, str) else histogram
+            buckets = histogram.get("buckets", [])
+            if histogram.get("histogram-type") == "singleton":
+                bounds = [bucket[0] for bucket in buckets]
+            else:
+                bounds = [bucket[0] for bucket in buckets] + [buckets[-1][1]] if buckets else []
+            bounds = [_coerce(str(bound), type_name) for bound in bounds]
+            columns.setdefault(table, {})[column] = _column_stats(
+                histogram.get("null-values"), None, bounds[0] if bounds else None,
+                bounds[-1] if bounds else None, bounds
+            )
+        return columns
+
+    def _sampled_stats(self, connection, quote, table: str, table_columns: List[Dict[str, Any]],
+                       row_count: Optional[int], known: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Null fraction, n-distinct, min/max and equi-depth histograms from a bounded row sample"""
+        table_columns = table_columns[:MAX_SAMPLED_COLUMNS]
+        measures = ["COUNT(*)"]
+        for col in table_columns:
+            q = quote(col["name"])
+            measures += [f"COUNT({q})", f"COUNT(DISTINCT {q})", f"MIN({q})", f"MAX({q})"]
+        column_list = ", ".join(quote(col["name"]) for col in table_columns)
+        row = connection.execute(text(
+            f"SELECT {', '.join(measures)} FROM (SELECT {column_list} FROM {quote(table)} "
+            f"LIMIT {STATS_SAMPLE_ROWS}) AS sampled"
+        )).fetchone()
+        sampled = int(row[0])
+        if row_count is None and sampled < STATS_SAMPLE_ROWS:
+            row_count = sampled
+
+        columns = {}
+        for i, col in enumerate(table_columns):
+            non_null, distinct, min_value, max_value = row[1 + 4 * i: 5 + 4 * i]
+            ordered = is_numeric_type(col["type"]) or is_temporal_type(col["type"])
+            # Mostly-unique columns scale with the table, low-cardinality ones don't
+            if row_count and sampled and sampled < row_count and non_null and distinct / non_null > 0.9:
+                distinct = round(distinct / sampled * row_count)
+            stats = _column_stats(1 - non_null / sampled if sampled else None, int(distinct),
+                                  min_value if ordered else None, max_value if ordered else None)
+            if col["name"] in known:
+                stats["histogram"] = known[col["name"]]["histogram"]
+            elif ordered and non_null:
+                stats["histogram"] = self._sampled_histogram(connection, quote, table, col["name"])
+            columns[col["name"]] = stats
+        return {"row_count": row_count, "source": "sample", "columns": columns}
+
+    def _sampled_histogram(self, connection, quote, table: str, column: str) -> List[Any]:
+        rows = connection.execute(text(
+            f"SELECT bucket, MIN(v), MAX(v) FROM (SELECT v, NTILE({HISTOGRAM_BUCKETS}) OVER (ORDER BY v) AS bucket "
+            f"FROM (SELECT {quote(column)} AS v FROM {quote(table)} LIMIT {STATS_SAMPLE_ROWS}) AS sampled "
+            f"WHERE v IS NOT NULL) AS ranked GROUP BY bucket ORDER BY bucket"
+        )).fetchall()
+        return [rows[0][1]] + [row[2] for row in rows] if rows else []
+
+    def collect(self, snapshot: SchemaSnapshot) -> Optional[StatisticsSnapshot]:
+        """Collect statistics for every table of a schema snapshot"""
+        engine = get_schema_catalog().engine(snapshot.key)
+        if engine is None:
+            return None
+        quote = engine.dialect.identifier_preparer.quote
+        started = time.time()
+        tables: Dict[str, Dict[str, Any]] = {}
+        with engine.connect() as connection:
+            row_counts = self._row_counts(connection, snapshot.dbtype)
+            if snapshot.dbtype == "postgresql":
+                catalog_stats = self._postgres_stats(connection, snapshot, row_counts)
+            elif snapshot.dbtype == "mysql":
+                catalog_stats = self._mysql_histograms(connection, snapshot)
+            else:
+                catalog_stats = {}
+
+            for table, table_columns in snapshot.tables.items():
+                known = catalog_stats.get(table, {})
+                if snapshot.dbtype == "postgresql" and known:
+                    tables[table] = {"row_count": row_counts.get(table), "source": "pg_stats", "columns": known}
+                    continue
+                # MySQL, and PostgreSQL tables that were never analyzed
+                try:
+                    # In a savepoint: one table failing to sample must not abort the transaction for the others
+                    with connection.begin_nested():
+                        tables[table] = self._sampled_stats(connection, quote, table, table_columns,
+                                                            row_counts.get(table), known)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not sample statistics of {table}: {e}")
+                    tables[table] = {"row_count": row_counts.get(table), "source": "catalog", "columns": known}
+
+        stats = StatisticsSnapshot(snapshot.key, snapshot.fingerprint, tables)
+        with self._lock:
+            self._stats[snapshot.key] = stats
+        logger.info(f"📈 Column statistics collected for {snapshot.key}: {len(tables)} tables in {time.time() - started:.1f}s")
+        return stats
+
+    def _collect(self, snapshot: SchemaSnapshot) -> Optional[StatisticsSnapshot]:
+        try:
+            return self.collect(snapshot)
+        except Exception as e:
+            logger.warning(f"⚠️ Column statistics collection failed for {snapshot.key}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(snapshot.key, None)
+
+    def _schedule(self, snapshot: SchemaSnapshot) -> Future:
+        with self._lock:
+            pending = self._pending.get(snapshot.key)
+            if pending is None:
+                pending = self._executor.submit(self._collect, snapshot)
+                self._pending[snapshot.key] = pending
+            return pending
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: (re)collect statistics after every schema build"""
+        self._schedule(snapshot)
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(min(self.refresh_interval, 60))
+            for key, stats in list(self._stats.items()):
+                snapshot = get_schema_catalog().get(key)
+                if snapshot is not None and time.time() - stats.collected_at > self.refresh_interval:
+                    self._schedule(snapshot)
+
+    def start(self):
+        """Start the scheduled background refresh (idempotent)"""
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._refresh_loop, name="column-stats-scheduler", daemon=True)
+                self._scheduler.start()
+
+    # ---- reads (request path) ----
+
+    def get(self, key: str) -> Optional[StatisticsSnapshot]:
+        """Statistics of a database from memory, None while the first collection is running"""
+        return self._stats.get(key)
+
+    def wait(self, snapshot: SchemaSnapshot) -> Optional[StatisticsSnapshot]:
+        """Statistics of a database, blocking only when none have been collected yet"""
+        stats = self._stats.get(snapshot.key)
+        if stats is None:
+            stats = self._schedule(snapshot).result()
+        return stats
+
+
+# Global statistics catalog instance
+_statistics_catalog = None
+
+def get_statistics_catalog() -> StatisticsCatalog:
+    """Get or create the global statistics catalog, subscribe it to schema changes and start its schedule"""
+    global _statistics_catalog
+    if _statistics_catalog is None:
+        _statistics_catalog = StatisticsCatalog()
+        get_schema_catalog().add_listener(_statistics_catalog.on_schema_snapshot)
+        _statistics_catalog.start()
+    return _statistics_catalog
@@ -0,0 +1,300 @@
+"""
+Local Completion Engine
+In-memory autocompletion for /search-completions. Each database gets a prefix
+trie over:
+1. Table and column names
+2. SQL keywords
+3. Popular past questions from query history
+4. Categorical values from the column value index
+Every trie node keeps its best candidates pre-ranked by frequency and recency,
+so a lookup costs O(len(prefix)). The LLM is only consulted when local
+candidates are insufficient, asynchronously and debounced per database.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any, Callable, Tuple
+
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, database_key_from_config
+from utils.rag_service import get_rag_service
+from utils.schema_linker import get_schema_linker
+from utils.value_index import get_value_index
+
+logger = logging.getLogger(__name__)
+
+NODE_CANDIDATES = 16
+MAX_QUESTION_PREFIX = 64
+MIN_LOCAL_CANDIDATES = 3
+LLM_DEBOUNCE_SECONDS = 0.3
+LLM_CACHE_SIZE = 512
+HISTORY_TTL_SECONDS = 300
+LLM_SCHEMA_TOKENS = 400
+
+MAX_VALUE_CANDIDATES = 2000
+
+SQL_KEYWORDS = [
+    "SELECT", "FROM", "WHERE", "GROUP BY", "ORDER BY", "HAVING", "LIMIT", "JOIN", "LEFT JOIN",
+    "INNER JOIN", "DISTINCT", "COUNT", "SUM", "AVG", "MIN", "MAX", "BETWEEN", "LIKE", "IN",
+    "NOT", "AND", "OR", "AS", "ASC", "DESC", "CASE", "WHEN", "THEN", "ELSE", "END", "UNION",
+]
+
+QUESTION_STARTERS = [
+    "show me", "how many", "what is the average", "what is the total", "list all",
+    "which", "top 10", "count of", "compare", "trend of",
+]
+
+# Relative weight of each candidate kind before frequency/recency
+KIND_WEIGHTS = {
+    "question": 3.0,
+    "table": 2.0,
+    "column": 1.5,
+    "value": 1.0,
+    "keyword": 0.5,
+}
+
+
+class PrefixTrie:
+    """Character trie whose nodes store the ids of their top-ranked candidates"""
+
+    def __init__(self, max_depth: Optional[int] = None):
+        self.root: Dict[str, Any] = {}
+        self.max_depth = max_depth
+        self.candidates: List[Tuple[str, str, float]] = []  # (text, kind, score)
+
+    def add(self, text_value: str, kind: str, score: float):
+        self.candidates.append((text_value, kind, score))
+
+    def build(self):
+        """Insert all candidates and keep the NODE_CANDIDATES best ids per node"""
+        order = sorted(range(len(self.candidates)), key=lambda i: self.candidates[i][2], reverse=True)
+        for index in order:
+            key = self.candidates[index][0].lower()
+            if self.max_depth:
+                key = key[:self.max_depth]
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+                top = node.setdefault("\0", [])
+                # Candidates arrive best-first, so the first NODE_CANDIDATES are the node's best
+                if len(top) < NODE_CANDIDATES:
+                    top.append(index)
+        return self
+
+    def search(self, prefix: str) -> List[Tuple[str, str, float]]:
+        node = self.root
+        key = prefix.lower()
+        for char in key[:self.max_depth] if self.max_depth else key:
+            node = node.get(char)
+            if node is None:
+                return []
+        matches = [self.candidates[i] for i in node.get("\0", [])]
+        if self.max_depth and len(key) > self.max_depth:
+            matches = [c for c in matches if c[0].lower().startswith(key)]
+        return matches
+
+
+class CompletionIndex:
+    def __init__(self, key: str, fingerprint: Optional[str], tokens: PrefixTrie, questions: PrefixTrie):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.tokens = tokens        # tables, columns, values, keywords (matched against the last word)
+        self.questions = questions  # whole questions (matched against the full term)
+        self.built_at = time.time()
+
+
+def _keyword_trie() -> PrefixTrie:
+    trie = PrefixTrie()
+    for keyword in SQL_KEYWORDS:
+        trie.add(keyword, "keyword", KIND_WEIGHTS["keyword"])
+    return trie
+
+
+class CompletionEngine:
+    def __init__(self):
+        self._indexes: Dict[str, CompletionIndex] = {}
+        self._snapshots: Dict[str, SchemaSnapshot] = {}
+        self._history: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        # database key -> dbtype/host/user/dbname, learned from requests; history is only read for known databases
+        self._identities: Dict[str, Dict[str, Any]] = {}
+        self._llm_cache: "OrderedDict[Tuple[str, str], List[str]]" = OrderedDict()
+        self._llm_pending: Dict[str, Tuple[str, asyncio.Task]] = {}
+        self._lock = threading.Lock()
+        self._default = CompletionIndex("", None, _keyword_trie().build(), self._starter_trie().build())
+
+    @staticmethod
+    def _starter_trie() -> PrefixTrie:
+        trie = PrefixTrie(MAX_QUESTION_PREFIX)
+        for starter in QUESTION_STARTERS:
+            trie.add(starter, "question", 0.5)
+        return trie
+
+    # ---- index building (background) ----
+
+    def _history_for(self, key: str, database_config: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not database_config:
+            # Unscoped history would mix in every other database's questions
+            return []
+        cached = self._history.get(key)
+        if cached and time.time() - cached[0] < HISTORY_TTL_SECONDS:
+            return cached[1]
+        history = get_rag_service().get_popular_queries(database_config, limit=200)
+        self._history[key] = (time.time(), history)
+        return history
+
+    def build(self, snapshot: SchemaSnapshot, database_config: Optional[Dict[str, Any]] = None) -> CompletionIndex:
+        """Build (or rebuild) the tries for one database"""
+        database_config = database_config or self._identities.get(snapshot.key)
+        tokens = _keyword_trie()
+        for table, columns in snapshot.tables.items():
+            tokens.add(table, "table", KIND_WEIGHTS["table"])
+            for col in columns:
+                tokens.add(col["name"], "column", KIND_WEIGHTS["column"])
+
+        values = get_value_index().top_values(snapshot.key, MAX_VALUE_CANDIDATES)
+        max_count = max((count for _, count in values), default=1)
+        for value, count in values:
+            tokens.add(value, "value", KIND_WEIGHTS["value"] * (0.5 + count / max_count))
+
+        questions = self._starter_trie()
+        history = self._history_for(snapshot.key, database_config)
+        top_score = history[0]["score"] if history else 1.0
+        for item in history:
+            # Frequency/recency score from query history, normalized to (0, 1]
+            questions.add(item["query"], "question", KIND_WEIGHTS["question"] * (0.5 + item["score"] / top_score))
+
+        index = CompletionIndex(snapshot.key, snapshot.fingerprint, tokens.build(), questions.build())
+        with self._lock:
+            self._indexes[snapshot.key] = index
+            self._snapshots[snapshot.key] = snapshot
+        logger.info(f"🔤 Completion index built for {snapshot.key}: {len(tokens.candidates)} tokens, {len(questions.candidates)} questions")
+        return index
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener"""
+        self.build(snapshot)
+
+    def on_values_updated(self, key: str):
+        """Value index listener: pick up newly sampled values"""
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            self.build(snapshot)
+
+    def refresh_history(self, key: str, database_config: Dict[str, Any]):
+        """Rebuild the question trie when cached history has expired"""
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            self._history.pop(key, None)
+            self.build(snapshot, database_config)
+
+    # ---- lookups (request path) ----
+
+    def index_for(self, database_config: Optional[Dict[str, Any]]) -> CompletionIndex:
+        if not database_config:
+            return self._default
+        key = database_key_from_config(database_config)
+        self._identities[key] = {field: database_config.get(field) for field in ("dbtype", "host", "user", "dbname")}
+        index = self._indexes.get(key)
+        if index is None:
+            return self._default
+        cached = self._history.get(key)
+        # Indexes built before a request identified the database have no history yet
+        if cached is None or time.time() - cached[0] > HISTORY_TTL_SECONDS:
+            # Mark as fresh immediately so only one refresh is started
+            self._history[key] = (time.time(), cached[1] if cached else [])
+            threading.Thread(target=self.refresh_history, args=(key, self._identities[key]), daemon=True).start()
+        return index
+
+    def complete(self, term: str, limit: int = 10, database_config: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Local completions for a partial term, best first"""
+        index = self.index_for(database_config)
+        stripped = term.lstrip()
+        if not stripped:
+            return []
+
+        scored: Dict[str, float] = {}
+        for text_value, kind, score in index.questions.search(stripped):
+            if text_value.lower() != stripped.lower():
+                scored.setdefault(text_value, score)
+
+        # Complete the last word (and the last two, for multi-word values) against identifiers
+        words = stripped.split(" ")
+        for n_words in (1, 2):
+            if len(words) < n_words or not words[-1]:
+                continue
+            fragment = " ".join(words[-n_words:])
+            head = stripped[: len(stripped) - len(fragment)]
+            for text_value, kind, score in index.tokens.search(fragment):
+                completion = head + text_value
+                if completion.lower() != stripped.lower():
+                    scored.setdefault(completion, score)
+
+        ranked = sorted(scored.items(), key=lambda item: item[1], reverse=True)
+        return [completion for completion, _ in ranked[:limit]]
+
+    # ---- LLM fallback ----
+
+    def cached_llm_completions(self, term: str, database_config: Optional[Dict[str, Any]]) -> List[str]:
+        key = (database_key_from_config(database_config) if database_config else "", term.strip().lower())
+        with self._lock:
+            if key in self._llm_cache:
+                self._llm_cache.move_to_end(key)
+                return self._llm_cache[key]
+        return []
+
+    def schedule_llm_fallback(self, term: str, limit: int, database_config: Optional[Dict[str, Any]],
+                              fetch: Callable[[str, int, Optional[str]], List[str]]) -> bool:
+        """
+        Debounced background LLM lookup. A newer term for the same database
+        cancels a call that is still waiting out the debounce window.
+
+        Returns:
+            True if a call was scheduled
+        """
+        db_key = database_key_from_config(database_config) if database_config else ""
+        normalized = term.strip().lower()
+        if not normalized or self.cached_llm_completions(term, database_config):
+            return False
+
+        pending = self._llm_pending.get(db_key)
+        if pending is not None:
+            pending_term, task = pending
+            if pending_term == normalized and not task.done():
+                return False
+            task.cancel()
+
+        snapshot = self._snapshots.get(db_key)
+        # Only the tables relevant to the typed term go into the prompt
+        schema = get_schema_linker().link_snapshot(snapshot, term, top_k=3, token_budget=LLM_SCHEMA_TOKENS).ddl if snapshot else None
+
+        async def debounced():
+            await asyncio.sleep(LLM_DEBOUNCE_SECONDS)
+            # Past the debounce window the call is no longer cancellable by newer keystrokes
+            self._llm_pending.pop(db_key, None)
+            try:
+                completions = await asyncio.to_thread(fetch, term, limit, schema)
+            except Exception as e:
+                logger.warning(f"⚠️ LLM completion fallback failed for '{term}': {e}")
+                return
+            with self._lock:
+                self._llm_cache[(db_key, normalized)] = completions
+                while len(self._llm_cache) > LLM_CACHE_SIZE:
+                    self._llm_cache.popitem(last=False)
+
+        self._llm_pending[db_key] = (normalized, asyncio.get_running_loop().create_task(debounced()))
+        return True
+
+
+# Global completion engine instance
+_completion_engine = None
+
+def get_completion_engine() -> CompletionEngine:
+    """Get or create the global completion engine and subscribe it to schema changes"""
+    global _completion_engine
+    if _completion_engine is None:
+        _completion_engine = CompletionEngine()
+        get_schema_catalog().add_listener(_completion_engine.on_schema_snapshot)
+        get_value_index().add_listener(_completion_engine.on_values_updated)
+    return _completion_engine
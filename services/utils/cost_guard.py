@@ -0,0 +1,333 @@
+"""
+SQL Cost Guard
+Checks the optimizer's plan of generated SQL before it runs:
+1. EXPLAIN (FORMAT JSON) on PostgreSQL and EXPLAIN FORMAT=JSON on MySQL give the
+   estimated cost, result rows, full table scans and joins without a condition
+2. Plans are compared against per-database thresholds (defaults per dialect,
+   overridable per database key through COST_GUARD_LIMITS)
+3. Unbounded results get a LIMIT and are re-checked; plans still too expensive
+   are rejected with feedback (full scans, cartesian joins, indexed columns to
+   filter on) for the SQL generator
+4. Verdicts are cached by database and SQL fingerprint
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any, Tuple
+
+from sqlalchemy import text
+
+from utils.schema_cache import SchemaSnapshot, database_label, get_schema_catalog
+from utils.column_stats import get_statistics_catalog
+from utils.result_cache import engine_identity
+from utils.sql_toolkit import sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+ALLOW = "allow"
+REWRITE = "rewrite"
+REJECT = "reject"
+UNCHECKED = "unchecked"
+
+DEFAULT_LIMITS = {
+    # Optimizer cost units differ per dialect; both are roughly "rows touched / 10" for scans
+    "postgresql": {"max_cost": 2_000_000, "max_scan_rows": 5_000_000, "max_result_rows": 10_000,
+                   "cartesian_rows": 100_000},
+    "mysql": {"max_cost": 2_000_000, "max_scan_rows": 5_000_000, "max_result_rows": 10_000,
+              "cartesian_rows": 100_000},
+}
+RESULT_ROW_LIMIT = int(os.getenv("COST_GUARD_RESULT_LIMIT", "1000"))
+PLAN_CACHE_SIZE = 2048
+PLAN_CACHE_TTL_SECONDS = 600
+
+TOP_LEVEL_LIMIT = re.compile(r"\blimit\s+\d+(\s*(,|offset)\s*\d+)?\s*;?\s*$", re.IGNORECASE)
+# MySQL plans ignore LIMIT in their cost; a LIMIT without these can stop the scan early
+NEEDS_ALL_ROWS = re.compile(r"\b(order\s+by|group\s+by|distinct|join|union|count|sum|avg|min|max)\b", re.IGNORECASE)
+CONDITION_KEYS = ("Join Filter", "Index Cond", "Recheck Cond", "Hash Cond", "Merge Cond")
+
+
+def load_limits() -> Dict[str, Dict[str, float]]:
+    """Per-database threshold overrides: COST_GUARD_LIMITS='{"<dbtype>://<user>@<host>/<dbname>": {"max_cost": ...}}'"""
+    try:
+        return json.loads(os.getenv("COST_GUARD_LIMITS", "{}"))
+    except ValueError as e:
+        logger.warning(f"⚠️ Ignoring invalid COST_GUARD_LIMITS: {e}")
+        return {}
+
+
+class PlanEstimate:
+    """Dialect-independent facts of one plan"""
+
+    def __init__(self, cost: float, rows: float, scans: List[Tuple[str, float]], cartesian: List[Dict[str, Any]]):
+        self.cost = cost
+        self.rows = rows              # estimated result rows
+        self.scans = scans            # (table, rows) of full table scans
+        self.cartesian = cartesian    # [{"tables", "rows"}] joins without a join condition
+
+
+def _postgres_nodes(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(_postgres_nodes(child))
+    return nodes
+
+
+def _relations(plan: Dict[str, Any]) -> List[str]:
+    return [node["Relation Name"] for node in _postgres_nodes(plan) if "Relation Name" in node]
+
+
+def parse_postgres_plan(document: Any, table_rows) -> PlanEstimate:
+    if isinstance(document, str):
+        document = json.loads(document)
+    root = document[0]["Plan"]
+    scans, cartesian = [], []
+    for node in _postgres_nodes(root):
+        if node.get("Node Type") == "Seq Scan":
+            table = node.get("Relation Name", "")
+            # Plan Rows counts rows after the filter; the scan reads the whole table
+            scans.append((table, table_rows(table) or node.get("Plan Rows", 0)))
+        children = node.get("Plans", [])
+        if node.get("Node Type") == "Nested Loop" and len(children) == 2 and "Join Filter" not in node:
+            inner = _postgres_nodes(children[1])
+            if not any(key in n for n in inner for key in CONDITION_KEYS):
+                cartesian.append({
+                    "tables": _relations(children[0]) + _relations(children[1]),
+                    "rows": children[0].get("Plan Rows", 0) * children[1].get("Plan Rows", 0),
+                })
+    return PlanEstimate(root.get("Total Cost", 0.0), root.get("Plan Rows", 0), scans, cartesian)
+
+
+def _mysql_tables(node: Any, found: List[Tuple[Dict[str, Any], int]], position: int = 0):
+    """Table entries of a MySQL JSON plan with their position in their nested loop"""
+    if isinstance(node, dict):
+        if "table_name" in node:
+            found.append((node, position))
+        for key, value in node.items():
+            if key == "nested_loop" and isinstance(value, list):
+                for i, item in enumerate(value):
+                    _mysql_tables(item, found, i)
+            else:
+                _mysql_tables(value, found, position if key == "table" else 0)
+    elif isinstance(node, list):
+        for item in node:
+            _mysql_tables(item, found)
+
+
+def parse_mysql_plan(document: Any, table_rows) -> PlanEstimate:
+    if isinstance(document, str):
+        document = json.loads(document)
+    block = document.get("query_block", {})
+    cost = float(block.get("cost_info", {}).get("query_cost", 0) or 0)
+    tables: List[Tuple[Dict[str, Any], int]] = []
+    _mysql_tables(block, tables)
+    scans, cartesian = [], []
+    rows = 0.0
+    previous_rows = 1.0
+    for table, position in tables:
+        name = table.get("table_name", "")
+        examined = float(table.get("rows_examined_per_scan", 0) or 0)
+        produced = float(table.get("rows_produced_per_join", 0) or 0)
+        rows = max(rows, produced)
+        if table.get("access_type") == "ALL":
+            scans.append((name, table_rows(name) or examined))
+            # A later table of a join read in full, without any condition attached to it
+            if position > 0 and "attached_condition" not in table:
+                cartesian.append({"tables": [name], "rows": previous_rows * examined})
+        previous_rows = produced or previous_rows
+    return PlanEstimate(cost, rows, scans, cartesian)
+
+
+class CostVerdict:
+    def __init__(self, action: str, sql: str, findings: Optional[List[Dict[str, Any]]] = None,
+                 estimate: Optional[PlanEstimate] = None):
+        self.action = action
+        self.sql = sql                    # SQL to run (with an added LIMIT for REWRITE)
+        self.findings = findings or []
+        self.estimate = estimate
+
+    @property
+    def rejected(self) -> bool:
+        return self.action == REJECT
+
+    def feedback(self) -> str:
+        """Plan problems and suggestions, phrased for the SQL generator and the user"""
+        lines = [finding["message"] for finding in self.findings]
+        return "Query rejected as too expensive: " + " ".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {"action": self.action, "findings": self.findings}
+        if self.estimate is not None:
+            result["estimated_cost"] = round(self.estimate.cost, 1)
+            result["estimated_rows"] = round(self.estimate.rows)
+        return result
+
+
+class CostGuard:
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = limits if limits is not None else load_limits()
+        # (database key, SQL fingerprint) -> (checked at, verdict), least recently used first
+        self._plans: "OrderedDict[Tuple[str, str], Tuple[float, CostVerdict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "cached": 0, "rewritten": 0, "rejected": 0}
+
+    def thresholds(self, database_key: str, dialect: str) -> Dict[str, float]:
+        return {**DEFAULT_LIMITS[dialect], **self.limits.get(database_label(database_key), {})}
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: plans of a database whose schema changed are re-checked"""
+        with self._lock:
+            for cache_key in [k for k in self._plans if k[0] == snapshot.key]:
+                del self._plans[cache_key]
+
+    def _explain(self, connection, sql: str) -> Any:
+        statement = sql.strip().rstrip(";")
+        if connection.dialect.name == "postgresql":
+            # In a savepoint: a failing EXPLAIN must not abort the transaction the query runs in
+            with connection.begin_nested():
+                return connection.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+        return connection.execute(text(f"EXPLAIN FORMAT=JSON {statement}")).scalar()
+
+    def _estimate(self, connection, database_key: str, sql: str) -> PlanEstimate:
+        stats = get_statistics_catalog().get(database_key)
+
+        def table_rows(table: str) -> Optional[float]:
+            return stats.row_count(table) if stats is not None else None
+
+        document = self._explain(connection, sql)
+        if connection.dialect.name == "postgresql":
+            return parse_postgres_plan(document, table_rows)
+        return parse_mysql_plan(document, table_rows)
+
+    @staticmethod
+    def _filter_hint(database_key: str, table: str) -> str:
+        """Indexed columns of a table, as a suggestion for a selective filter"""
+        snapshot = get_schema_catalog().get(database_key)
+        if snapshot is None:
+            return ""
+        columns = list(dict.fromkeys(
+            column for index in snapshot.indexes.get(table, []) for column in index.get("columns") or [] if column
+        ))
+        columns = list(dict.fromkeys(snapshot.primary_keys.get(table, []) + columns))
+        return f" (indexed: {', '.join(columns[:5])})" if columns else ""
+
+    def _findings(self, dialect: str, database_key: str, sql: str, estimate: PlanEstimate,
+                  limits: Dict[str, float]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Plan findings and whether they make the plan too expensive"""
+        findings = []
+        too_costly = estimate.cost > limits["max_cost"]
+        for table, rows in estimate.scans:
+            if rows > limits["max_scan_rows"]:
+                findings.append({
+                    "kind": "full_scan", "table": table, "rows": round(rows),
+                    "message": f"Full scan of {table} (~{round(rows):,} rows); add a selective filter"
+                               f"{self._filter_hint(database_key, table)}.",
+                })
+        for join in estimate.cartesian:
+            if join["rows"] > limits["cartesian_rows"]:
+                findings.append({
+                    "kind": "cartesian_join", "tables": join["tables"], "rows": round(join["rows"]),
+                    "message": f"Join of {', '.join(join['tables'])} has no join condition "
+                               f"(~{round(join['rows']):,} row combinations); join on their key columns.",
+                })
+        if too_costly:
+            findings.append({
+                "kind": "high_cost", "cost": round(estimate.cost),
+                "message": f"Estimated cost {round(estimate.cost):,} exceeds the limit of {round(limits['max_cost']):,}.",
+            })
+        cartesian = any(f["kind"] == "cartesian_join" for f in findings)
+        # MySQL costs ignore LIMIT: a plain limited scan stops early however large the table
+        if dialect == "mysql" and TOP_LEVEL_LIMIT.search(sql) and not NEEDS_ALL_ROWS.search(sql):
+            too_costly = False
+            findings = [f for f in findings if f["kind"] != "full_scan"]
+        return findings, too_costly or cartesian
+
+    def check(self, connection, sql: str) -> CostVerdict:
+        """
+        Verdict on a query's plan, from the plan cache when this SQL was checked before.
+
+        Returns:
+            ALLOW (run as is), REWRITE (run verdict.sql, which has a LIMIT), REJECT
+            (do not run; see feedback()) or UNCHECKED (dialect without a guard, or EXPLAIN failed)
+        """
+        dialect = connection.dialect.name
+        if dialect not in DEFAULT_LIMITS or not re.match(r"^\s*(select|with)\b", sql, re.IGNORECASE):
+            return CostVerdict(UNCHECKED, sql)
+        database_key = engine_identity(connection.engine)[0]
+        cache_key = (database_key, sql_fingerprint(dialect, sql))
+        with self._lock:
+            cached = self._plans.get(cache_key)
+            if cached is not None and time.time() - cached[0] < PLAN_CACHE_TTL_SECONDS:
+                self._plans.move_to_end(cache_key)
+                self.stats["cached"] += 1
+                return cached[1]
+
+        verdict = self._check(connection, database_key, sql)
+        with self._lock:
+            self.stats["checked"] += 1
+            if verdict.action == REWRITE:
+                self.stats["rewritten"] += 1
+            elif verdict.action == REJECT:
+                self.stats["rejected"] += 1
+            if verdict.action != UNCHECKED:
+                self._plans[cache_key] = (time.time(), verdict)
+                while len(self._plans) > PLAN_CACHE_SIZE:
+                    self._plans.popitem(last=False)
+        return verdict
+
+    def _check(self, connection, database_key: str, sql: str) -> CostVerdict:
+        dialect = connection.dialect.name
+        limits = self.thresholds(database_key, dialect)
+        try:
+            estimate = self._estimate(connection, database_key, sql)
+        except Exception as e:
+            # Invalid SQL fails the same way when it runs; the guard does not mask that error
+            logger.debug(f"EXPLAIN failed: {e}")
+            return CostVerdict(UNCHECKED, sql)
+
+        findings, too_expensive = self._findings(dialect, database_key, sql, estimate, limits)
+        unbounded = estimate.rows > limits["max_result_rows"] and not TOP_LEVEL_LIMIT.search(sql)
+        if not too_expensive and not unbounded:
+            return CostVerdict(ALLOW, sql, findings, estimate)
+
+        if not TOP_LEVEL_LIMIT.search(sql):
+            # Capping the result often lets the plan stop early; the capped plan is checked again
+            limited = f"{sql.strip().rstrip(';')} LIMIT {RESULT_ROW_LIMIT}"
+            try:
+                limited_estimate = self._estimate(connection, database_key, limited)
+                limited_findings, still_expensive = self._findings(dialect, database_key, limited, limited_estimate, limits)
+            except Exception as e:
+                logger.debug(f"EXPLAIN of the limited query failed: {e}")
+                limited_estimate, limited_findings, still_expensive = None, findings, True
+            if limited_estimate is not None and not still_expensive:
+                limited_findings.append({
+                    "kind": "limit_added", "limit": RESULT_ROW_LIMIT,
+                    "message": f"About {round(estimate.rows):,} result rows expected; only the first "
+                               f"{RESULT_ROW_LIMIT:,} are returned.",
+                })
+                logger.info(f"✂️ Cost guard added LIMIT {RESULT_ROW_LIMIT} to a query on {database_key}")
+                return CostVerdict(REWRITE, limited, limited_findings, limited_estimate)
+            findings = limited_findings
+
+        logger.warning(f"🛑 Cost guard rejected a query on {database_key}: {[f['kind'] for f in findings]}")
+        return CostVerdict(REJECT, sql, findings, estimate)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"cached_plans": len(self._plans), **self.stats}
+
+
+# Global cost guard instance
+_cost_guard = None
+
+def get_cost_guard() -> CostGuard:
+    """Get or create the global cost guard and subscribe it to schema changes"""
+    global _cost_guard
+    if _cost_guard is None:
+        _cost_guard = CostGuard()
+        get_schema_catalog().add_listener(_cost_guard.on_schema_snapshot)
+    return _cost_guard
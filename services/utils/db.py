@@ -143,6 +143,11 @@ def is_valid_sql(query):
     return any(keyword.upper() in query.upper() for keyword in select_keywords)
 
 
+def normalize_question(question):
+    """Case, whitespace and trailing punctuation insensitive form of a question"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(" ?.!")
+
+
 def generate_natural_language_queries(schema):
     """Generate a list of possible natural language queries based on the schema."""
     queries = []
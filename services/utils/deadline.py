@@ -0,0 +1,126 @@
+"""
+Request Deadlines
+One time budget per chat request, visible to every stage without threading it
+through call signatures:
+1. request_deadline(seconds) opens a RequestBudget in a context variable; RAG
+   retrieval, the agent, SQL execution, LLM calls and enrichment read it with
+   current_budget()
+2. Optional stages ask budget.allows(stage, seconds) before running and are
+   recorded as skipped when the remaining time is too short
+3. Mandatory stages are capped to the remaining time (agent execution time, LLM
+   admission and HTTP timeouts, SQL statement timeouts) and raise
+   DeadlineExceeded once the budget is spent
+"""
+
+import os
+import re
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "60"))
+MAX_DEADLINE_SECONDS = 600.0
+# Statement timeouts below this would only turn slow queries into guaranteed errors
+MIN_STATEMENT_TIMEOUT_MS = 100
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before a mandatory stage finished"""
+
+
+class RequestBudget:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds
+        self.skipped: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def check(self, stage: str):
+        """Raise DeadlineExceeded if a mandatory stage starts with no time left"""
+        if self.expired():
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded before {stage}")
+
+    def allows(self, stage: str, seconds: float) -> bool:
+        """Whether an optional stage needing `seconds` still fits; if not it is recorded as skipped"""
+        if self.remaining() >= seconds:
+            return True
+        self.skip(stage)
+        return False
+
+    def skip(self, stage: str):
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+            logger.info(f"⏱️ Skipping {stage} with {self.remaining():.1f}s of the request budget left")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "deadline_seconds": self.seconds,
+            "elapsed_seconds": round(time.monotonic() - self.started, 3),
+            "skipped_stages": list(self.skipped),
+        }
+
+
+_budget: ContextVar[Optional[RequestBudget]] = ContextVar("request_budget", default=None)
+
+
+def current_budget() -> Optional[RequestBudget]:
+    """Budget of the request being served (None outside request_deadline)"""
+    return _budget.get()
+
+
+def remaining_seconds(default: Optional[float] = None) -> Optional[float]:
+    budget = _budget.get()
+    return budget.remaining() if budget is not None else default
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float] = None):
+    """Open a request budget of `seconds` (CHAT_DEADLINE_SECONDS if omitted) for the enclosed work"""
+    seconds = min(seconds or CHAT_DEADLINE_SECONDS, MAX_DEADLINE_SECONDS)
+    budget = RequestBudget(seconds)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+@contextmanager
+def statement_timeout(connection):
+    """Cap statements on this connection to the remaining request budget (PostgreSQL and MySQL)"""
+    remaining = remaining_seconds()
+    dialect = connection.dialect.name
+    if remaining is None or dialect not in ("postgresql", "mysql"):
+        yield
+        return
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded before SQL execution")
+    timeout_ms = max(MIN_STATEMENT_TIMEOUT_MS, int(remaining * 1000))
+    # Statement text is generated here from an int, never from user input
+    if dialect == "postgresql":
+        # Transaction-scoped: gone when the connection returns to the pool
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+        yield
+        return
+    connection.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {timeout_ms}")
+    try:
+        yield
+    finally:
+        connection.exec_driver_sql("SET SESSION MAX_EXECUTION_TIME = DEFAULT")
+
+
+def rule_based_title(question: str, max_words: int = 8) -> str:
+    """Title from the question itself, for answers without time for an LLM title"""
+    words = re.sub(r"[?!.]+$", "", question.strip()).split()
+    title = " ".join(words[:max_words]) + ("…" if len(words) > max_words else "")
+    return title[:1].upper() + title[1:] if title else "Query Results"
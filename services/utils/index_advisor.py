@@ -0,0 +1,439 @@
+"""
+Index Advisor
+Recommends indexes from what users actually ask, mined from the generated-query history:
+1. Past SQL of a database (QueryMessage sqlQuery and executionTime in MongoDB)
+   is grouped into patterns by its AST with literals removed; each pattern is
+   weighted by its frequency times its average answer time
+2. Filter predicates (equality and range), join keys and GROUP BY / ORDER BY
+   columns of every pattern are resolved to schema tables with sqlglot
+3. Per table a candidate index is built (equality and join columns, then sort
+   or range columns) and dropped when an existing index or the primary key
+   already leads with the same columns
+4. On PostgreSQL with the HypoPG extension each candidate is created as a
+   hypothetical index and the plans of its patterns are re-costed; elsewhere
+   candidates are ranked by history weight alone
+Reports are built in the background and cached per database and schema fingerprint.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional, Any, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.scope import traverse_scope
+from sqlalchemy import text
+
+from utils.rag_service import get_rag_service
+from utils.schema_cache import SchemaSnapshot, database_label, get_schema_catalog
+from utils.column_stats import get_statistics_catalog
+from utils.sql_validator import DIALECTS
+
+logger = logging.getLogger(__name__)
+
+INDEX_ADVISOR_TTL_SECONDS = int(os.getenv("INDEX_ADVISOR_TTL_SECONDS", str(6 * 3600)))
+HISTORY_DAYS = 30
+MAX_PATTERNS = 200
+MAX_INDEX_COLUMNS = 3
+MAX_RECOMMENDATIONS = 20
+# Candidates re-costed with hypothetical indexes, and sample queries re-costed per candidate
+HYPOPG_CANDIDATES = 30
+HYPOPG_SAMPLES = 5
+# Indexes on tables this small rarely beat a sequential scan
+MIN_TABLE_ROWS = 1000
+MIN_IMPROVEMENT = 0.01
+
+RANGE_PREDICATES = (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between)
+
+
+class _ColumnUsage:
+    """Columns of one table a query pattern filters, joins, groups or sorts on (in order of appearance)"""
+
+    def __init__(self):
+        self.equality: List[str] = []
+        self.join: List[str] = []
+        self.range: List[str] = []
+        self.group: List[str] = []
+        self.order: List[str] = []
+
+    def add(self, kind: str, column: str):
+        columns = getattr(self, kind)
+        if column not in columns:
+            columns.append(column)
+
+    def candidate(self) -> List[str]:
+        """Index columns: equality and join keys first, then the sort (or grouping, or one range) columns"""
+        columns = list(dict.fromkeys(self.equality + self.join))
+        tail = self.order or self.group or self.range[:1]
+        columns.extend(column for column in tail if column not in columns)
+        return columns[:MAX_INDEX_COLUMNS]
+
+    def reasons(self) -> List[str]:
+        labels = (("equality", "equality filter"), ("join", "join key"), ("range", "range filter"),
+                  ("group", "GROUP BY"), ("order", "ORDER BY"))
+        return [f"{label} on {', '.join(getattr(self, kind))}" for kind, label in labels if getattr(self, kind)]
+
+
+class _Pattern:
+    def __init__(self, key: str, sql: str):
+        self.key = key                # the SQL with literals as placeholders, safe to show to other users
+        self.sql = sql                # most frequent concrete SQL of the pattern, only for EXPLAIN
+        self.count = 0
+        self.total_ms = 0.0
+        self.top_count = 0
+
+    def add(self, entry: Dict[str, Any]):
+        self.count += entry["count"]
+        self.total_ms += entry["count"] * (entry["avg_execution_ms"] or 0.0)
+        if entry["count"] > self.top_count:
+            self.top_count, self.sql = entry["count"], entry["sql"]
+
+    @property
+    def weight(self) -> float:
+        """Answer time users spent on this pattern (ms)"""
+        return self.total_ms
+
+
+class _Candidate:
+    def __init__(self, table: str, columns: Tuple[str, ...]):
+        self.table = table
+        self.columns = columns
+        self.patterns: List[_Pattern] = []
+        self.reasons: List[str] = []
+        self.cost_before: Optional[float] = None
+        self.cost_after: Optional[float] = None
+
+    def add(self, pattern: _Pattern, usage: _ColumnUsage):
+        if pattern not in self.patterns:
+            self.patterns.append(pattern)
+        self.reasons.extend(reason for reason in usage.reasons() if reason not in self.reasons)
+
+    @property
+    def weight(self) -> float:
+        return sum(pattern.weight for pattern in self.patterns)
+
+    @property
+    def improvement(self) -> Optional[float]:
+        if self.cost_before is None or self.cost_after is None or self.cost_before <= 0:
+            return None
+        return max(0.0, 1 - self.cost_after / self.cost_before)
+
+    @property
+    def score(self) -> float:
+        return self.weight * (self.improvement if self.improvement is not None else 1.0)
+
+
+def _table_lookup(snapshot: SchemaSnapshot) -> Dict[str, str]:
+    return {table.lower(): table for table in snapshot.tables}
+
+
+def column_usage(statement: exp.Expression, snapshot: SchemaSnapshot) -> Dict[str, _ColumnUsage]:
+    """Per schema table, the columns a statement filters, joins, groups and sorts on"""
+    tables = _table_lookup(snapshot)
+    columns = {table: {col["name"].lower(): col["name"] for col in cols} for table, cols in snapshot.tables.items()}
+    usage: Dict[str, _ColumnUsage] = {}
+
+    for scope in traverse_scope(statement):
+        # alias -> schema table, for the tables this scope reads directly
+        sources = {}
+        for alias, source in scope.sources.items():
+            if isinstance(source, exp.Table) and isinstance(source.this, exp.Identifier):
+                table = tables.get(source.name.lower())
+                if table is not None:
+                    sources[alias] = table
+
+        def resolve(node) -> Optional[Tuple[str, str]]:
+            if not isinstance(node, exp.Column) or isinstance(node.this, exp.Star):
+                return None
+            name = node.name.lower()
+            if node.table:
+                table = sources.get(node.table)
+                return (table, columns[table][name]) if table and name in columns[table] else None
+            owners = [table for table in sources.values() if name in columns[table]]
+            return (owners[0], columns[owners[0]][name]) if len(set(owners)) == 1 else None
+
+        def record(kind: str, node):
+            resolved = resolve(node)
+            if resolved is not None:
+                usage.setdefault(resolved[0], _ColumnUsage()).add(kind, resolved[1])
+
+        def predicates(condition: Optional[exp.Expression]):
+            if condition is None:
+                return
+            for predicate in condition.find_all(exp.EQ, exp.In, exp.Is, exp.Like, *RANGE_PREDICATES):
+                if predicate.find_ancestor(exp.Select) is not scope.expression:
+                    continue  # belongs to a subquery, which is its own scope
+                # Predicates under OR (or NOT) can't use a single index range
+                if predicate.find_ancestor(exp.Or, exp.Not, exp.Select) is not scope.expression:
+                    continue
+                left, right = predicate.this, predicate.expression
+                if isinstance(predicate, exp.EQ) and resolve(left) and resolve(right):
+                    if resolve(left)[0] != resolve(right)[0]:
+                        record("join", left)
+                        record("join", right)
+                elif isinstance(predicate, exp.EQ):
+                    record("equality", left if resolve(left) else right)
+                elif isinstance(predicate, (exp.In, exp.Is)):
+                    record("equality", left)
+                elif isinstance(predicate, exp.Like):
+                    # Only a fixed prefix can use a b-tree range
+                    if isinstance(right, exp.Literal) and right.is_string and right.this[:1] not in ("%", "_"):
+                        record("range", left)
+                else:
+                    record("range", left if resolve(left) else right)
+
+        select = scope.expression
+        if not isinstance(select, exp.Select):
+            continue
+        predicates(select.args.get("where"))
+        for join in select.args.get("joins") or []:
+            predicates(join.args.get("on"))
+            joined = join.this
+            for identifier in join.args.get("using") or []:
+                if isinstance(joined, exp.Table):
+                    record("join", exp.column(identifier.name, table=joined.alias_or_name))
+        group = select.args.get("group")
+        if group is not None:
+            for expression in group.expressions:
+                record("group", expression)
+        order = select.args.get("order")
+        if order is not None:
+            for ordered in order.expressions:
+                record("order", ordered.this)
+    return usage
+
+
+def pattern_key(statement: exp.Expression, dialect: str) -> str:
+    """The statement with every literal replaced by a placeholder"""
+    normalized = statement.copy().transform(
+        lambda node: exp.Placeholder() if isinstance(node, exp.Literal) else node
+    )
+    return normalized.sql(dialect=dialect)
+
+
+def _covered(columns: Tuple[str, ...], existing: List[List[str]]) -> bool:
+    """Whether an existing index leads with these columns"""
+    for index_columns in existing:
+        prefix = [column for column in index_columns[:len(columns)] if column]
+        if tuple(prefix) == columns:
+            return True
+    return False
+
+
+class IndexAdvisor:
+    def __init__(self, ttl: int = INDEX_ADVISOR_TTL_SECONDS, history_days: int = HISTORY_DAYS):
+        self.ttl = ttl
+        self.history_days = history_days
+        self._reports: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-advisor")
+
+    # ---- analysis (background) ----
+
+    def _patterns(self, snapshot: SchemaSnapshot, history: List[Dict[str, Any]]) -> List[Tuple[_Pattern, exp.Expression]]:
+        dialect = DIALECTS.get(snapshot.dbtype)
+        patterns: Dict[str, Tuple[_Pattern, exp.Expression]] = {}
+        for entry in history:
+            try:
+                statement = sqlglot.parse_one(entry["sql"], read=dialect)
+            except Exception:
+                continue
+            if not isinstance(statement, (exp.Select, exp.Union, exp.Intersect, exp.Except)):
+                continue
+            key = pattern_key(statement, dialect)
+            if key not in patterns:
+                patterns[key] = (_Pattern(key, entry["sql"]), statement)
+            patterns[key][0].add(entry)
+        ranked = sorted(patterns.values(), key=lambda item: item[0].weight, reverse=True)
+        return ranked[:MAX_PATTERNS]
+
+    def _candidates(self, snapshot: SchemaSnapshot, patterns: List[Tuple[_Pattern, exp.Expression]]) -> List[_Candidate]:
+        stats = get_statistics_catalog().get(snapshot.key)
+        candidates: Dict[Tuple[str, Tuple[str, ...]], _Candidate] = {}
+        for pattern, statement in patterns:
+            for table, usage in column_usage(statement, snapshot).items():
+                columns = tuple(usage.candidate())
+                if not columns:
+                    continue
+                rows = stats.row_count(table) if stats is not None else None
+                if rows is not None and rows < MIN_TABLE_ROWS:
+                    continue
+                existing = [index.get("columns") or [] for index in snapshot.indexes.get(table, [])]
+                existing.append(snapshot.primary_keys.get(table, []))
+                if _covered(columns, existing):
+                    continue
+                # Join lookups an existing index already serves gain little from extra sort columns
+                keys = tuple(dict.fromkeys(usage.join))[:MAX_INDEX_COLUMNS]
+                if not usage.equality and keys and _covered(keys, existing):
+                    continue
+                candidate = candidates.setdefault((table, columns), _Candidate(table, columns))
+                candidate.add(pattern, usage)
+
+        # A candidate leading with another one's columns serves that one's queries too
+        for (table, columns), candidate in list(candidates.items()):
+            wider = [other for (other_table, other_columns), other in candidates.items()
+                     if other_table == table and len(other_columns) > len(columns)
+                     and other_columns[:len(columns)] == columns]
+            if wider:
+                target = max(wider, key=lambda other: other.weight)
+                for pattern in candidate.patterns:
+                    if pattern not in target.patterns:
+                        target.patterns.append(pattern)
+                target.reasons.extend(reason for reason in candidate.reasons if reason not in target.reasons)
+                del candidates[(table, columns)]
+        return sorted(candidates.values(), key=lambda candidate: candidate.weight, reverse=True)
+
+    @staticmethod
+    def _plan_cost(connection, sql: str) -> Optional[float]:
+        try:
+            # In a savepoint: a failing EXPLAIN must not abort the session's transaction
+            with connection.begin_nested():
+                plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}")).scalar()
+        except Exception as e:
+            logger.debug(f"EXPLAIN failed: {e}")
+            return None
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]["Total Cost"]
+
+    def _hypothetical_costs(self, engine, candidates: List[_Candidate], quote) -> bool:
+        """Re-cost each candidate's patterns with it as a HypoPG hypothetical index; False without HypoPG"""
+        with engine.connect() as connection:
+            try:
+                if connection.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")).first() is None:
+                    return False
+            except Exception:
+                return False
+            baseline: Dict[str, Optional[float]] = {}
+            for candidate in candidates[:HYPOPG_CANDIDATES]:
+                samples = sorted(candidate.patterns, key=lambda pattern: pattern.weight, reverse=True)[:HYPOPG_SAMPLES]
+                for pattern in samples:
+                    if pattern.key not in baseline:
+                        baseline[pattern.key] = self._plan_cost(connection, pattern.sql)
+                samples = [pattern for pattern in samples if baseline[pattern.key] is not None]
+                if not samples:
+                    continue
+                statement = f"CREATE INDEX ON {quote(candidate.table)} ({', '.join(quote(c) for c in candidate.columns)})"
+                try:
+                    with connection.begin_nested():
+                        connection.execute(text("SELECT * FROM hypopg_create_index(:statement)"), {"statement": statement})
+                    after = [self._plan_cost(connection, pattern.sql) for pattern in samples]
+                finally:
+                    with connection.begin_nested():
+                        connection.execute(text("SELECT hypopg_reset()"))
+                if any(cost is None for cost in after):
+                    continue
+                # Weighted by how often each pattern runs
+                candidate.cost_before = sum(baseline[p.key] * p.count for p in samples)
+                candidate.cost_after = sum(cost * p.count for cost, p in zip(after, samples))
+        return True
+
+    def analyze(self, snapshot: SchemaSnapshot, database_config: Dict[str, Any]) -> Dict[str, Any]:
+        """Build an index report for a database from its query history (runs in the background)"""
+        started = time.time()
+        history = get_rag_service().get_sql_history(database_config, days=self.history_days)
+        patterns = self._patterns(snapshot, history)
+        candidates = self._candidates(snapshot, patterns)
+
+        engine = get_schema_catalog().engine(snapshot.key)
+        quote = engine.dialect.identifier_preparer.quote if engine is not None else (lambda name: name)
+        hypothetical = False
+        if snapshot.dbtype == "postgresql" and engine is not None and candidates:
+            hypothetical = self._hypothetical_costs(engine, candidates, quote)
+            if hypothetical:
+                # Candidates the planner would not use (or that did not lower the cost) are dropped
+                candidates = [c for c in candidates if c.improvement is None or c.improvement >= MIN_IMPROVEMENT]
+        candidates.sort(key=lambda candidate: candidate.score, reverse=True)
+
+        concurrently = " CONCURRENTLY" if snapshot.dbtype == "postgresql" else ""
+        recommendations = []
+        for candidate in candidates[:MAX_RECOMMENDATIONS]:
+            name = f"idx_{candidate.table}_{'_'.join(candidate.columns)}"[:63]
+            queries = sum(pattern.count for pattern in candidate.patterns)
+            recommendation = {
+                "table": candidate.table,
+                "columns": list(candidate.columns),
+                "statement": f"CREATE INDEX{concurrently} {quote(name)} ON {quote(candidate.table)} "
+                             f"({', '.join(quote(column) for column in candidate.columns)})",
+                "reasons": candidate.reasons,
+                "patterns": len(candidate.patterns),
+                "queries": queries,
+                "avg_execution_ms": round(candidate.weight / queries, 1) if queries else None,
+                "total_execution_ms": round(candidate.weight),
+                # History SQL carries other users' literals: only its placeholder form leaves the advisor
+                "example_sql": max(candidate.patterns, key=lambda pattern: pattern.weight).key,
+            }
+            if candidate.improvement is not None:
+                recommendation["estimated_cost_before"] = round(candidate.cost_before, 1)
+                recommendation["estimated_cost_after"] = round(candidate.cost_after, 1)
+                recommendation["estimated_improvement_pct"] = round(candidate.improvement * 100, 1)
+            recommendations.append(recommendation)
+
+        logger.info(f"🗂️ Index advisor analysed {len(history)} queries ({len(patterns)} patterns) of {snapshot.key}: "
+                    f"{len(recommendations)} recommendations in {time.time() - started:.1f}s")
+        return {
+            "database": database_label(snapshot.key),
+            "fingerprint": snapshot.fingerprint,
+            "generated_at": time.time(),
+            "history_days": self.history_days,
+            "queries_analyzed": sum(entry["count"] for entry in history),
+            "patterns_analyzed": len(patterns),
+            "benefit_estimation": "hypopg" if hypothetical else "history",
+            "recommendations": recommendations,
+        }
+
+    def _analyze(self, snapshot: SchemaSnapshot, database_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            report = self.analyze(snapshot, database_config)
+            with self._lock:
+                self._reports[snapshot.key] = report
+            return report
+        except Exception as e:
+            logger.warning(f"⚠️ Index advisor failed for {snapshot.key}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(snapshot.key, None)
+
+    def _schedule(self, snapshot: SchemaSnapshot, database_config: Dict[str, Any]) -> Future:
+        with self._lock:
+            pending = self._pending.get(snapshot.key)
+            if pending is None:
+                pending = self._executor.submit(self._analyze, snapshot, database_config)
+                self._pending[snapshot.key] = pending
+            return pending
+
+    # ---- reads (request path) ----
+
+    def report(self, snapshot: SchemaSnapshot, database_config: Dict[str, Any], refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Index report of a database, blocking only when none was built yet (or refresh is asked).
+
+        Returns:
+            The report with "stale" set when a rebuild is running in the background; None if analysis failed
+        """
+        report = self._reports.get(snapshot.key)
+        if report is None or refresh:
+            report = self._schedule(snapshot, database_config).result()
+            return {**report, "stale": False} if report is not None else None
+
+        stale = report["fingerprint"] != snapshot.fingerprint or time.time() - report["generated_at"] > self.ttl
+        if stale:
+            self._schedule(snapshot, database_config)
+        return {**report, "stale": stale}
+
+
+# Global index advisor instance
+_index_advisor = None
+
+def get_index_advisor() -> IndexAdvisor:
+    """Get or create global index advisor instance"""
+    global _index_advisor
+    if _index_advisor is None:
+        _index_advisor = IndexAdvisor()
+    return _index_advisor
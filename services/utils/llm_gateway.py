@@ -0,0 +1,610 @@
+"""
+LLM Gateway
+Single entry point for every LLM call made by the service:
+1. One pooled HTTP client per provider and model (keep-alive connections, shared
+   TLS sessions), with connection limits and timeouts from the environment
+2. Sync (complete) and async (acomplete) chat completion interfaces over the
+   Groq (OpenAI-compatible) and Gemini REST APIs, returning the message text;
+   every call is admitted by the LLM scheduler (key pool, priorities, retries)
+3. GatewayChatModel, a LangChain chat model routed through the gateway, for the
+   SQL agent and other chains
+4. Provider SDK clients (audio endpoints) built on the same pooled HTTP clients
+5. Hedged interactive calls: a duplicate goes to another key or the fallback
+   provider once a call runs past its observed p90, and providers whose circuit
+   breaker is open fail over to their fallback
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Optional, Any, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from utils.llm_scheduler import (
+    INTERACTIVE, LLM_MAX_RETRIES, Lease, get_llm_scheduler, discover_keys, estimate_tokens, backoff_delay
+)
+from utils.llm_resilience import CircuitBreaker, LatencyTracker, HedgeStats
+from utils.deadline import DeadlineExceeded, current_budget
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() in ("1", "true", "yes")
+# A hedge only goes out if a key has budget for it right away
+HEDGE_ADMISSION_TIMEOUT_SECONDS = 1.0
+
+PROVIDERS = {
+    "groq": {"base_url": "https://api.groq.com/openai/v1", "key_env": "GROQ_API_KEY_1", "key_prefix": "GROQ_API_KEY",
+             "fallback": ("gemini", "gemini-2.5-flash")},
+    "gemini": {"base_url": "https://generativelanguage.googleapis.com/v1beta", "key_env": "GEMINI_API_KEY",
+               "key_prefix": "GEMINI_API_KEY", "fallback": ("groq", "llama-3.3-70b-versatile")},
+}
+
+# LangChain message types to chat roles
+MESSAGE_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+
+class LLMError(Exception):
+    """A failed LLM call; status_code and retry_after are set for HTTP errors"""
+
+    def __init__(self, message: str, provider: str, model: str, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.model = model
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Rate limits, server errors and transport failures are worth retrying"""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+class CircuitOpenError(LLMError):
+    """The provider's circuit breaker is open; fail fast instead of retrying"""
+
+    @property
+    def retryable(self) -> bool:
+        return False
+
+
+class LLMCancelled(LLMError):
+    """A hedged duplicate lost the race and was stopped"""
+
+    @property
+    def retryable(self) -> bool:
+        return False
+
+
+def _groq_request(model: str, messages: List[Dict[str, str]], api_key: str, temperature: float,
+                  max_tokens: Optional[int], json_mode: bool, stop: Optional[List[str]]) -> Tuple[str, Dict, Dict]:
+    body: Dict[str, Any] = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens:
+        body["max_tokens"] = max_tokens
+    if json_mode:
+        body["response_format"] = {"type": "json_object"}
+    if stop:
+        body["stop"] = stop
+    return "/chat/completions", {"Authorization": f"Bearer {api_key}"}, body
+
+
+def _groq_text(payload: Dict[str, Any]) -> str:
+    return payload["choices"][0]["message"]["content"] or ""
+
+
+def _groq_usage(payload: Dict[str, Any]) -> Optional[int]:
+    return (payload.get("usage") or {}).get("total_tokens")
+
+
+def _gemini_request(model: str, messages: List[Dict[str, str]], api_key: str, temperature: float,
+                    max_tokens: Optional[int], json_mode: bool, stop: Optional[List[str]]) -> Tuple[str, Dict, Dict]:
+    system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    contents = [
+        {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+        for m in messages if m["role"] != "system"
+    ]
+    config: Dict[str, Any] = {"temperature": temperature}
+    if max_tokens:
+        config["maxOutputTokens"] = max_tokens
+    if json_mode:
+        config["responseMimeType"] = "application/json"
+    if stop:
+        config["stopSequences"] = stop[:5]
+    body: Dict[str, Any] = {"contents": contents, "generationConfig": config}
+    if system:
+        body["systemInstruction"] = {"parts": [{"text": system}]}
+    return f"/models/{model}:generateContent", {"x-goog-api-key": api_key}, body
+
+
+def _gemini_text(payload: Dict[str, Any]) -> str:
+    parts = payload["candidates"][0]["content"].get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+
+def _gemini_usage(payload: Dict[str, Any]) -> Optional[int]:
+    return (payload.get("usageMetadata") or {}).get("totalTokenCount")
+
+
+REQUEST_BUILDERS = {
+    "groq": (_groq_request, _groq_text, _groq_usage),
+    "gemini": (_gemini_request, _gemini_text, _gemini_usage),
+}
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMGateway:
+    def __init__(self, max_connections: int = LLM_MAX_CONNECTIONS, max_keepalive: int = LLM_MAX_KEEPALIVE,
+                 timeout: float = LLM_TIMEOUT_SECONDS):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.timeout = timeout
+        self._clients: Dict[Tuple[str, str], httpx.Client] = {}
+        self._async_clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._sdk_clients: Dict[Tuple[str, str], Any] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[Tuple[str, str], LatencyTracker] = {}
+        self.hedge_stats = HedgeStats()
+        # Runs blocking calls so the caller can hedge them after a deadline
+        self._hedge_pool = ThreadPoolExecutor(max_workers=max(32, 2 * max_connections), thread_name_prefix="llm-hedge")
+        self._lock = threading.Lock()
+
+    # ---- pooled clients ----
+
+    def http_client(self, provider: str, model: str) -> httpx.Client:
+        """Pooled sync HTTP client of one provider/model"""
+        with self._lock:
+            client = self._clients.get((provider, model))
+            if client is None:
+                client = httpx.Client(base_url=PROVIDERS[provider]["base_url"], limits=self.limits, timeout=self.timeout)
+                self._clients[(provider, model)] = client
+            return client
+
+    def async_http_client(self, provider: str, model: str) -> httpx.AsyncClient:
+        """Pooled async HTTP client of one provider/model"""
+        with self._lock:
+            client = self._async_clients.get((provider, model))
+            if client is None:
+                client = httpx.AsyncClient(base_url=PROVIDERS[provider]["base_url"], limits=self.limits,
+                                           timeout=self.timeout)
+                self._async_clients[(provider, model)] = client
+            return client
+
+    def sdk_client(self, provider: str = "groq", key_env: Optional[str] = None):
+        """Provider SDK client (e.g. for audio endpoints) sharing the gateway's connection pool"""
+        key_env = key_env or PROVIDERS[provider]["key_env"]
+        with self._lock:
+            client = self._sdk_clients.get((provider, key_env))
+        if client is None:
+            if provider != "groq":
+                raise ValueError(f"No SDK client for provider: {provider}")
+            from groq import Groq
+            client = Groq(api_key=self.api_key(provider, key_env) or "dummy_key_for_development",
+                          http_client=self.http_client(provider, "sdk"))
+            with self._lock:
+                self._sdk_clients[(provider, key_env)] = client
+        return client
+
+    @staticmethod
+    def api_key(provider: str, key_env: Optional[str] = None) -> Optional[str]:
+        return os.getenv(key_env or PROVIDERS[provider]["key_env"])
+
+    @staticmethod
+    def key_pool(provider: str, key_env: Optional[str] = None) -> List[str]:
+        """Key variables a call may use: the pinned one, or every configured key of the provider"""
+        if key_env:
+            return [key_env] if os.getenv(key_env) else []
+        return discover_keys(PROVIDERS[provider]["key_prefix"])
+
+    @staticmethod
+    def _parse(provider: str, model: str, response: httpx.Response, started: float) -> Tuple[str, Optional[int]]:
+        if response.status_code >= 400:
+            raise LLMError(f"{provider} {model} returned {response.status_code}: {response.text[:300]}",
+                           provider, model, response.status_code, _retry_after(response))
+        _, extract, usage = REQUEST_BUILDERS[provider]
+        payload = response.json()
+        logger.debug(f"🤖 {provider}/{model} answered in {time.perf_counter() - started:.2f}s")
+        return extract(payload), usage(payload)
+
+    def _admit(self, provider: str, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int],
+               key_envs: List[str], priority: str, timeout: Optional[float] = None) -> Lease:
+        if provider not in REQUEST_BUILDERS:
+            raise ValueError(f"Unsupported LLM provider: {provider}")
+        if not key_envs:
+            raise LLMError(f"API key for {provider} not configured", provider, model)
+        return get_llm_scheduler().acquire(provider, model, key_envs, estimate_tokens(messages, max_tokens), priority,
+                                           timeout)
+
+    def _settle(self, lease: Lease, error: Optional[LLMError] = None, used_tokens: Optional[int] = None,
+                started: Optional[float] = None) -> bool:
+        """Report the outcome to the scheduler and circuit breaker; True if a failed call should be retried"""
+        scheduler = get_llm_scheduler()
+        breaker = self.breaker(lease.provider)
+        if error is None:
+            scheduler.release(lease, used_tokens)
+            breaker.record_success()
+            if started is not None:
+                self.latency(lease.provider, lease.model).record(time.perf_counter() - started)
+            return False
+        if error.status_code == 429:
+            scheduler.throttle(lease, error.retry_after)
+        else:
+            scheduler.release(lease)
+        # Only outages count against the provider; 4xx answers mean it is up
+        if error.status_code is None or error.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return error.retryable
+
+    # ---- resilience ----
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault(provider, CircuitBreaker(provider))
+
+    def latency(self, provider: str, model: str) -> LatencyTracker:
+        with self._lock:
+            return self._latencies.setdefault((provider, model), LatencyTracker())
+
+    def _primary_target(self, provider: str, model: str) -> Tuple[str, str, bool]:
+        """Failover: calls for a provider whose circuit is open go to its fallback provider"""
+        fallback = PROVIDERS[provider].get("fallback")
+        if self.breaker(provider).available() or not fallback:
+            return provider, model, False
+        if self.key_pool(fallback[0]) and self.breaker(fallback[0]).available():
+            return fallback[0], fallback[1], True
+        return provider, model, False
+
+    def _secondary_target(self, provider: str, model: str,
+                          primary_key: Optional[str]) -> Optional[Tuple[str, str, List[str]]]:
+        """Where a hedged duplicate goes: another key of the same provider, else the fallback provider"""
+        other_keys = [key for key in self.key_pool(provider) if key != primary_key]
+        if primary_key and other_keys and self.breaker(provider).available():
+            return provider, model, other_keys
+        fallback = PROVIDERS[provider].get("fallback")
+        if fallback and self.breaker(fallback[0]).available():
+            fallback_keys = self.key_pool(fallback[0])
+            if fallback_keys:
+                return fallback[0], fallback[1], fallback_keys
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        """Circuit breaker state per provider, hedge delay per model and hedging effect on latency"""
+        with self._lock:
+            breakers = dict(self._breakers)
+            latencies = dict(self._latencies)
+
+        def ms(value):
+            return round(value * 1000) if value is not None else None
+
+        return {
+            "circuit_breakers": {provider: breaker.metrics() for provider, breaker in breakers.items()},
+            "models": {
+                f"{provider}/{model}": {
+                    "p90_ms": ms(tracker.percentile(0.9)),
+                    "p99_ms": ms(tracker.percentile(0.99)),
+                    "hedge_after_ms": ms(tracker.hedge_delay()),
+                }
+                for (provider, model), tracker in latencies.items()
+            },
+            "hedging": {"enabled": LLM_HEDGING, **self.hedge_stats.metrics()},
+        }
+
+    # ---- completions ----
+
+    def _complete(self, messages: List[Dict[str, str]], model: str, provider: str, options: Dict[str, Any],
+                  key_envs: List[str], priority: str, cancelled: Optional[threading.Event] = None,
+                  admission_timeout: Optional[float] = None, call_info: Optional[Dict[str, Any]] = None) -> str:
+        """One call on one provider/model with scheduler admission and rate-limit retries"""
+        build, _, _ = REQUEST_BUILDERS.get(provider, (None, None, None))
+        started = time.perf_counter()
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if cancelled is not None and cancelled.is_set():
+                raise LLMCancelled(f"{provider} {model} call cancelled", provider, model)
+            if not self.breaker(provider).allow():
+                raise CircuitOpenError(f"{provider} circuit is open", provider, model)
+            queue_timeout, request_timeout = self._timeouts(provider, model, admission_timeout)
+            lease = self._admit(provider, model, messages, options["max_tokens"], key_envs, priority, queue_timeout)
+            if call_info is not None:
+                call_info["key_env"] = lease.key_env
+            path, headers, body = build(model, messages, os.getenv(lease.key_env), options["temperature"],
+                                        options["max_tokens"], options["json_mode"], options["stop"])
+            request_started = time.perf_counter()
+            try:
+                try:
+                    response = self.http_client(provider, model).post(path, headers=headers, json=body,
+                                                                      timeout=request_timeout)
+                except httpx.HTTPError as e:
+                    self._raise_if_expired(lease, provider, model, e)
+                    raise LLMError(f"{provider} {model} request failed: {e}", provider, model) from e
+                text_value, used = self._parse(provider, model, response, request_started)
+            except LLMError as e:
+                if not self._settle(lease, e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                get_llm_scheduler().stats["retries"] += 1
+                time.sleep(backoff_delay(attempt, e.retry_after))
+                continue
+            self._settle(lease, used_tokens=used, started=started)
+            return text_value
+
+    async def _acomplete(self, messages: List[Dict[str, str]], model: str, provider: str, options: Dict[str, Any],
+                         key_envs: List[str], priority: str, admission_timeout: Optional[float] = None,
+                         call_info: Optional[Dict[str, Any]] = None) -> str:
+        """Async _complete(); cancelling the task aborts the HTTP request and frees its admission"""
+        build, _, _ = REQUEST_BUILDERS.get(provider, (None, None, None))
+        started = time.perf_counter()
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if not self.breaker(provider).allow():
+                raise CircuitOpenError(f"{provider} circuit is open", provider, model)
+            queue_timeout, request_timeout = self._timeouts(provider, model, admission_timeout)
+            # Waiting for admission blocks, so it happens off the event loop
+            admission = asyncio.ensure_future(asyncio.to_thread(
+                self._admit, provider, model, messages, options["max_tokens"], key_envs, priority, queue_timeout
+            ))
+            try:
+                lease = await asyncio.shield(admission)
+            except asyncio.CancelledError:
+                admission.add_done_callback(_release_admission)
+                raise
+            if call_info is not None:
+                call_info["key_env"] = lease.key_env
+            path, headers, body = build(model, messages, os.getenv(lease.key_env), options["temperature"],
+                                        options["max_tokens"], options["json_mode"], options["stop"])
+            request_started = time.perf_counter()
+            try:
+                try:
+                    response = await self.async_http_client(provider, model).post(path, headers=headers, json=body,
+                                                                                  timeout=request_timeout)
+                except httpx.HTTPError as e:
+                    self._raise_if_expired(lease, provider, model, e)
+                    raise LLMError(f"{provider} {model} request failed: {e}", provider, model) from e
+                text_value, used = self._parse(provider, model, response, request_started)
+            except asyncio.CancelledError:
+                get_llm_scheduler().release(lease)
+                raise
+            except LLMError as e:
+                if not self._settle(lease, e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                get_llm_scheduler().stats["retries"] += 1
+                await asyncio.sleep(backoff_delay(attempt, e.retry_after))
+                continue
+            self._settle(lease, used_tokens=used, started=started)
+            return text_value
+
+    def _timeouts(self, provider: str, model: str,
+                  admission_timeout: Optional[float]) -> Tuple[Optional[float], Optional[float]]:
+        """Queue and HTTP timeouts of one attempt, capped to the remaining request budget"""
+        budget = current_budget()
+        if budget is None:
+            return admission_timeout, self.timeout
+        budget.check(f"{provider}/{model} call")
+        remaining = budget.remaining()
+        queue_timeout = min(admission_timeout if admission_timeout is not None else get_llm_scheduler().queue_timeout,
+                            remaining)
+        return queue_timeout, min(self.timeout, remaining)
+
+    def _raise_if_expired(self, lease: Lease, provider: str, model: str, error: Exception):
+        """A request cut short by the request deadline is not a provider failure"""
+        budget = current_budget()
+        if budget is not None and budget.expired():
+            get_llm_scheduler().release(lease)
+            raise DeadlineExceeded(f"Request deadline exceeded during {provider}/{model} call") from error
+
+    @staticmethod
+    def _hedges(key_env: Optional[str], priority: str) -> bool:
+        """Interactive calls on the key pool are hedged; background work tolerates latency, pinned keys have no peer"""
+        return LLM_HEDGING and key_env is None and priority == INTERACTIVE
+
+    def complete(self, messages: List[Dict[str, str]], model: str, provider: str = "groq", temperature: float = 0.1,
+                 max_tokens: Optional[int] = None, json_mode: bool = False, stop: Optional[List[str]] = None,
+                 key_env: Optional[str] = None, priority: str = INTERACTIVE) -> str:
+        """
+        Chat completion (blocking), admitted by the LLM scheduler and retried on rate limits.
+        Interactive calls are hedged: when no answer arrived within the model's observed p90,
+        a duplicate goes to another key or the fallback provider and the first answer wins.
+
+        Args:
+            messages: [{"role": "system" | "user" | "assistant", "content": str}]
+            model: Provider model name
+            provider: 'groq' or 'gemini'
+            json_mode: Ask the provider for a JSON object response
+            key_env: Pin the call to one API key variable (the provider's whole key pool if omitted)
+            priority: 'interactive' or 'background' admission priority
+
+        Returns:
+            The text of the first choice
+        """
+        options = {"temperature": temperature, "max_tokens": max_tokens, "json_mode": json_mode, "stop": stop}
+        if not self._hedges(key_env, priority):
+            return self._complete(messages, model, provider, options, self.key_pool(provider, key_env), priority)
+
+        stats = self.hedge_stats
+        stats.count("calls")
+        started = time.perf_counter()
+        provider, model, failover = self._primary_target(provider, model)
+        if failover:
+            stats.count("failovers")
+        primary_info: Dict[str, Any] = {}
+        primary_cancel = threading.Event()
+        # Pool threads run in a copy of the caller's context (request deadline)
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._complete, messages, model, provider,
+                                          options, self.key_pool(provider), priority, primary_cancel, None, primary_info)
+        primary.add_done_callback(lambda _: stats.record_primary(time.perf_counter() - started))
+        calls = {primary: primary_cancel}
+        hedge_at = started + self.latency(provider, model).hedge_delay()
+        hedged = False
+        error: Optional[Exception] = None
+        try:
+            while calls:
+                timeout = None if hedged else max(0.0, hedge_at - time.perf_counter())
+                done, _ = wait(list(calls), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    calls.pop(future)
+                    try:
+                        text_value = future.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if future is not primary:
+                        stats.count("hedge_wins")
+                    stats.record_answer(time.perf_counter() - started)
+                    return text_value
+                if not hedged:
+                    # The primary is past its p90 (or failed): duplicate it elsewhere
+                    hedged = True
+                    target = self._secondary_target(provider, model, primary_info.get("key_env"))
+                    if target is None:
+                        stats.count("hedges_skipped")
+                        continue
+                    stats.count("hedged" if calls else "failovers")
+                    secondary_cancel = threading.Event()
+                    secondary = self._hedge_pool.submit(
+                        contextvars.copy_context().run, self._complete, messages, target[1], target[0], options,
+                        target[2], priority, secondary_cancel, HEDGE_ADMISSION_TIMEOUT_SECONDS
+                    )
+                    calls[secondary] = secondary_cancel
+                    logger.info(f"🪃 Hedging {provider}/{model} on {target[0]}/{target[1]}")
+        finally:
+            # Losers stop before their next admission or retry; a request already on the wire is left to finish
+            for future, cancel in calls.items():
+                cancel.set()
+                future.cancel()
+        raise error
+
+    async def acomplete(self, messages: List[Dict[str, str]], model: str, provider: str = "groq",
+                        temperature: float = 0.1, max_tokens: Optional[int] = None, json_mode: bool = False,
+                        stop: Optional[List[str]] = None, key_env: Optional[str] = None,
+                        priority: str = INTERACTIVE) -> str:
+        """Chat completion (async), same arguments and hedging as complete(); the losing request is cancelled"""
+        options = {"temperature": temperature, "max_tokens": max_tokens, "json_mode": json_mode, "stop": stop}
+        if not self._hedges(key_env, priority):
+            return await self._acomplete(messages, model, provider, options, self.key_pool(provider, key_env),
+                                         priority)
+
+        stats = self.hedge_stats
+        stats.count("calls")
+        started = time.perf_counter()
+        provider, model, failover = self._primary_target(provider, model)
+        if failover:
+            stats.count("failovers")
+        primary_info: Dict[str, Any] = {}
+        primary = asyncio.ensure_future(self._acomplete(messages, model, provider, options, self.key_pool(provider),
+                                                        priority, None, primary_info))
+        primary.add_done_callback(lambda _: stats.record_primary(time.perf_counter() - started))
+        calls = {primary}
+        hedge_at = started + self.latency(provider, model).hedge_delay()
+        hedged = False
+        error: Optional[Exception] = None
+        try:
+            while calls:
+                timeout = None if hedged else max(0.0, hedge_at - time.perf_counter())
+                done, _ = await asyncio.wait(calls, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    calls.discard(task)
+                    try:
+                        text_value = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if task is not primary:
+                        stats.count("hedge_wins")
+                    stats.record_answer(time.perf_counter() - started)
+                    return text_value
+                if not hedged:
+                    hedged = True
+                    target = self._secondary_target(provider, model, primary_info.get("key_env"))
+                    if target is None:
+                        stats.count("hedges_skipped")
+                        continue
+                    stats.count("hedged" if calls else "failovers")
+                    calls.add(asyncio.ensure_future(self._acomplete(
+                        messages, target[1], target[0], options, target[2], priority, HEDGE_ADMISSION_TIMEOUT_SECONDS
+                    )))
+                    logger.info(f"🪃 Hedging {provider}/{model} on {target[0]}/{target[1]}")
+        finally:
+            for task in calls:
+                task.cancel()
+        raise error
+
+    def chat_model(self, model: str, provider: str = "groq", temperature: float = 0.1,
+                   max_tokens: Optional[int] = None, key_env: Optional[str] = None,
+                   priority: str = INTERACTIVE) -> "GatewayChatModel":
+        """LangChain chat model whose calls go through this gateway"""
+        return GatewayChatModel(model=model, provider=provider, temperature=temperature, max_tokens=max_tokens,
+                                key_env=key_env, priority=priority)
+
+
+def _release_admission(admission: "asyncio.Future"):
+    """A call was cancelled while waiting for admission: give the key back once it is admitted"""
+    if not admission.cancelled() and admission.exception() is None:
+        get_llm_scheduler().release(admission.result())
+
+
+def to_gateway_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    return [{"role": MESSAGE_ROLES.get(m.type, "user"), "content": str(m.content)} for m in messages]
+
+
+class GatewayChatModel(BaseChatModel):
+    """LangChain chat model backed by the LLM gateway (drop-in for ChatGroq in agents and chains)"""
+
+    model: str
+    provider: str = "groq"
+    temperature: float = 0.1
+    max_tokens: Optional[int] = None
+    key_env: Optional[str] = None
+    priority: str = INTERACTIVE
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "provider": self.provider, "temperature": self.temperature}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs) -> ChatResult:
+        text_value = get_llm_gateway().complete(
+            to_gateway_messages(messages), self.model, self.provider, self.temperature, self.max_tokens,
+            stop=stop, key_env=self.key_env, priority=self.priority
+        )
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text_value))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs) -> ChatResult:
+        text_value = await get_llm_gateway().acomplete(
+            to_gateway_messages(messages), self.model, self.provider, self.temperature, self.max_tokens,
+            stop=stop, key_env=self.key_env, priority=self.priority
+        )
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text_value))])
+
+
+# Global LLM gateway instance
+_llm_gateway = None
+
+def get_llm_gateway() -> LLMGateway:
+    """Get or create global LLM gateway instance"""
+    global _llm_gateway
+    if _llm_gateway is None:
+        _llm_gateway = LLMGateway()
+    return _llm_gateway
@@ -0,0 +1,153 @@
+"""
+LLM Resilience
+Failure and latency tracking behind the gateway's hedged requests and failover:
+1. CircuitBreaker per provider: consecutive server errors or timeouts open it for
+   a cool-down, after which a single probe call decides whether it closes again
+2. LatencyTracker per provider/model: rolling latencies of answered calls, whose
+   p90 is how long a call may run before a hedged duplicate is sent
+3. HedgeStats: hedges sent and won, failovers, and the p99 of answered calls next
+   to the p99 the primary calls alone had (the latency without hedging)
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_HEDGE_DEFAULT_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "4"))
+HEDGE_MIN_SECONDS = 0.25
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 500
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, failure_threshold: int = LLM_BREAKER_FAILURES,
+                 cooldown: float = LLM_BREAKER_COOLDOWN_SECONDS):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now (an open breaker lets one probe through after its cool-down)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probe_started = None
+            # One probe at a time; a probe that never reported back is replaced after a cool-down
+            if self.state == HALF_OPEN and (self._probe_started is None or now - self._probe_started >= self.cooldown):
+                self._probe_started = now
+                return True
+            return False
+
+    def available(self) -> bool:
+        """Like allow() but without claiming the probe"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                return self._probe_started is None or now - self._probe_started >= self.cooldown
+            return self.state == CLOSED or now - self.opened_at >= self.cooldown
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"✅ {self.provider} circuit closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                self._probe_started = None
+                logger.warning(f"🔌 {self.provider} circuit opened after {self.failures} failures")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            return percentile(list(self._latencies), q)
+
+    def hedge_delay(self) -> float:
+        """Observed p90, or the configured default until enough calls were seen"""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return LLM_HEDGE_DEFAULT_SECONDS
+            return max(HEDGE_MIN_SECONDS, percentile(list(self._latencies), 0.9))
+
+
+class HedgeStats:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.counts = {"calls": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "hedges_skipped": 0}
+        # Latency of the answer the caller got, and of the primary call on its own
+        # (cancelled primaries count with the time they had run, a lower bound)
+        self._answered = deque(maxlen=window)
+        self._primary = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def record_answer(self, seconds: float):
+        with self._lock:
+            self._answered.append(seconds)
+
+    def record_primary(self, seconds: float):
+        with self._lock:
+            self._primary.append(seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        def ms(value):
+            return round(value * 1000) if value is not None else None
+
+        with self._lock:
+            answered, primary = list(self._answered), list(self._primary)
+            return {
+                **self.counts,
+                "p50_ms": ms(percentile(answered, 0.5)),
+                "p90_ms": ms(percentile(answered, 0.9)),
+                "p99_ms": ms(percentile(answered, 0.99)),
+                "p99_without_hedging_ms": ms(percentile(primary, 0.99)),
+            }
@@ -0,0 +1,232 @@
+"""
+LLM Scheduler
+Rate-limit-aware admission in front of every LLM gateway call:
+1. Each API key of a provider (GROQ_API_KEY_1, GROQ_API_KEY_2, ...) gets token
+   buckets per model for requests and tokens per minute, so calls are spread
+   over the key pool instead of being hard-wired to one key
+2. Callers wait in a per-model priority queue when no key has budget left;
+   interactive requests are always admitted before background ones
+3. A 429 puts the key on cooldown for its retry-after; retries use jittered
+   exponential backoff
+4. Queue depths, in-flight calls and per-key budgets are exposed as metrics
+"""
+
+import os
+import re
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from typing import List, Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = {INTERACTIVE: 0, BACKGROUND: 1}
+
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "6000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20.0
+DEFAULT_COMPLETION_TOKENS = 512
+
+
+def discover_keys(prefix: str) -> List[str]:
+    """Names of the configured key variables: PREFIX, PREFIX_1, PREFIX_2, ... in numeric order"""
+    pattern = re.compile(rf"^{prefix}(?:_(\d+))?$")
+    found = [(int(m.group(1) or 0), name) for name in os.environ if (m := pattern.match(name)) and os.environ[name]]
+    return [name for _, name in sorted(found)]
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+    """Prompt tokens (about 4 characters each) plus the completion budget"""
+    prompt = sum(len(m.get("content", "")) for m in messages) // 4
+    return prompt + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """retry-after when the provider sent one, otherwise full-jitter exponential backoff"""
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX_SECONDS) + random.uniform(0, BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it is now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class KeyBudget:
+    """Request and token budget of one API key for one model"""
+
+    def __init__(self, key_env: str, requests_per_minute: float, tokens_per_minute: float):
+        self.key_env = key_env
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+
+    def wait_time(self, tokens: int) -> float:
+        cooldown = max(0.0, self.cooldown_until - time.monotonic())
+        return max(cooldown, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "key": self.key_env,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "requests_available": round(self.requests.level, 1),
+            "tokens_available": round(self.tokens.level),
+            "cooldown_seconds": round(max(0.0, self.cooldown_until - time.monotonic()), 1),
+        }
+
+
+class Lease:
+    """Admission of one call on one key; settled with the actual token usage"""
+
+    def __init__(self, provider: str, model: str, key_env: str, tokens: int, waited: float):
+        self.provider = provider
+        self.model = model
+        self.key_env = key_env
+        self.tokens = tokens
+        self.waited = waited
+
+
+class LLMScheduler:
+    def __init__(self, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = LLM_TOKENS_PER_MINUTE, queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_timeout = queue_timeout
+        self._budgets: Dict[Tuple[str, str], Dict[str, KeyBudget]] = {}
+        # (provider, model) -> heap of (priority, sequence) tickets waiting for a key
+        self._queues: Dict[Tuple[str, str], List[Tuple[int, int]]] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.stats = {"admitted": 0, "retries": 0, "rate_limited": 0, "queue_timeouts": 0}
+
+    def _pool(self, provider: str, model: str, key_envs: List[str]) -> List[KeyBudget]:
+        budgets = self._budgets.setdefault((provider, model), {})
+        for key_env in key_envs:
+            if key_env not in budgets:
+                budgets[key_env] = KeyBudget(key_env, self.requests_per_minute, self.tokens_per_minute)
+        return [budgets[key_env] for key_env in key_envs]
+
+    def acquire(self, provider: str, model: str, key_envs: List[str], tokens: int, priority: str = INTERACTIVE,
+                timeout: Optional[float] = None) -> Lease:
+        """
+        Block until one of the keys has request and token budget for this call.
+
+        Args:
+            key_envs: Pool of API key variables the call may use
+            tokens: Estimated prompt + completion tokens
+            priority: 'interactive' calls are admitted before 'background' ones
+            timeout: Longest wait in the queue (queue_timeout if omitted)
+
+        Raises:
+            TimeoutError: No key had budget within the timeout
+        """
+        if not key_envs:
+            raise ValueError(f"No API keys configured for {provider}")
+        started = time.monotonic()
+        deadline = started + (self.queue_timeout if timeout is None else timeout)
+        ticket = (PRIORITIES.get(priority, PRIORITIES[BACKGROUND]), next(self._sequence))
+        with self._condition:
+            queue = self._queues.setdefault((provider, model), [])
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    pool = self._pool(provider, model, key_envs)
+                    wait = min(budget.wait_time(tokens) for budget in pool)
+                    if queue[0] == ticket and wait == 0:
+                        # Least loaded key among those with budget
+                        budget = min((b for b in pool if b.wait_time(tokens) == 0),
+                                     key=lambda b: (b.in_flight, -b.tokens.level))
+                        budget.requests.take(1)
+                        budget.tokens.take(tokens)
+                        budget.in_flight += 1
+                        budget.calls += 1
+                        self.stats["admitted"] += 1
+                        return Lease(provider, model, budget.key_env, tokens, time.monotonic() - started)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["queue_timeouts"] += 1
+                        raise TimeoutError(f"No {provider} key had budget for {model} within the queue timeout")
+                    self._condition.wait(timeout=min(remaining, max(wait, 0.05)))
+            finally:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                self._condition.notify_all()
+
+    def release(self, lease: Lease, used_tokens: Optional[int] = None):
+        """Finish a call, returning over-estimated tokens to the key's bucket"""
+        with self._condition:
+            budget = self._budgets[(lease.provider, lease.model)][lease.key_env]
+            budget.in_flight -= 1
+            if used_tokens is not None and used_tokens < lease.tokens:
+                budget.tokens.give(lease.tokens - used_tokens)
+            self._condition.notify_all()
+
+    def throttle(self, lease: Lease, retry_after: Optional[float]):
+        """A call was rate limited: cool the key down so others are preferred"""
+        with self._condition:
+            budget = self._budgets[(lease.provider, lease.model)][lease.key_env]
+            budget.in_flight -= 1
+            budget.throttled += 1
+            budget.cooldown_until = time.monotonic() + (retry_after if retry_after is not None else BACKOFF_BASE_SECONDS * 4)
+            self.stats["rate_limited"] += 1
+            self._condition.notify_all()
+        logger.warning(f"⏳ {lease.provider}/{lease.model} rate limited on {lease.key_env} (retry after {retry_after}s)")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            models = {}
+            for (provider, model), budgets in self._budgets.items():
+                queue = self._queues.get((provider, model), [])
+                models[f"{provider}/{model}"] = {
+                    "queued": {name: sum(1 for p, _ in queue if p == level) for name, level in PRIORITIES.items()},
+                    "keys": [budget.metrics() for budget in budgets.values()],
+                }
+            return {"models": models, "totals": dict(self.stats)}
+
+
+# Global LLM scheduler instance
+_llm_scheduler = None
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Get or create global LLM scheduler instance"""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        _llm_scheduler = LLMScheduler()
+    return _llm_scheduler
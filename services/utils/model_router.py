@@ -0,0 +1,199 @@
+"""
+Model Tier Router
+Assigns every LLM pipeline stage a model tier instead of using the largest model everywhere:
+1. Stages (SQL generation, summary, title, Cypher generation, ...) map to a tier
+   (small or large) with a latency SLO; defaults can be overridden without code
+   changes through the MODEL_ROUTES environment variable (JSON)
+2. A stage may name an escalation tier: the call is repeated on it when the
+   answer fails the caller's validation (or the smaller model errors)
+3. Model choice, latency, SLO misses and escalations are recorded per stage
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Optional, Any, Callable
+
+from utils.llm_gateway import GatewayChatModel, get_llm_gateway
+from utils.llm_scheduler import INTERACTIVE
+from utils.deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 200
+
+DEFAULT_ROUTES: Dict[str, Any] = {
+    "tiers": {
+        "small": {"provider": "groq", "model": "llama-3.1-8b-instant"},
+        "large": {"provider": "groq", "model": "llama-3.3-70b-versatile"},
+    },
+    "stages": {
+        "sql_generation": {"tier": "large", "slo_ms": 20000},
+        "sql_repair": {"tier": "large", "slo_ms": 5000},
+        "sql_summary": {"tier": "small", "escalate_to": "large", "slo_ms": 3000},
+        "sql_title": {"tier": "small", "slo_ms": 1500},
+        "cypher_generation": {"tier": "small", "escalate_to": "large", "slo_ms": 4000},
+        "cypher_explanation": {"tier": "small", "slo_ms": 3000},
+        "neo4j_summary": {"tier": "small", "escalate_to": "large", "slo_ms": 3000},
+        "neo4j_title": {"tier": "small", "slo_ms": 1500},
+    },
+}
+
+
+def load_routes() -> Dict[str, Any]:
+    """Default routes with MODEL_ROUTES ({"tiers": {...}, "stages": {...}}) merged over them"""
+    routes = {"tiers": dict(DEFAULT_ROUTES["tiers"]), "stages": dict(DEFAULT_ROUTES["stages"])}
+    override = os.getenv("MODEL_ROUTES")
+    if override:
+        try:
+            parsed = json.loads(override)
+            for section in ("tiers", "stages"):
+                for name, value in parsed.get(section, {}).items():
+                    routes[section][name] = {**routes[section].get(name, {}), **value}
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"⚠️ Ignoring invalid MODEL_ROUTES: {e}")
+    return routes
+
+
+class StageMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.escalations = 0
+        self.slo_misses = 0
+        self.models: Dict[str, int] = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, model: str, latency_ms: float, slo_ms: Optional[float]):
+        self.calls += 1
+        self.models[model] = self.models.get(model, 0) + 1
+        self.latencies.append(latency_ms)
+        if slo_ms is not None and latency_ms > slo_ms:
+            self.slo_misses += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "escalations": self.escalations,
+            "slo_misses": self.slo_misses,
+            "models": dict(self.models),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+        }
+
+
+class ModelRouter:
+    def __init__(self, routes: Optional[Dict[str, Any]] = None):
+        self.routes = routes or load_routes()
+        self._metrics: Dict[str, StageMetrics] = {}
+        self._lock = threading.Lock()
+
+    def route(self, stage: str) -> Dict[str, Any]:
+        """Stage config ({"tier", "escalate_to", "slo_ms"}); unknown stages use the large tier"""
+        return self.routes["stages"].get(stage, {"tier": "large"})
+
+    def slo_seconds(self, stage: str, default: float = 0.0) -> float:
+        """The stage's latency SLO, i.e. the time budget it needs to be worth starting"""
+        slo_ms = self.route(stage).get("slo_ms")
+        return slo_ms / 1000 if slo_ms is not None else default
+
+    def tier(self, name: str) -> Dict[str, str]:
+        return self.routes["tiers"][name]
+
+    def record(self, stage: str, model: str, latency_ms: float, escalated: bool = False):
+        slo_ms = self.route(stage).get("slo_ms")
+        with self._lock:
+            metrics = self._metrics.setdefault(stage, StageMetrics())
+            metrics.record(model, latency_ms, slo_ms)
+            if escalated:
+                metrics.escalations += 1
+        if slo_ms is not None and latency_ms > slo_ms:
+            logger.info(f"🐢 Stage {stage} took {latency_ms:.0f}ms on {model} (SLO {slo_ms}ms)")
+
+    def complete(self, stage: str, messages: List[Dict[str, str]], validate: Optional[Callable[[str], bool]] = None,
+                 temperature: float = 0.1, max_tokens: Optional[int] = None, json_mode: bool = False,
+                 priority: str = INTERACTIVE) -> str:
+        """
+        Run one stage on its tier, escalating when the answer fails validation.
+
+        Args:
+            stage: Pipeline stage name (see DEFAULT_ROUTES)
+            validate: Returns False for answers that should be retried on the escalation tier
+
+        Returns:
+            The answer of the last tier tried
+        """
+        route = self.route(stage)
+        tiers = [route["tier"]] + ([route["escalate_to"]] if route.get("escalate_to") else [])
+        for i, tier_name in enumerate(tiers):
+            tier = self.tier(tier_name)
+            last = i == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                answer = get_llm_gateway().complete(
+                    messages, tier["model"], tier.get("provider", "groq"), temperature, max_tokens,
+                    json_mode=json_mode, priority=priority
+                )
+            except Exception as e:
+                self.record(stage, tier["model"], (time.perf_counter() - started) * 1000, escalated=i > 0)
+                if last or isinstance(e, DeadlineExceeded):
+                    raise
+                logger.info(f"⬆️ Stage {stage} escalating after {tier['model']} failed: {e}")
+                continue
+            self.record(stage, tier["model"], (time.perf_counter() - started) * 1000, escalated=i > 0)
+            if last or validate is None or validate(answer):
+                return answer
+            logger.info(f"⬆️ Stage {stage} escalating after {tier['model']} failed validation")
+        raise RuntimeError(f"No tier configured for stage {stage}")
+
+    def chat_model(self, stage: str, temperature: float = 0.1, priority: str = INTERACTIVE) -> "RoutedChatModel":
+        """LangChain chat model on the stage's tier (for agents, which cannot escalate mid-run)"""
+        tier = self.tier(self.route(stage)["tier"])
+        return RoutedChatModel(stage=stage, model=tier["model"], provider=tier.get("provider", "groq"),
+                               temperature=temperature, priority=priority)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "routes": self.routes,
+                "stages": {stage: metrics.to_dict() for stage, metrics in self._metrics.items()},
+            }
+
+
+class RoutedChatModel(GatewayChatModel):
+    """Gateway chat model that records each call under its pipeline stage"""
+
+    stage: str
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        finally:
+            get_model_router().record(self.stage, self.model, (time.perf_counter() - started) * 1000)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        finally:
+            get_model_router().record(self.stage, self.model, (time.perf_counter() - started) * 1000)
+
+
+# Global model router instance
+_model_router = None
+
+def get_model_router() -> ModelRouter:
+    """Get or create global model router instance"""
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter()
+    return _model_router
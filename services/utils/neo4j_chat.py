@@ -1,16 +1,40 @@
 from fastapi import HTTPException
-from langchain_groq import ChatGroq
+from utils.llm_gateway import get_llm_gateway
+from utils.model_router import get_model_router
+from utils.deadline import DeadlineExceeded, current_budget, rule_based_title
 from utils.db import configure_db, get_database_schema
-from neo4j import GraphDatabase, Driver
+from neo4j import GraphDatabase, Driver, Query
 import json
 from dotenv import load_dotenv
 import os
-from pydantic import SecretStr
 import re
 from typing import Dict, Any, Union
 
 load_dotenv()
-groq_api_key_5 = os.getenv("GROQ_API_KEY_1")
+groq_api_keys = get_llm_gateway().key_pool("groq")
+
+CYPHER_CLAUSES = ("MATCH", "OPTIONAL", "WITH", "UNWIND", "CALL", "RETURN")
+
+def clean_cypher(cypher_query):
+    """Strip markdown fences around a generated Cypher query"""
+    cypher_query = re.sub(r'```cypher\s*', '', cypher_query)
+    cypher_query = re.sub(r'```\s*', '', cypher_query)
+    return cypher_query.strip()
+
+def cypher_validator(driver):
+    """Validation for generated Cypher: a read clause that Neo4j can plan (EXPLAIN does not execute it)"""
+    def validate(cypher_query):
+        cypher_query = clean_cypher(cypher_query)
+        if not cypher_query.upper().startswith(CYPHER_CLAUSES):
+            return False
+        try:
+            with driver.session() as session:
+                session.run(f"EXPLAIN {cypher_query}").consume()
+            return True
+        except Exception as e:
+            print(f"[DEBUG] Generated Cypher failed EXPLAIN: {e}")
+            return False
+    return validate
 
 def format_neo4j_results(result_records):
     """Format Neo4j results into user-friendly display format"""
@@ -63,7 +87,7 @@ def format_neo4j_results(result_records):
     
     return formatted_results
 
-def process_neo4j_query(db_name, host, user, password, database, query, llm, driver):
+def process_neo4j_query(db_name, host, user, password, database, query, driver):
     """Process Neo4j graph database queries using Cypher"""
     
     try:
@@ -97,9 +121,12 @@ def process_neo4j_query(db_name, host, user, password, database, query, llm, dri
         Generate only the Cypher query:
         """
         
-        # Generate Cypher query using LLM
-        cypher_response = llm.invoke(cypher_prompt)
-        cypher_query = cypher_response.content.strip()
+        router = get_model_router()
+
+        # Generate Cypher query, escalating to the larger model when Neo4j cannot plan it
+        cypher_query = clean_cypher(router.complete(
+            "cypher_generation", [{"role": "user", "content": cypher_prompt}], validate=cypher_validator(driver)
+        ))
         
         # Generate thought process for Neo4j query
         thought_process_prompt = f"""
@@ -117,18 +144,23 @@ def process_neo4j_query(db_name, host, user, password, database, query, llm, dri
         Keep it concise and technical but understandable.
         """
         
-        thought_process_response = llm.invoke(thought_process_prompt)
-        thought_process = thought_process_response.content.strip()
-        
-        # Clean up the query (remove markdown if present)
-        cypher_query = re.sub(r'```cypher\s*', '', cypher_query)
-        cypher_query = re.sub(r'```\s*', '', cypher_query)
-        cypher_query = cypher_query.strip()
+        budget = current_budget()
+        if budget is not None and not budget.allows("cypher_explanation", router.slo_seconds("cypher_explanation")):
+            thought_process = "Explanation skipped to answer within the request deadline."
+        else:
+            thought_process = router.complete(
+                "cypher_explanation", [{"role": "user", "content": thought_process_prompt}]
+            ).strip()
         
         # Execute Cypher query
         result_records = []
         with driver.session() as session:
-            result = session.run(cypher_query)
+            # Neo4j aborts the transaction when the request budget runs out
+            if budget is not None:
+                budget.check("Cypher execution")
+                result = session.run(Query(cypher_query, timeout=max(0.1, budget.remaining())))
+            else:
+                result = session.run(cypher_query)
             
             for record in result:
                 # Convert record to dictionary
@@ -159,7 +191,9 @@ def process_neo4j_query(db_name, host, user, password, database, query, llm, dri
         formatted_results = format_neo4j_results(result_records)
         
         # Generate summary using formatted results for better readability
-        if formatted_results:
+        if formatted_results and budget is not None and not budget.allows("summary", router.slo_seconds("neo4j_summary")):
+            summary = None
+        elif formatted_results:
             # Use formatted results for summary but limit the data shown
             summary_data = []
             for record in formatted_results[:3]:  # Only use first 3 for summary
@@ -193,12 +227,20 @@ def process_neo4j_query(db_name, host, user, password, database, query, llm, dri
             Focus on the key insights and findings from the graph data.
             """
             
-            summary = llm.invoke(summary_prompt).content
+            try:
+                summary = router.complete(
+                    "neo4j_summary", [{"role": "user", "content": summary_prompt}], validate=lambda text: bool(text.strip())
+                )
+            except DeadlineExceeded:
+                budget.skip("summary")
+                summary = None
         else:
             summary = "No matching records found in the graph database for your query."
         
         # Generate title
-        if result_records:
+        if result_records and budget is not None and not budget.allows("llm_title", router.slo_seconds("neo4j_title")):
+            title = rule_based_title(query)
+        elif result_records:
             title_prompt = f"""
             Create a brief, descriptive title (5-8 words) for this graph query result:
             Question: {query}
@@ -206,7 +248,11 @@ def process_neo4j_query(db_name, host, user, password, database, query, llm, dri
             
             Focus on what was discovered in the graph.
             """
-            title = llm.invoke(title_prompt).content.strip()
+            try:
+                title = router.complete("neo4j_title", [{"role": "user", "content": title_prompt}]).strip()
+            except DeadlineExceeded:
+                budget.skip("llm_title")
+                title = rule_based_title(query)
         else:
             title = "No Graph Results Found"
         
@@ -219,8 +265,10 @@ def process_neo4j_query(db_name, host, user, password, database, query, llm, dri
             "database_type": "neo4j",
             "agent_thought_process": thought_process
         }
+        if budget is not None:
+            result["budget"] = budget.report()
         
-        print(f"[DEBUG] Final Neo4j result structure: user_query={result['user_query']}, cypher_query={result['cypher_query']}, graph_result_count={len(result['graph_result'])}, summary={result['summary'][:50]}...")
+        print(f"[DEBUG] Final Neo4j result structure: user_query={result['user_query']}, cypher_query={result['cypher_query']}, graph_result_count={len(result['graph_result'])}, summary={(result['summary'] or '')[:50]}...")
         
         return result
         
@@ -242,23 +290,13 @@ def chat_neo4j(db_name, host, user, password, database, query):
     
     print(f"[DEBUG] chat_neo4j called with: db_name={db_name}, host={host}, user={user}, database={database}, query={query}")
     
-    if not groq_api_key_5:
-        print(f"[ERROR] GROQ API key not found: {groq_api_key_5}")
+    if not groq_api_keys:
+        print(f"[ERROR] GROQ API key not found")
         raise HTTPException(status_code=500, detail="GROQ API key not found in environment variables")
     
-    print(f"[DEBUG] GROQ API key found: {groq_api_key_5[:10]}...")
+    print(f"[DEBUG] GROQ API keys found: {', '.join(groq_api_keys)}")
     
     try:
-        # Initialize LLM
-        print("[DEBUG] Initializing LLM...")
-        llm = ChatGroq(
-            api_key=SecretStr(groq_api_key_5),
-            model="llama-3.3-70b-versatile",
-            streaming=False,
-            temperature=0.1
-        )
-        print("[DEBUG] LLM initialized successfully")
-        
         # Connect to Neo4j
         print(f"[DEBUG] Connecting to Neo4j with host: {host}")
         db_connection, _ = configure_db(db_name, host, user, password, database)
@@ -269,7 +307,7 @@ def chat_neo4j(db_name, host, user, password, database, query):
             raise HTTPException(status_code=500, detail="Invalid Neo4j connection returned")
         
         print("[DEBUG] Calling process_neo4j_query...")
-        result = process_neo4j_query(db_name, host, user, password, database, query, llm, db_connection)
+        result = process_neo4j_query(db_name, host, user, password, database, query, db_connection)
         print(f"[DEBUG] process_neo4j_query returned: {type(result)}")
         
         # Close Neo4j driver safely
@@ -0,0 +1,147 @@
+"""
+Query Template Compiler
+Compiles the question patterns of db.generate_natural_language_queries straight
+to SQL for a given schema, so such questions never reach the LLM:
+1. Every generated question is precompiled per database when the schema catalog
+   (re)builds a snapshot
+2. User questions are matched exactly against the precompiled set first, then
+   against the same patterns with light phrasing variations
+3. Answers get a deterministic title and summary, so a template question costs
+   one database round trip
+"""
+
+import re
+import logging
+import threading
+from typing import List, Dict, Optional, Any, Tuple
+
+from utils.db import generate_natural_language_queries, normalize_question
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, database_key_from_config
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_ROW_LIMIT = 100
+
+_TABLE = r"(?:the )?'?(?P<table>[\w.$]+)'?(?: table)?"
+
+# Patterns mirror generate_natural_language_queries; they run on normalize_question() output
+TEMPLATE_PATTERNS = [
+    ("count", re.compile(rf"^how many (?:records|rows|entries) (?:are there )?in {_TABLE}$")),
+    ("average", re.compile(rf"^what is the average (?:of )?(?P<column>[\w$]+) in {_TABLE}$")),
+    ("details", re.compile(rf"^(?:what are the details of|show me|list) all (?:records|rows) (?:in|from) {_TABLE}$")),
+    ("columns", re.compile(rf"^show me all (?P<columns>[\w$]+(?:, [\w$]+)+) from {_TABLE}$")),
+    ("column", re.compile(rf"^(?:give me|show me) (?:the |all )?(?P<column>[\w$]+) from {_TABLE}$")),
+]
+
+
+class CompiledQuery:
+    def __init__(self, kind: str, sql: str, table: str, columns: List[str]):
+        self.kind = kind
+        self.sql = sql
+        self.table = table
+        self.columns = columns
+
+    def describe(self, rows: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """Deterministic (title, summary) for the result of this query"""
+        if self.kind == "count":
+            count = next(iter(rows[0].values())) if rows else 0
+            return f"Record Count in {self.table}", f"There are {count} records in the {self.table} table."
+        if self.kind == "average":
+            value = next(iter(rows[0].values())) if rows else None
+            return (f"Average {self.columns[0]} in {self.table}",
+                    f"The average {self.columns[0]} in the {self.table} table is {value}.")
+        shown = f"first {len(rows)}" if len(rows) >= TEMPLATE_ROW_LIMIT else f"{len(rows)}"
+        return f"{self.table.title()} Records", f"Showing the {shown} records from the {self.table} table."
+
+
+class TemplateCompiler:
+    def __init__(self):
+        self._compiled: Dict[str, Dict[str, CompiledQuery]] = {}
+        self._snapshots: Dict[str, SchemaSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, snapshot: SchemaSnapshot, table: str, columns: List[str]) -> Optional[Tuple[str, List[str]]]:
+        """Map case-insensitive table/column names onto the snapshot, None if any is unknown"""
+        tables = {name.lower(): name for name in snapshot.tables}
+        table_name = tables.get(table.lower())
+        if table_name is None:
+            return None
+        known = {col["name"].lower(): col["name"] for col in snapshot.columns(table_name)}
+        resolved = [known.get(col.lower()) for col in columns]
+        if any(col is None for col in resolved):
+            return None
+        return table_name, resolved
+
+    def compile(self, snapshot: SchemaSnapshot, question: str) -> Optional[CompiledQuery]:
+        """Compile one question against a schema, or None if it matches no template"""
+        normalized = normalize_question(question)
+        for kind, pattern in TEMPLATE_PATTERNS:
+            match = pattern.match(normalized)
+            if not match:
+                continue
+            slots = match.groupdict()
+            if slots.get("columns"):
+                columns = [c.strip() for c in slots["columns"].split(",")]
+            elif slots.get("column"):
+                columns = [slots["column"]]
+            else:
+                columns = []
+            resolved = self._resolve(snapshot, slots["table"], columns)
+            if resolved is None:
+                continue
+            table, columns = resolved
+            return CompiledQuery(kind, self._sql(snapshot, kind, table, columns), table, columns)
+        return None
+
+    def _sql(self, snapshot: SchemaSnapshot, kind: str, table: str, columns: List[str]) -> str:
+        engine = get_schema_catalog().engine(snapshot.key)
+        quote = engine.dialect.identifier_preparer.quote if engine is not None else (lambda name: name)
+        source = quote(table)
+        if kind == "count":
+            return f"SELECT COUNT(*) AS record_count FROM {source}"
+        if kind == "average":
+            return f"SELECT AVG({quote(columns[0])}) AS {quote('average_' + columns[0])} FROM {source}"
+        if kind == "details":
+            return f"SELECT * FROM {source} LIMIT {TEMPLATE_ROW_LIMIT}"
+        return f"SELECT {', '.join(quote(c) for c in columns)} FROM {source} LIMIT {TEMPLATE_ROW_LIMIT}"
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: precompile every generated question for the database"""
+        compiled = {}
+        for question in generate_natural_language_queries(snapshot.column_map()):
+            query = self.compile(snapshot, question)
+            if query is not None:
+                compiled[normalize_question(question)] = query
+        with self._lock:
+            self._compiled[snapshot.key] = compiled
+            self._snapshots[snapshot.key] = snapshot
+        logger.info(f"🧩 Compiled {len(compiled)} template questions for {snapshot.key}")
+
+    def questions(self, database_config: Dict[str, Any]) -> List[str]:
+        """Precompiled questions of a database (in generation order)"""
+        compiled = self._compiled.get(database_key_from_config(database_config), {})
+        return list(compiled.keys())
+
+    def match(self, database_config: Dict[str, Any], question: str) -> Optional[CompiledQuery]:
+        """Compiled SQL for a user question, or None if it should go to the LLM"""
+        if not database_config:
+            return None
+        key = database_key_from_config(database_config)
+        snapshot = self._snapshots.get(key)
+        current = get_schema_catalog().get(key)
+        if snapshot is None or current is None or current.fingerprint != snapshot.fingerprint:
+            return None
+        compiled = self._compiled.get(key, {}).get(normalize_question(question))
+        return compiled or self.compile(snapshot, question)
+
+
+# Global template compiler instance
+_template_compiler = None
+
+def get_template_compiler() -> TemplateCompiler:
+    """Get or create the global template compiler and subscribe it to schema changes"""
+    global _template_compiler
+    if _template_compiler is None:
+        _template_compiler = TemplateCompiler()
+        get_schema_catalog().add_listener(_template_compiler.on_schema_snapshot)
+    return _template_compiler
@@ -362,6 +362,128 @@ Generate a SQL query that follows similar patterns to the examples provided whil
         except Exception as e:
             self.logger.warning(f"⚠️ Could not store RAG feedback: {e}")
     
+    @staticmethod
+    def _database_stages(database_config: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Aggregation stages keeping only messages of sessions on this database (host/dbname/dbtype)"""
+        if not database_config or not database_config.get("dbname"):
+            return []
+        # Messages only reference their session; the session references the database
+        return [
+            {"$lookup": {"from": "querysessions", "localField": "session", "foreignField": "_id", "as": "session_doc"}},
+            {"$unwind": "$session_doc"},
+            {"$lookup": {"from": "databases", "localField": "session_doc.database", "foreignField": "_id", "as": "database_doc"}},
+            {"$unwind": "$database_doc"},
+            {"$match": {
+                "database_doc.database": database_config.get("dbname"),
+                "database_doc.host": database_config.get("host"),
+                "database_doc.dbType": database_config.get("dbtype"),
+            }},
+        ]
+
+    def get_sql_history(self, database_config: Optional[Dict[str, Any]] = None, days: Optional[int] = None,
+                        limit: int = 2000) -> List[Dict[str, Any]]:
+        """
+        Distinct generated SQL of past answers with how often and how slowly it ran
+
+        Args:
+            database_config: Restrict history to sessions on this database (host/dbname/dbtype)
+            days: Only consider answers from the last N days (recent_days if omitted)
+            limit: Maximum number of distinct queries returned (most frequent first)
+
+        Returns:
+            List of {"sql", "count", "avg_execution_ms", "max_execution_ms", "last_used"}
+        """
+        if self.query_collection is None:
+            return []
+
+        try:
+            pipeline: List[Dict[str, Any]] = [
+                {"$match": {
+                    "createdAt": {"$gte": datetime.now() - timedelta(days=days or self.recent_days)},
+                    "sqlQuery": {"$exists": True, "$nin": [None, ""]},
+                    "executionTime": {"$exists": True, "$ne": None},
+                }},
+            ]
+            pipeline.extend(self._database_stages(database_config))
+            pipeline.extend([
+                {"$group": {
+                    "_id": {"$trim": {"input": "$sqlQuery"}},
+                    "count": {"$sum": 1},
+                    "avg_execution_ms": {"$avg": "$executionTime"},
+                    "max_execution_ms": {"$max": "$executionTime"},
+                    "last_used": {"$max": "$createdAt"},
+                }},
+                {"$sort": {"count": -1, "avg_execution_ms": -1}},
+                {"$limit": limit},
+            ])
+            return [
+                {
+                    "sql": doc["_id"],
+                    "count": doc["count"],
+                    "avg_execution_ms": doc["avg_execution_ms"],
+                    "max_execution_ms": doc["max_execution_ms"],
+                    "last_used": doc["last_used"].isoformat(),
+                }
+                for doc in self.query_collection.aggregate(pipeline)
+            ]
+
+        except Exception as e:
+            self.logger.warning(f"⚠️ Could not load SQL history: {e}")
+            return []
+
+    def get_popular_queries(self, database_config: Optional[Dict[str, Any]] = None, limit: int = 100,
+                            half_life_days: float = 7.0) -> List[Dict[str, Any]]:
+        """
+        Rank past questions by frequency and recency (exponential decay)
+
+        Args:
+            database_config: Restrict history to sessions on this database (host/dbname/dbtype)
+            limit: Maximum number of questions returned
+            half_life_days: Age at which a past question counts half as much
+
+        Returns:
+            List of {"query", "count", "last_used", "score"} sorted by score
+        """
+        if self.query_collection is None:
+            return []
+
+        try:
+            pipeline: List[Dict[str, Any]] = [
+                {"$match": {
+                    "createdAt": {"$gte": datetime.now() - timedelta(days=self.recent_days)},
+                    "requestQuery": {"$exists": True, "$ne": ""},
+                    "sqlQuery": {"$exists": True, "$ne": None},
+                }},
+            ]
+            pipeline.extend(self._database_stages(database_config))
+            pipeline.extend([
+                {"$group": {
+                    "_id": {"$toLower": {"$trim": {"input": "$requestQuery"}}},
+                    "query": {"$last": "$requestQuery"},
+                    "count": {"$sum": 1},
+                    "last_used": {"$max": "$createdAt"},
+                }},
+                {"$sort": {"count": -1, "last_used": -1}},
+                {"$limit": limit * 3},
+            ])
+
+            now = datetime.now()
+            ranked = []
+            for doc in self.query_collection.aggregate(pipeline):
+                age_days = max((now - doc["last_used"]).total_seconds() / 86400, 0.0)
+                ranked.append({
+                    "query": doc["query"].strip(),
+                    "count": doc["count"],
+                    "last_used": doc["last_used"].isoformat(),
+                    "score": doc["count"] * 0.5 ** (age_days / half_life_days),
+                })
+            ranked.sort(key=lambda x: x["score"], reverse=True)
+            return ranked[:limit]
+
+        except Exception as e:
+            self.logger.warning(f"⚠️ Could not load popular queries: {e}")
+            return []
+
     def get_rag_stats(self) -> Dict[str, Any]:
         """Get statistics about RAG usage and effectiveness"""
         if self.query_collection is None:
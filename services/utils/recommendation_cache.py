@@ -0,0 +1,208 @@
+"""
+Recommendation Cache
+Serves /recommend for SQL databases without an LLM call on every page load:
+1. Recommendations are cached per database and schema fingerprint
+2. Stale entries (TTL expired or schema changed) are served immediately while
+   a single background regeneration runs (stale-while-revalidate)
+3. The LLM is asked for JSON-mode output, parsed once
+4. Optionally each question comes with SQL that is validated against the schema
+   and dry-run (EXPLAIN) before it is cached, so the chat pipeline can answer a
+   clicked recommendation directly
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional, Any
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from utils.db import is_valid_sql, normalize_question
+from utils.llm_gateway import get_llm_gateway
+from utils.llm_scheduler import BACKGROUND
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, database_key_from_config
+from utils.schema_linker import get_schema_linker
+from utils.sql_validator import get_sql_validator
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_TTL_SECONDS = 6 * 3600
+RECOMMENDATION_COUNT = 10
+RECOMMENDATION_MODEL = "llama-3.1-8b-instant"
+RECOMMENDATION_SCHEMA_TOKENS = 2000
+
+DB_VERSIONS = {"postgresql": "PostgreSQL", "mysql": "MySQL 8.0"}
+
+
+def parse_recommendations(content: Optional[str]) -> List[Dict[str, Any]]:
+    """Parse JSON-mode output: {"recommendations": [{"question": ..., "sql": ...}]} or a list of strings"""
+    if not content:
+        return []
+    parsed = json.loads(content)
+    if isinstance(parsed, dict):
+        parsed = next((v for v in parsed.values() if isinstance(v, list)), [])
+    recommendations = []
+    for item in parsed:
+        if isinstance(item, str):
+            recommendations.append({"question": item.strip(), "sql": None})
+        elif isinstance(item, dict) and item.get("question"):
+            recommendations.append({"question": str(item["question"]).strip(), "sql": item.get("sql")})
+    return recommendations
+
+
+class _CacheEntry:
+    def __init__(self, fingerprint: str, questions: List[str], sql: Dict[str, str]):
+        self.fingerprint = fingerprint
+        self.questions = questions
+        self.sql = sql  # normalized question -> pre-validated SQL
+        self.generated_at = time.time()
+
+
+class RecommendationCache:
+    def __init__(self, ttl: int = RECOMMENDATION_TTL_SECONDS, prevalidate: Optional[bool] = None):
+        self.ttl = ttl
+        if prevalidate is None:
+            prevalidate = os.getenv("RECOMMENDATION_PREVALIDATE", "true").lower() in ("1", "true", "yes")
+        self.prevalidate = prevalidate
+        self._entries: Dict[str, _CacheEntry] = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="recommendations")
+
+    def _prompt(self, snapshot: SchemaSnapshot) -> str:
+        db_version = DB_VERSIONS.get(snapshot.dbtype, snapshot.dbtype)
+        if self.prevalidate:
+            shape = (
+                'Return a JSON object {"recommendations": [{"question": "...", "sql": "..."}]} where sql is a '
+                f"single read-only SELECT statement in {db_version} syntax that answers the question."
+            )
+        else:
+            shape = 'Return a JSON object {"recommendations": ["question", ...]}.'
+        return f"""
+        Given the following database schema:
+        {get_schema_linker().link_snapshot(snapshot, token_budget=RECOMMENDATION_SCHEMA_TOKENS).ddl}
+
+        Generate {RECOMMENDATION_COUNT} natural language queries that a business user might ask about this database.
+        Each query should be a single sentence and should be relevant to the schema provided.
+        Avoid complex queries or technical jargon. The query should be simple and understandable.
+        Each query should be clear and answerable using SQL.
+        {shape}
+        """
+
+    def _dry_run(self, engine, snapshot: SchemaSnapshot, sql: str) -> bool:
+        """Validate the SQL against the schema, then EXPLAIN it without executing it"""
+        if not is_valid_sql(sql):
+            return False
+        validation = get_sql_validator().validate(sql, snapshot.dbtype, snapshot)
+        if not validation.valid:
+            logger.info(f"🔎 Recommendation SQL rejected by validation: {[issue.message for issue in validation.issues]}")
+            return False
+        try:
+            with engine.connect() as connection:
+                connection.execute(text(f"EXPLAIN {sql.strip().rstrip(';')}"))
+            return True
+        except Exception as e:
+            logger.info(f"🔎 Recommendation SQL rejected by dry run: {e}")
+            return False
+
+    def _generate(self, snapshot: SchemaSnapshot) -> _CacheEntry:
+        try:
+            content = get_llm_gateway().complete(
+                [
+                    {"role": "system", "content": "You are a database expert that helps generate natural language queries."},
+                    {"role": "user", "content": self._prompt(snapshot)}
+                ],
+                model=RECOMMENDATION_MODEL,
+                temperature=0.7,
+                max_tokens=2048 if self.prevalidate else 1024,
+                json_mode=True,
+                priority=BACKGROUND
+            )
+            recommendations = parse_recommendations(content)
+
+            questions, sql = [], {}
+            engine = get_schema_catalog().engine(snapshot.key)
+            for item in recommendations:
+                if self.prevalidate and item["sql"] and engine is not None:
+                    # Questions whose SQL fails the dry run are still recommended, they just go through the agent
+                    if self._dry_run(engine, snapshot, item["sql"]):
+                        sql[normalize_question(item["question"])] = item["sql"].strip().rstrip(';')
+                questions.append(item["question"])
+
+            entry = _CacheEntry(snapshot.fingerprint, questions, sql)
+            with self._lock:
+                self._entries[snapshot.key] = entry
+            logger.info(f"💡 Recommendations generated for {snapshot.key}: {len(questions)} questions, {len(sql)} with validated SQL")
+            return entry
+        finally:
+            with self._lock:
+                self._pending.pop(snapshot.key, None)
+
+    def _schedule(self, snapshot: SchemaSnapshot) -> Future:
+        with self._lock:
+            pending = self._pending.get(snapshot.key)
+            if pending is None:
+                pending = self._executor.submit(self._generate, snapshot)
+                self._pending[snapshot.key] = pending
+            return pending
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: regenerate recommendations of databases already served"""
+        entry = self._entries.get(snapshot.key)
+        if entry is not None and entry.fingerprint != snapshot.fingerprint:
+            self._schedule(snapshot)
+
+    def get(self, snapshot: SchemaSnapshot) -> Dict[str, Any]:
+        """
+        Recommendations for a database, blocking only when nothing is cached yet.
+
+        Returns:
+            {"recommended_queries": [...], "cached": bool, "stale": bool, "generated_at": float}
+        """
+        entry = self._entries.get(snapshot.key)
+        if entry is None:
+            entry = self._schedule(snapshot).result()
+            return {"recommended_queries": entry.questions, "cached": False, "stale": False, "generated_at": entry.generated_at}
+
+        stale = entry.fingerprint != snapshot.fingerprint or time.time() - entry.generated_at > self.ttl
+        if stale:
+            self._schedule(snapshot)
+        return {"recommended_queries": entry.questions, "cached": True, "stale": stale, "generated_at": entry.generated_at}
+
+    def lookup_sql(self, database_config: Dict[str, Any], question: str) -> Optional[str]:
+        """Pre-validated SQL for a recommended question, if its schema is still current"""
+        if not database_config:
+            return None
+        key = database_key_from_config(database_config)
+        entry = self._entries.get(key)
+        if entry is None or not entry.sql:
+            return None
+        snapshot = get_schema_catalog().get(key)
+        if snapshot is None or snapshot.fingerprint != entry.fingerprint:
+            return None
+        return entry.sql.get(normalize_question(question))
+
+    def discard_sql(self, database_config: Dict[str, Any], question: str):
+        """Forget the SQL of a recommended question that failed to execute; the question stays recommended"""
+        entry = self._entries.get(database_key_from_config(database_config or {}))
+        if entry is not None and entry.sql:
+            with self._lock:
+                entry.sql.pop(normalize_question(question), None)
+
+
+# Global recommendation cache instance
+_recommendation_cache = None
+
+def get_recommendation_cache() -> RecommendationCache:
+    """Get or create the global recommendation cache and subscribe it to schema changes"""
+    global _recommendation_cache
+    if _recommendation_cache is None:
+        _recommendation_cache = RecommendationCache()
+        get_schema_catalog().add_listener(_recommendation_cache.on_schema_snapshot)
+    return _recommendation_cache
@@ -0,0 +1,97 @@
+"""
+Request Coalescer
+Singleflight for the chat and recommendation endpoints:
+1. Concurrent requests with the same key (database identity + normalized
+   question, for example) attach to one in-flight computation and share its
+   result or its error
+2. The computation runs as its own task, so a caller that disconnects or times
+   out does not cancel it for the others
+3. Keys include a hash of the credentials: a request only shares results with
+   requests that could have run the same query themselves
+"""
+
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Optional, Any, Callable, Awaitable
+
+from utils.db import normalize_question
+from utils.schema_cache import database_key_from_config
+
+logger = logging.getLogger(__name__)
+
+
+def coalescing_key(namespace: str, *parts: Any) -> str:
+    """Stable key of a request: namespace plus a hash of its JSON-serializable parts"""
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+def database_identity(database_config: Dict[str, Any]) -> str:
+    """Catalog key of a database plus a hash of the credentials and URI used to reach it"""
+    credentials = hashlib.sha1(
+        f"{database_config.get('password', '')}\n{database_config.get('uri') or ''}".encode()
+    ).hexdigest()
+    return f"{database_key_from_config(database_config)}#{credentials}"
+
+
+def question_key(namespace: str, database_config: Dict[str, Any], question: str, *options: Any) -> str:
+    """Key of a question about a database; options are anything else that changes the response"""
+    return coalescing_key(namespace, database_identity(database_config), normalize_question(question), *options)
+
+
+class RequestCoalescer:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, key: str, field: str):
+        namespace = key.split(":", 1)[0]
+        counts = self.stats.setdefault(namespace, {"computed": 0, "coalesced": 0})
+        counts[field] += 1
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Result of compute() for this key, shared with every concurrent caller of the same key.
+
+        Args:
+            key: Dedupe key (see coalescing_key / question_key)
+            compute: Coroutine factory, only called when no computation for the key is in flight
+            timeout: Longest this caller waits (the shared computation keeps running)
+
+        Raises:
+            asyncio.TimeoutError: The result was not ready within timeout
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self._count(key, "computed")
+        else:
+            self._count(key, "coalesced")
+            logger.info(f"🔗 Attached to in-flight request {key}")
+        # Shielded: one caller giving up must not cancel the computation for the others
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the error retrieved when every caller has already given up
+            task.exception()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._inflight), "namespaces": {k: dict(v) for k, v in self.stats.items()}}
+
+
+# Global request coalescer instance
+_request_coalescer = None
+
+def get_request_coalescer() -> RequestCoalescer:
+    """Get or create global request coalescer instance"""
+    global _request_coalescer
+    if _request_coalescer is None:
+        _request_coalescer = RequestCoalescer()
+    return _request_coalescer
@@ -0,0 +1,241 @@
+"""
+Query Result Cache
+Reuses the rows of a SQL query while the data behind it is unchanged:
+1. Entries are keyed by database identity (catalog key plus a credentials hash)
+   and the whitespace-normalized SQL fingerprint
+2. Each entry records a cheap data version read before the query ran, and is
+   served only while that version still matches:
+   - PostgreSQL: n_tup_ins/upd/del and relfilenode (TRUNCATE, rewrites) of the
+     tables named in the query from pg_stat_user_tables; the WAL LSN when the
+     query reads views or no user table
+   - MySQL: information_schema.tables.UPDATE_TIME of the named tables (of the
+     whole schema when the query reads views)
+   - Anything else: a short TTL
+3. Rows are stored as zlib-compressed JSON (columns once, rows as lists), in an
+   LRU bounded by total compressed bytes
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any, Tuple
+
+from sqlalchemy import bindparam, text
+
+from utils.schema_cache import SchemaSnapshot, credential_hash, database_key, get_schema_catalog
+from utils.sql_toolkit import sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+# Statistics counters are flushed lazily, so even versioned entries are re-read after this long
+RESULT_CACHE_MAX_AGE_SECONDS = float(os.getenv("RESULT_CACHE_MAX_AGE_SECONDS", "300"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "30"))
+
+CACHEABLE_SQL = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# Results of these change without any write, so they are only kept for the TTL
+VOLATILE_SQL = re.compile(
+    r"\b(now|random|rand|uuid|gen_random_uuid|clock_timestamp|statement_timestamp|sysdate|curdate|curtime|"
+    r"utc_timestamp|current_timestamp|current_date|current_time|localtime|localtimestamp)\b",
+    re.IGNORECASE,
+)
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+
+POSTGRES_VERSION_QUERY = text("""
+    SELECT
+      (SELECT COUNT(*) FROM pg_class c
+        WHERE c.relkind IN ('v', 'm', 'p', 'f') AND c.relname IN :names) AS opaque,
+      (SELECT COUNT(*) FROM pg_stat_user_tables s WHERE s.relname IN :names) AS tables,
+      (SELECT COALESCE(SUM(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0)::text || '/' ||
+              COALESCE(string_agg(c.relfilenode::text, ',' ORDER BY c.oid), '')
+         FROM pg_stat_user_tables s JOIN pg_class c ON c.oid = s.relid
+        WHERE s.relname IN :names) AS counters,
+      (CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END)::text AS lsn
+""").bindparams(bindparam("names", expanding=True))
+
+MYSQL_VERSION_QUERY = text("""
+    SELECT TABLE_NAME, TABLE_TYPE, UPDATE_TIME, NOW()
+    FROM information_schema.tables
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :names
+""").bindparams(bindparam("names", expanding=True))
+
+MYSQL_SCHEMA_VERSION_QUERY = text("""
+    SELECT MAX(UPDATE_TIME), NOW(), COUNT(*)
+    FROM information_schema.tables
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+""")
+
+
+def engine_identity(engine) -> Tuple[str, str]:
+    """(catalog database key, credentials hash) of an engine"""
+    url = engine.url
+    host = f"{url.host}:{url.port}" if url.port else (url.host or "")
+    key = database_key(engine.dialect.name, host, url.username or "", url.database or "", url.password)
+    return key, credential_hash(url.password)
+
+
+def referenced_names(sql: str) -> List[str]:
+    """Every identifier in the query: a superset of the tables it reads (extra names only make versions stricter)"""
+    return sorted({name for name in IDENTIFIER.findall(sql)} | {name.lower() for name in IDENTIFIER.findall(sql)})
+
+
+def _postgres_version(connection, names: List[str]) -> Optional[str]:
+    row = connection.execute(POSTGRES_VERSION_QUERY, {"names": names}).fetchone()
+    opaque, tables, counters, lsn = row
+    # Views hide the tables they read, and queries without user tables read the catalog: any write counts
+    if opaque or not tables:
+        return f"lsn:{lsn}"
+    return f"tables:{counters}"
+
+
+def _mysql_version(connection, names: List[str]) -> Optional[str]:
+    try:
+        # MySQL 8 caches information_schema statistics (UPDATE_TIME) for a day by default
+        connection.exec_driver_sql("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        pass
+    rows = connection.execute(MYSQL_VERSION_QUERY, {"names": names}).fetchall()
+    if not rows or any(table_type != "BASE TABLE" for _, table_type, _, _ in rows):
+        updated, now, count = connection.execute(MYSQL_SCHEMA_VERSION_QUERY).fetchone()
+        stamps = [updated] if count else []
+    else:
+        stamps = [updated for _, _, updated, _ in rows]
+        now = rows[0][3]
+    # UPDATE_TIME has one-second resolution: a write in the current second may not show yet
+    if any(stamp is not None and (now - stamp).total_seconds() < 1 for stamp in stamps):
+        return None
+    if not rows:
+        return f"schema:{stamps[0] if stamps else None}"
+    return "tables:" + ",".join(f"{name}={updated}" for name, _, updated, _ in sorted(rows))
+
+
+class _ResultEntry:
+    __slots__ = ("version", "payload", "row_count", "stored_at", "expires_at")
+
+    def __init__(self, version: Optional[str], payload: bytes, row_count: int, expires_at: float):
+        self.version = version
+        self.payload = payload
+        self.row_count = row_count
+        self.stored_at = time.time()
+        self.expires_at = expires_at
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # (database key, credentials hash, SQL fingerprint) -> entry, least recently used first
+        self._entries: "OrderedDict[Tuple[str, str, str], _ResultEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "stored": 0, "evicted": 0, "uncacheable": 0}
+
+    @staticmethod
+    def cacheable(sql: str) -> bool:
+        return bool(CACHEABLE_SQL.match(sql))
+
+    def data_version(self, connection, sql: str) -> Tuple[bool, Optional[str]]:
+        """
+        Data version of the tables a query reads.
+
+        Returns:
+            (cacheable, version): version None means the entry lives for the TTL only;
+            cacheable False means the data is changing right now
+        """
+        dialect = connection.dialect.name
+        names = referenced_names(sql)
+        try:
+            if dialect == "postgresql":
+                # In a savepoint: a failure must not abort the transaction the query runs in
+                with connection.begin_nested():
+                    return True, _postgres_version(connection, names)
+            if dialect == "mysql":
+                version = _mysql_version(connection, names)
+                return version is not None, version
+        except Exception as e:
+            # Without a version (e.g. no access to the statistics views) entries fall back to the TTL
+            logger.debug(f"Could not read data version: {e}")
+        return True, None
+
+    def lookup(self, engine, connection, sql: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+        """
+        Cached rows of a query, or None with the ticket to store() its fresh rows under.
+
+        Returns:
+            (rows, None) on a hit, (None, ticket) on a miss, (None, None) if the query can't be cached
+        """
+        if not self.cacheable(sql):
+            return None, None
+        cacheable, version = self.data_version(connection, sql)
+        if not cacheable:
+            with self._lock:
+                self.stats["uncacheable"] += 1
+            return None, None
+        cache_key = (*engine_identity(engine), sql_fingerprint(connection.dialect.name, sql))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry.version == version and now < entry.expires_at:
+                self._entries.move_to_end(cache_key)
+                self.stats["hits"] += 1
+                payload = entry.payload
+            else:
+                if entry is not None:
+                    self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                payload = None
+        if payload is None:
+            ttl = RESULT_CACHE_TTL_SECONDS if version is None or VOLATILE_SQL.search(sql) else RESULT_CACHE_MAX_AGE_SECONDS
+            return None, {"key": cache_key, "version": version, "expires_at": now + ttl}
+        data = json.loads(zlib.decompress(payload))
+        return [dict(zip(data["columns"], row)) for row in data["rows"]], None
+
+    def store(self, ticket: Optional[Dict[str, Any]], columns: List[str], rows: List[Dict[str, Any]]):
+        """Keep the rows of a missed lookup (rows must already be JSON-safe)"""
+        if ticket is None:
+            return
+        payload = zlib.compress(json.dumps(
+            {"columns": list(columns), "rows": [[row[col] for col in columns] for row in rows]},
+            separators=(",", ":"), default=str
+        ).encode())
+        if len(payload) > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(ticket["key"], None)
+            if previous is not None:
+                self._bytes -= len(previous.payload)
+            self._entries[ticket["key"]] = _ResultEntry(ticket["version"], payload, len(rows), ticket["expires_at"])
+            self._bytes += len(payload)
+            self.stats["stored"] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.payload)
+                self.stats["evicted"] += 1
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: results of a database whose schema changed are dropped"""
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == snapshot.key]:
+                self._bytes -= len(self._entries.pop(cache_key).payload)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes, **self.stats}
+
+
+# Global result cache instance
+_result_cache = None
+
+def get_result_cache() -> ResultCache:
+    """Get or create the global result cache and subscribe it to schema changes"""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+        get_schema_catalog().add_listener(_result_cache.on_schema_snapshot)
+    return _result_cache
@@ -0,0 +1,319 @@
+"""
+Schema Catalog Cache
+Keeps an in-memory snapshot of every connected database's schema so request
+handlers don't reflect it on each call:
+1. Snapshots are built in the background the first time a database is seen
+2. A cheap fingerprint (hash of information_schema.columns) is re-checked on a
+   TTL, and the snapshot is rebuilt only when the schema actually changed
+3. Listeners (suggestion index, completion engine, ...) are notified after
+   every (re)build so they can precompute their own per-database structures
+4. Entries are keyed by the credentials too, and a request is only served
+   cached data after its credentials opened a connection (re-checked on a TTL)
+"""
+
+import os
+import hmac
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional, Any, Callable
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import NullPool
+
+from utils.db import configure_db
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_TTL_SECONDS = 60
+CREDENTIAL_CHECK_TTL_SECONDS = 60
+
+# Keys end up in logs and on disk (value index directories): credentials are only part of them as a keyed hash
+_CREDENTIAL_SECRET = os.getenv("SCHEMA_CATALOG_SECRET", "").encode() or os.urandom(32)
+
+COLUMNS_QUERY = {
+    "postgresql": """
+        SELECT c.table_name, c.column_name, c.data_type, c.is_nullable
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        WHERE c.table_schema = current_schema() AND t.table_type = 'BASE TABLE'
+        ORDER BY c.table_name, c.ordinal_position
+    """,
+    "mysql": """
+        SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.IS_NULLABLE
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+        WHERE c.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+        ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+    """,
+}
+
+
+NUMERIC_TYPE_HINTS = ['int', 'float', 'double', 'decimal', 'numeric', 'real', 'money']
+TEMPORAL_TYPE_HINTS = ['date', 'time', 'year']
+TEXT_TYPE_HINTS = ['char', 'text', 'enum', 'string']
+
+
+def is_numeric_type(type_name: str) -> bool:
+    type_name = type_name.lower()
+    return any(hint in type_name for hint in NUMERIC_TYPE_HINTS) and 'interval' not in type_name
+
+
+def is_temporal_type(type_name: str) -> bool:
+    return any(hint in type_name.lower() for hint in TEMPORAL_TYPE_HINTS)
+
+
+def is_text_type(type_name: str) -> bool:
+    return any(hint in type_name.lower() for hint in TEXT_TYPE_HINTS)
+
+
+def credential_hash(password: Optional[str]) -> str:
+    return hmac.new(_CREDENTIAL_SECRET, (password or "").encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def database_key(dbtype: str, host: str, user: str, dbname: str, password: Optional[str] = None) -> str:
+    """Identity of a database connection, including a hash of the password used to reach it"""
+    return f"{dbtype}://{user}@{host}/{dbname}#{credential_hash(password)}"
+
+
+def database_key_from_config(database_config: Dict[str, Any]) -> str:
+    return database_key(
+        database_config.get("dbtype", ""), database_config.get("host", ""),
+        database_config.get("user", ""), database_config.get("dbname", ""),
+        database_config.get("password")
+    )
+
+
+def database_label(key: str) -> str:
+    """A database key without its credentials hash, for display and per-database settings"""
+    return key.split("#", 1)[0]
+
+
+class DatabaseAuthenticationError(HTTPException):
+    """The credentials of a request could not open a connection to its database"""
+
+    def __init__(self, label: str, reason: Any):
+        super().__init__(status_code=401, detail=f"Could not connect to {label} with the given credentials: {reason}")
+
+
+class SchemaSnapshot:
+    def __init__(self, key: str, dbtype: str, fingerprint: str, tables: Dict[str, List[Dict[str, Any]]],
+                 foreign_keys: Dict[str, List[Dict[str, Any]]], primary_keys: Dict[str, List[str]],
+                 indexes: Dict[str, List[Dict[str, Any]]], comments: Optional[Dict[str, str]] = None):
+        self.key = key
+        self.dbtype = dbtype
+        self.fingerprint = fingerprint
+        self.tables = tables              # table -> [{"name", "type", "nullable", optional "comment"}]
+        self.foreign_keys = foreign_keys  # table -> [{"columns", "referred_table", "referred_columns"}]
+        self.primary_keys = primary_keys  # table -> [column]
+        self.indexes = indexes            # table -> [{"name", "columns", "unique"}]
+        self.comments = comments or {}    # table -> table comment
+        self.built_at = time.time()
+
+    def column_map(self) -> Dict[str, List[str]]:
+        """Same shape as get_database_schema(): table -> column names"""
+        return {table: [col["name"] for col in columns] for table, columns in self.tables.items()}
+
+    def columns(self, table: str) -> List[Dict[str, Any]]:
+        return self.tables.get(table, [])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "dbtype": self.dbtype,
+            "fingerprint": self.fingerprint,
+            "tables": self.tables,
+            "foreign_keys": self.foreign_keys,
+            "primary_keys": self.primary_keys,
+            "indexes": self.indexes,
+            "comments": self.comments,
+            "built_at": self.built_at,
+        }
+
+
+class _CatalogEntry:
+    def __init__(self, engine, dbtype: str):
+        self.engine = engine
+        self.dbtype = dbtype
+        self.snapshot: Optional[SchemaSnapshot] = None
+        self.checked_at = 0.0
+        self.verified_at = 0.0
+        self.pending: Optional[Future] = None
+
+
+class SchemaCatalog:
+    def __init__(self, fingerprint_ttl: int = FINGERPRINT_TTL_SECONDS,
+                 credential_ttl: int = CREDENTIAL_CHECK_TTL_SECONDS, max_workers: int = 2):
+        self.fingerprint_ttl = fingerprint_ttl
+        self.credential_ttl = credential_ttl
+        self._entries: Dict[str, _CatalogEntry] = {}
+        self._listeners: List[Callable[[SchemaSnapshot], None]] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="schema-catalog")
+
+    def add_listener(self, listener: Callable[[SchemaSnapshot], None]):
+        """Register a callback run (in the background) after every snapshot (re)build"""
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def get(self, key: str) -> Optional[SchemaSnapshot]:
+        entry = self._entries.get(key)
+        return entry.snapshot if entry else None
+
+    def engine(self, key: str):
+        entry = self._entries.get(key)
+        return entry.engine if entry else None
+
+    def ensure(self, database_config: Dict[str, Any], engine=None, wait: bool = False) -> Optional[SchemaSnapshot]:
+        """
+        Return the cached snapshot for a SQL database, scheduling a background
+        build (first sight) or fingerprint check (TTL expired) as needed.
+        The credentials are verified with a fresh connection first (on first
+        sight and then every credential_ttl seconds).
+
+        Args:
+            database_config: dbtype/host/user/password/dbname of the database
+            engine: Existing engine to reuse; one is created otherwise
+            wait: Block until a snapshot exists when none has been built yet
+
+        Returns:
+            The current snapshot, or None while the first build is still running
+
+        Raises:
+            DatabaseAuthenticationError: The credentials could not open a connection
+        """
+        dbtype = database_config.get("dbtype")
+        if dbtype not in COLUMNS_QUERY:
+            return None
+        key = database_key_from_config(database_config)
+
+        entry = self._entries.get(key)
+        if entry is None:
+            if engine is None:
+                _, engine = configure_db(
+                    dbtype, database_config["host"], database_config["user"],
+                    database_config["password"], database_config["dbname"]
+                )
+            # Only credentials that connect get an entry: a wrong password never creates (or poisons) one
+            candidate = _CatalogEntry(engine, dbtype)
+            self._authenticate(key, candidate)
+            with self._lock:
+                entry = self._entries.setdefault(key, candidate)
+        elif time.time() - entry.verified_at > self.credential_ttl:
+            self._authenticate(key, entry)
+
+        with self._lock:
+            due = time.time() - entry.checked_at > self.fingerprint_ttl
+            if (entry.snapshot is None or due) and (entry.pending is None or entry.pending.done()):
+                entry.checked_at = time.time()
+                entry.pending = self._executor.submit(self._refresh, key, entry)
+            pending = entry.pending
+
+        if entry.snapshot is None and wait and pending is not None:
+            pending.result()
+        return entry.snapshot
+
+    def _authenticate(self, key: str, entry: _CatalogEntry):
+        """Open a fresh (unpooled) connection with the entry's credentials; evict the entry when it fails"""
+        probe = create_engine(entry.engine.url, poolclass=NullPool)
+        try:
+            with probe.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception as e:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            logger.warning(f"🔒 Credentials check failed for {database_label(key)}: {e}")
+            raise DatabaseAuthenticationError(database_label(key), e)
+        finally:
+            probe.dispose()
+        entry.verified_at = time.time()
+
+    def refresh(self, key: str) -> Optional[SchemaSnapshot]:
+        """Synchronously re-check one database (e.g. after a known migration)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._refresh(key, entry)
+        return entry.snapshot
+
+    def _read_columns(self, engine, dbtype: str):
+        with engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(text(COLUMNS_QUERY[dbtype]))]
+
+    def _refresh(self, key: str, entry: _CatalogEntry):
+        try:
+            rows = self._read_columns(entry.engine, entry.dbtype)
+            fingerprint = hashlib.sha1(repr(rows).encode()).hexdigest()
+            if entry.snapshot is not None and entry.snapshot.fingerprint == fingerprint:
+                return
+            entry.snapshot = self._build(key, entry, rows, fingerprint)
+            logger.info(f"📚 Schema catalog built for {key}: {len(entry.snapshot.tables)} tables ({fingerprint[:8]})")
+        except Exception as e:
+            logger.warning(f"⚠️ Schema catalog refresh failed for {key}: {e}")
+            return
+
+        for listener in list(self._listeners):
+            try:
+                listener(entry.snapshot)
+            except Exception as e:
+                logger.warning(f"⚠️ Schema catalog listener {getattr(listener, '__name__', listener)} failed for {key}: {e}")
+
+    def _build(self, key: str, entry: _CatalogEntry, rows, fingerprint: str) -> SchemaSnapshot:
+        tables: Dict[str, List[Dict[str, Any]]] = {}
+        for table, column, data_type, nullable in rows:
+            tables.setdefault(table, []).append({
+                "name": column,
+                "type": str(data_type).lower(),
+                "nullable": str(nullable).upper() == "YES",
+            })
+
+        # Keys and indexes need per-table reflection; this only runs in the background
+        inspector = inspect(entry.engine)
+        foreign_keys, primary_keys, indexes, comments = {}, {}, {}, {}
+        for table in tables:
+            try:
+                foreign_keys[table] = [
+                    {
+                        "columns": fk["constrained_columns"],
+                        "referred_table": fk["referred_table"],
+                        "referred_columns": fk["referred_columns"],
+                    }
+                    for fk in inspector.get_foreign_keys(table)
+                ]
+                primary_keys[table] = inspector.get_pk_constraint(table).get("constrained_columns") or []
+                indexes[table] = [
+                    {"name": index["name"], "columns": index["column_names"], "unique": bool(index.get("unique"))}
+                    for index in inspector.get_indexes(table)
+                ]
+            except Exception as e:
+                logger.warning(f"⚠️ Could not reflect keys for {table}: {e}")
+            try:
+                # Comments feed schema linking; databases without them just skip this
+                comment = inspector.get_table_comment(table).get("text")
+                if comment:
+                    comments[table] = comment
+                column_comments = {col["name"]: col.get("comment") for col in inspector.get_columns(table)}
+                for col in tables[table]:
+                    if column_comments.get(col["name"]):
+                        col["comment"] = column_comments[col["name"]]
+            except Exception as e:
+                logger.debug(f"Could not reflect comments for {table}: {e}")
+        return SchemaSnapshot(key, entry.dbtype, fingerprint, tables, foreign_keys, primary_keys, indexes, comments)
+
+
+# Global schema catalog instance
+_schema_catalog = None
+
+def get_schema_catalog() -> SchemaCatalog:
+    """Get or create global schema catalog instance"""
+    global _schema_catalog
+    if _schema_catalog is None:
+        _schema_catalog = SchemaCatalog()
+    return _schema_catalog
@@ -0,0 +1,275 @@
+"""
+Schema Linker
+Prunes the schema sent to the LLM down to what a question needs:
+1. A per-database token index over table names, column names and comments
+   (built in the background from schema catalog snapshots)
+2. Questions score tables by IDF-weighted token overlap, boosted by their
+   foreign-key neighbours, and the top-k tables are selected
+3. Shortest foreign-key join paths between selected tables are added, including
+   bridge tables the question never mentions
+4. The result is serialized as compact DDL-like lines under a token budget
+"""
+
+import re
+import math
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Optional, Any, Tuple
+
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, database_key_from_config
+from utils.semantic_parser import singular, STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 5
+DEFAULT_TOKEN_BUDGET = 1500
+NEIGHBOUR_BOOST = 0.3
+CHARS_PER_TOKEN = 4
+
+# Weight of a token by where it appears
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.5
+COMMENT_WEIGHT = 1.0
+
+
+def tokenize(value: str) -> List[str]:
+    """snake_case, camelCase and free text to singular lower-case tokens"""
+    value = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", value or "")
+    words = re.split(r"[^a-zA-Z0-9]+", value.lower())
+    return [singular(w) for w in words if w and w not in STOPWORDS]
+
+
+def estimate_tokens(text_value: str) -> int:
+    return math.ceil(len(text_value) / CHARS_PER_TOKEN)
+
+
+class LinkedSchema:
+    def __init__(self, tables: List[str], join_paths: List[str], ddl: str, scores: Dict[str, float], database_tables: int):
+        self.tables = tables
+        self.join_paths = join_paths
+        self.ddl = ddl
+        self.scores = scores
+        self.database_tables = database_tables
+
+    @property
+    def pruned(self) -> bool:
+        """False when every table of the database is included"""
+        return len(self.tables) < self.database_tables
+
+    @property
+    def token_estimate(self) -> int:
+        return estimate_tokens(self.ddl)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tables": self.tables,
+            "join_paths": self.join_paths,
+            "ddl": self.ddl,
+            "token_estimate": self.token_estimate,
+            "pruned": self.pruned,
+        }
+
+
+class SchemaIndex:
+    def __init__(self, snapshot: SchemaSnapshot):
+        self.snapshot = snapshot
+        # token -> {table: weight}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        for table, columns in snapshot.tables.items():
+            self._post(tokenize(table), table, TABLE_NAME_WEIGHT)
+            self._post(tokenize(snapshot.comments.get(table, "")), table, COMMENT_WEIGHT)
+            for col in columns:
+                self._post(tokenize(col["name"]), table, COLUMN_NAME_WEIGHT)
+                self._post(tokenize(col.get("comment", "")), table, COMMENT_WEIGHT)
+        table_count = max(len(snapshot.tables), 1)
+        self.idf = {token: math.log(1 + table_count / len(tables)) for token, tables in self.postings.items()}
+
+        # Undirected foreign-key graph: table -> [(neighbour, join condition)]
+        self.graph: Dict[str, List[Tuple[str, str]]] = {table: [] for table in snapshot.tables}
+        for table, fks in snapshot.foreign_keys.items():
+            for fk in fks:
+                other = fk["referred_table"]
+                if other not in self.graph or table not in self.graph:
+                    continue
+                condition = " AND ".join(
+                    f"{table}.{local} = {other}.{remote}" for local, remote in zip(fk["columns"], fk["referred_columns"])
+                )
+                self.graph[table].append((other, condition))
+                self.graph[other].append((table, condition))
+
+    def _post(self, tokens: List[str], table: str, weight: float):
+        for token in tokens:
+            postings = self.postings.setdefault(token, {})
+            postings[table] = max(postings.get(table, 0.0), weight)
+
+    def score(self, question: str) -> Dict[str, float]:
+        """Relevance of every table to a question (0 for unrelated tables)"""
+        scores = {table: 0.0 for table in self.snapshot.tables}
+        for token in set(tokenize(question)):
+            for table, weight in self.postings.get(token, {}).items():
+                scores[table] += weight * self.idf[token]
+        # Tables next to strongly matching tables are likely join partners
+        boosted = dict(scores)
+        for table, neighbours in self.graph.items():
+            if neighbours:
+                boosted[table] += NEIGHBOUR_BOOST * max(scores[other] for other, _ in neighbours)
+        return boosted
+
+    def centrality(self) -> Dict[str, float]:
+        """Question-independent ranking: well connected, wide tables first"""
+        return {table: len(self.graph[table]) + 0.1 * len(columns) for table, columns in self.snapshot.tables.items()}
+
+    def join_path(self, start: str, goal: str) -> Optional[List[Tuple[str, str, str]]]:
+        """Shortest foreign-key path from start to goal as [(from table, to table, join condition)]"""
+        previous: Dict[str, Optional[Tuple[str, str]]] = {start: None}
+        queue = deque([start])
+        while queue:
+            table = queue.popleft()
+            if table == goal:
+                path = []
+                while previous[table] is not None:
+                    parent, condition = previous[table]
+                    path.append((parent, table, condition))
+                    table = parent
+                return list(reversed(path))
+            for other, condition in self.graph[table]:
+                if other not in previous:
+                    previous[other] = (table, condition)
+                    queue.append(other)
+        return None
+
+    def table_ddl(self, table: str, question_tokens: set, max_columns: Optional[int] = None) -> str:
+        """One compact line per table: name(col type PK, col type -> other.col, ...)"""
+        primary_keys = set(self.snapshot.primary_keys.get(table, []))
+        references = {}
+        for fk in self.snapshot.foreign_keys.get(table, []):
+            for local, remote in zip(fk["columns"], fk["referred_columns"]):
+                references[local] = f"{fk['referred_table']}.{remote}"
+
+        columns = self.snapshot.columns(table)
+        if max_columns is not None and len(columns) > max_columns:
+            # Keys and columns the question mentions survive truncation first
+            def priority(col):
+                if col["name"] in primary_keys or col["name"] in references:
+                    return 0
+                return 1 if question_tokens & set(tokenize(col["name"])) else 2
+            kept = {col["name"] for col in sorted(columns, key=priority)[:max_columns]}
+            columns = [col for col in columns if col["name"] in kept]
+            hidden = len(self.snapshot.columns(table)) - len(columns)
+        else:
+            hidden = 0
+
+        parts = []
+        for col in columns:
+            part = f"{col['name']} {col['type']}"
+            if col["name"] in primary_keys:
+                part += " PK"
+            if col["name"] in references:
+                part += f" -> {references[col['name']]}"
+            if col.get("comment"):
+                part += f" /* {col['comment'][:60]} */"
+            parts.append(part)
+        if hidden:
+            parts.append(f"... {hidden} more")
+        line = f"{table}({', '.join(parts)})"
+        if self.snapshot.comments.get(table):
+            line += f" -- {self.snapshot.comments[table][:80]}"
+        return line
+
+
+class SchemaLinker:
+    def __init__(self):
+        self._indexes: Dict[str, SchemaIndex] = {}
+        self._lock = threading.Lock()
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: rebuild the token index of a database"""
+        index = SchemaIndex(snapshot)
+        with self._lock:
+            self._indexes[snapshot.key] = index
+        logger.info(f"🔗 Schema linking index built for {snapshot.key}: {len(index.postings)} tokens")
+
+    def index_for(self, snapshot: SchemaSnapshot) -> SchemaIndex:
+        index = self._indexes.get(snapshot.key)
+        if index is None or index.snapshot.fingerprint != snapshot.fingerprint:
+            self.on_schema_snapshot(snapshot)
+            index = self._indexes[snapshot.key]
+        return index
+
+    def link_snapshot(self, snapshot: SchemaSnapshot, question: Optional[str] = None, top_k: int = DEFAULT_TOP_K,
+                      token_budget: int = DEFAULT_TOKEN_BUDGET) -> LinkedSchema:
+        """
+        Select the tables relevant to a question and serialize them.
+
+        Args:
+            snapshot: Cached schema of the database
+            question: Natural language question; without one the best connected tables are described
+            top_k: Maximum number of directly relevant tables (bridge tables on join paths come on top)
+            token_budget: Approximate token limit of the serialized schema
+
+        Returns:
+            LinkedSchema with the selected tables, join paths and compact DDL
+        """
+        index = self.index_for(snapshot)
+        scores = index.score(question) if question else {}
+        if not any(scores.values()):
+            scores = index.centrality()
+            top_k = len(snapshot.tables)
+        ranked = [t for t, s in sorted(scores.items(), key=lambda item: item[1], reverse=True) if s > 0][:top_k]
+
+        # Connect the selected tables through their shortest foreign-key paths
+        selected, edges = list(ranked[:1]), []
+        for table in ranked[1:]:
+            if table in selected:
+                continue
+            paths = [index.join_path(anchor, table) for anchor in selected]
+            paths = [p for p in paths if p is not None]
+            if paths:
+                for edge in min(paths, key=len):
+                    if edge not in edges:
+                        edges.append(edge)
+                    if edge[1] not in selected:
+                        selected.append(edge[1])
+            else:
+                selected.append(table)
+
+        question_tokens = set(tokenize(question or ""))
+        lines, used = [], 0
+        for table in selected:
+            line = index.table_ddl(table, question_tokens)
+            if used + estimate_tokens(line) > token_budget:
+                line = index.table_ddl(table, question_tokens, max_columns=8)
+            if used + estimate_tokens(line) > token_budget:
+                break
+            lines.append(line)
+            used += estimate_tokens(line) + 1
+        included = selected[:len(lines)]
+        joins = [condition for start, end, condition in edges if start in included and end in included]
+        if joins:
+            lines.append("-- joins: " + "; ".join(joins))
+
+        return LinkedSchema(included, joins, "\n".join(lines), {t: round(scores.get(t, 0.0), 3) for t in included},
+                            len(snapshot.tables))
+
+    def link(self, database_config: Dict[str, Any], question: Optional[str] = None, top_k: int = DEFAULT_TOP_K,
+             token_budget: int = DEFAULT_TOKEN_BUDGET) -> Optional[LinkedSchema]:
+        """Link against the cached snapshot of a database, None while it is not built yet"""
+        if not database_config:
+            return None
+        snapshot = get_schema_catalog().get(database_key_from_config(database_config))
+        if snapshot is None:
+            return None
+        return self.link_snapshot(snapshot, question, top_k, token_budget)
+
+
+# Global schema linker instance
+_schema_linker = None
+
+def get_schema_linker() -> SchemaLinker:
+    """Get or create the global schema linker and subscribe it to schema changes"""
+    global _schema_linker
+    if _schema_linker is None:
+        _schema_linker = SchemaLinker()
+        get_schema_catalog().add_listener(_schema_linker.on_schema_snapshot)
+    return _schema_linker
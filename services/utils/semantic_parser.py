@@ -0,0 +1,481 @@
+"""
+Rule-Based NL→SQL Fast Path
+A lightweight semantic parser that answers common question shapes without the
+LLM agent:
+1. "top N X by Y" (Y a column of X, or summed/counted over a table referencing X)
+2. "count of X per Y" / "how many X"
+3. "average/total/min/max Y in X [per Z]"
+4. "X in the last N days/weeks/months/years" (combinable with the shapes above)
+Table and column mentions are linked against the cached schema snapshot using
+name variants (plurals, spaces for underscores, table-prefixed columns), a small
+synonym list and fuzzy matching. Every parse carries a confidence score; only
+confident parses are executed, everything else falls through to the LLM.
+"""
+
+import os
+import re
+import difflib
+import logging
+import threading
+from typing import List, Dict, Optional, Any, Callable, Tuple
+
+from sqlalchemy.dialects import mysql, postgresql
+
+from utils.db import normalize_question
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, database_key_from_config, is_numeric_type, is_temporal_type, is_text_type
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+FAST_PATH_ROW_LIMIT = 100
+
+DIALECTS = {"postgresql": postgresql.dialect(), "mysql": mysql.dialect()}
+
+STOPWORDS = {"the", "all", "each", "every", "our", "my", "a", "an", "of"}
+LEADING_PHRASES = re.compile(
+    r"^(?:please |can you |could you )?(?P<verb>show me|show|list|give me|get|find|tell me|display|what are|what is|what's|which are)? ?"
+)
+
+# Generic business vocabulary mapped onto common column/table name fragments
+SYNONYMS = {
+    "revenue": "amount",
+    "sale amount": "amount",
+    "spend": "amount",
+    "spending": "amount",
+    "cost": "price",
+    "value": "amount",
+    "rep": "representative",
+    "client": "customer",
+    "item": "product",
+    "order": "sale",
+}
+
+AGGREGATES = {
+    "average": "AVG", "avg": "AVG", "mean": "AVG",
+    "total": "SUM", "sum": "SUM", "sum of": "SUM",
+    "minimum": "MIN", "min": "MIN", "lowest": "MIN", "smallest": "MIN",
+    "maximum": "MAX", "max": "MAX", "highest": "MAX", "largest": "MAX",
+}
+
+_TIME_FILTER = re.compile(
+    r" (?:from|in|during|over|within|for) (?:the )?(?:last|past|previous) (?:(?P<n>\d+) )?(?P<unit>day|week|month|year)s?$"
+)
+_TOP = re.compile(
+    r"^(?:the )?(?P<dir>top|bottom) (?P<n>\d+) (?P<entity>.+?) (?:by|with the (?:highest|most|largest|lowest|least)) (?P<metric>.+)$"
+)
+_COUNT_PER = [
+    re.compile(r"^(?:the )?(?:count|number|total number) of (?P<entity>.+?) (?:per|by|for each|in each|across) (?P<group>.+)$"),
+    re.compile(r"^how many (?P<entity>.+?) (?:are there )?(?:per|by|for each|in each) (?P<group>.+)$"),
+    re.compile(r"^(?P<entity>.+?) counts? (?:per|by) (?P<group>.+)$"),
+]
+_COUNT = [
+    re.compile(r"^how many (?P<entity>.+?)(?: are there| do we have| exist| in total)?$"),
+    re.compile(r"^(?:the )?(?:count|number|total number) of (?P<entity>.+)$"),
+    re.compile(r"^count (?:all )?(?P<entity>.+)$"),
+]
+_AGGREGATE = re.compile(
+    r"^(?:the )?(?P<agg>average|avg|mean|total|sum of|sum|minimum|min|maximum|max|highest|lowest|smallest|largest) "
+    r"(?P<metric>.+?)(?: (?:in|of|for|across) (?P<entity>.+?))?(?: (?:per|by|for each|in each) (?P<group>.+))?$"
+)
+
+
+def singular(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("sses", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def canonical(phrase: str) -> str:
+    """Lower-case, singular, space separated form used as lexicon key"""
+    words = re.sub(r"[^\w ]", " ", phrase.lower().replace("_", " ")).split()
+    return " ".join(singular(w) for w in words if w not in STOPWORDS)
+
+
+def dialect_quote(dbtype: str) -> Callable[[str], str]:
+    dialect = DIALECTS.get(dbtype)
+    return dialect.identifier_preparer.quote if dialect is not None else (lambda name: name)
+
+
+class ParsedQuery:
+    def __init__(self, shape: str, sql: str, confidence: float, tables: List[str]):
+        self.shape = shape
+        self.sql = sql
+        self.confidence = round(confidence, 3)
+        self.tables = tables
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"shape": self.shape, "sql": self.sql, "confidence": self.confidence, "tables": self.tables}
+
+
+class RuleBasedParser:
+    def __init__(self, snapshot: SchemaSnapshot, quote: Optional[Callable[[str], str]] = None):
+        """
+        Args:
+            snapshot: Cached schema of the database
+            quote: Identifier quoting function (the dialect's default if omitted)
+        """
+        self.snapshot = snapshot
+        self.dbtype = snapshot.dbtype
+        self.quote = quote or dialect_quote(snapshot.dbtype)
+
+        self.tables: Dict[str, List[str]] = {}
+        for table in snapshot.tables:
+            self._add(self.tables, canonical(table), table)
+
+        self.columns: Dict[str, Dict[str, List[str]]] = {}
+        for table, columns in snapshot.tables.items():
+            lexicon: Dict[str, List[str]] = {}
+            prefix = canonical(table) + " "
+            for col in columns:
+                variant = canonical(col["name"])
+                self._add(lexicon, variant, col["name"])
+                # customer_name in customers is also just "name"
+                if variant.startswith(prefix):
+                    self._add(lexicon, variant[len(prefix):], col["name"])
+            self.columns[table] = lexicon
+
+        # Single-column foreign keys only: (column, other table, other column)
+        self.forward: Dict[str, List[Tuple[str, str, str]]] = {t: [] for t in snapshot.tables}
+        self.reverse: Dict[str, List[Tuple[str, str, str]]] = {t: [] for t in snapshot.tables}
+        for table, fks in snapshot.foreign_keys.items():
+            for fk in fks:
+                if len(fk["columns"]) != 1 or fk["referred_table"] not in snapshot.tables:
+                    continue
+                self.forward[table].append((fk["columns"][0], fk["referred_table"], fk["referred_columns"][0]))
+                self.reverse[fk["referred_table"]].append((fk["referred_columns"][0], table, fk["columns"][0]))
+
+    @staticmethod
+    def _add(lexicon: Dict[str, List[str]], variant: str, name: str):
+        if variant and name not in lexicon.setdefault(variant, []):
+            lexicon[variant].append(name)
+
+    # ---- linking ----
+
+    def _link(self, phrase: str, lexicon: Dict[str, List[str]]) -> Optional[Tuple[str, float]]:
+        """Best schema name for a phrase with its link score, None if nothing is close"""
+        key = canonical(phrase)
+        if not key:
+            return None
+        scores: Dict[str, float] = {}
+
+        def offer(names, score):
+            for name in names:
+                scores[name] = max(scores.get(name, 0.0), score)
+
+        forms = [(key, 1.0)]
+        for word, replacement in SYNONYMS.items():
+            if re.search(rf"\b{word}\b", key):
+                forms.append((canonical(re.sub(rf"\b{word}\b", replacement, key)), 0.95))
+
+        for form, factor in forms:
+            if form in lexicon:
+                offer(lexicon[form], factor)
+        if not scores:
+            for form, factor in forms:
+                tokens = set(form.split())
+                # "amount" -> total_amount, "price" -> unit_price
+                containing = {name for variant, names in lexicon.items() if tokens <= set(variant.split()) for name in names}
+                offer(containing, (0.9 if len(containing) == 1 else 0.85) * factor)
+                for variant in difflib.get_close_matches(form, list(lexicon), n=3, cutoff=0.85):
+                    offer(lexicon[variant], 0.9 * factor * difflib.SequenceMatcher(None, form, variant).ratio())
+        if not scores:
+            return None
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        name, score = ranked[0]
+        if len(ranked) > 1 and ranked[1][1] == score:
+            score *= 0.7  # ambiguous
+        return name, score
+
+    def _link_table(self, phrase: Optional[str]) -> Optional[Tuple[str, float]]:
+        return self._link(phrase, self.tables) if phrase else None
+
+    def _link_column(self, table: str, phrase: str, predicate: Callable[[str], bool] = lambda _: True) -> Optional[Tuple[str, float]]:
+        types = {col["name"]: col["type"] for col in self.snapshot.columns(table)}
+        lexicon = {}
+        for variant, names in self.columns[table].items():
+            kept = [n for n in names if predicate(types[n])]
+            if kept:
+                lexicon[variant] = kept
+        return self._link(phrase, lexicon)
+
+    def _label_column(self, table: str) -> str:
+        """Human readable column identifying a row (customer_name, title, ...)"""
+        columns = self.snapshot.columns(table)
+        text_columns = [c["name"] for c in columns if is_text_type(c["type"])]
+        for hint in ("name", "title"):
+            for name in text_columns:
+                if hint in name.lower():
+                    return name
+        pk = self.snapshot.primary_keys.get(table) or []
+        if pk:
+            return pk[0]
+        return text_columns[0] if text_columns else columns[0]["name"]
+
+    def _temporal_column(self, table: str) -> Optional[Tuple[str, float]]:
+        temporal = [c["name"] for c in self.snapshot.columns(table) if is_temporal_type(c["type"])]
+        if len(temporal) == 1:
+            return temporal[0], 1.0
+        for name in temporal:
+            if "date" in name.lower() or "created" in name.lower():
+                return name, 0.9
+        return (temporal[0], 0.7) if temporal else None
+
+    # ---- SQL building ----
+
+    def _col(self, table: str, column: str) -> str:
+        return f"{self.quote(table)}.{self.quote(column)}"
+
+    def _time_condition(self, column_ref: str, n: int, unit: str) -> str:
+        if self.dbtype == "postgresql":
+            return f"{column_ref} >= CURRENT_DATE - INTERVAL '{n} {unit}s'"
+        return f"{column_ref} >= CURRENT_DATE - INTERVAL {n} {unit.upper()}"
+
+    def _group(self, table: str, phrase: str) -> Optional[Tuple[str, str, str, float]]:
+        """Selected group expression, optional join and GROUP BY list for a grouping phrase"""
+        best = None
+        column = self._link_column(table, phrase)
+        if column:
+            best = (self._col(table, column[0]), "", self._col(table, column[0]), column[1])
+        # Grouping by a referenced table ("per region", or its key "per rep") groups by its label column
+        linked_table = self._link_table(phrase)
+        for fk_column, other, other_column in self.forward[table]:
+            scores = [linked_table[1]] if linked_table and linked_table[0] == other else []
+            if column and column[0] == fk_column:
+                scores.append(column[1])
+            if scores:
+                # Several keys referencing the same table (home/away team) are ambiguous
+                score = max(scores) * (0.6 if sum(1 for f in self.forward[table] if f[1] == other) > 1 else 1.0)
+                if best is None or score >= best[3]:
+                    join = f" JOIN {self.quote(other)} ON {self._col(table, fk_column)} = {self._col(other, other_column)}"
+                    label = self._col(other, self._label_column(other))
+                    # Rows sharing a label (two reps named alike) stay separate groups, as in _top
+                    pk = self.snapshot.primary_keys.get(other) or [other_column]
+                    group = ", ".join([self._col(other, c) for c in pk if self._col(other, c) != label] + [label])
+                    best = (label, join, group, score)
+        return best
+
+    def _where(self, table: str, time_filter: Optional[Tuple[int, str]], *conditions: str) -> Optional[Tuple[str, float]]:
+        """WHERE clause for the time filter (on the table's date column) plus extra conditions"""
+        score = 1.0
+        conditions = list(conditions)
+        if time_filter:
+            temporal = self._temporal_column(table)
+            if temporal is None:
+                return None
+            conditions.append(self._time_condition(self._col(table, temporal[0]), *time_filter))
+            score = temporal[1]
+        return (f" WHERE {' AND '.join(conditions)}" if conditions else ""), score
+
+    def _top(self, match, time_filter) -> Optional[ParsedQuery]:
+        entity = self._link_table(match["entity"])
+        if entity is None:
+            return None
+        table, score = entity
+        n = int(match["n"])
+        order = "ASC" if match["dir"] == "bottom" or re.search(r"lowest|least", match.group(0)) else "DESC"
+        label = self._col(table, self._label_column(table))
+        # "total titles" may be a column (total_titles) or mean SUM(titles)
+        metric_phrase = re.sub(r"^(?:total|number of|count of) ", "", match["metric"])
+        metric = max(
+            filter(None, (self._link_column(table, phrase, is_numeric_type) for phrase in {match["metric"], metric_phrase})),
+            key=lambda linked: linked[1], default=None
+        )
+        if metric and metric[1] >= 0.85:
+            value = self._col(table, metric[0])
+            # NULLs would sort first in descending PostgreSQL order
+            where = self._where(table, time_filter, f"{value} IS NOT NULL")
+            if where is None:
+                return None
+            sql = (f"SELECT {label}, {value} FROM {self.quote(table)}{where[0]} "
+                   f"ORDER BY {value} {order} LIMIT {n}")
+            return ParsedQuery("top_n", sql, score * metric[1] * where[1], [table])
+
+        # Metric lives in a table referencing the entity: sum it (or count rows) per entity
+        pk = self.snapshot.primary_keys.get(table) or []
+        for ref_column, other, other_column in self.reverse[table]:
+            counted = self._link_table(metric_phrase)
+            if counted and counted[0] == other:
+                value, metric_score, alias = "COUNT(*)", counted[1] * 0.9, f"{other}_count"
+            else:
+                linked = max(
+                    filter(None, (self._link_column(other, phrase, is_numeric_type) for phrase in {match["metric"], metric_phrase})),
+                    key=lambda linked: linked[1], default=None
+                )
+                if not linked:
+                    continue
+                value, metric_score, alias = f"SUM({self._col(other, linked[0])})", linked[1] * 0.95, f"sum_{linked[0]}"
+            other_where = self._where(other, time_filter)
+            if other_where is None:
+                continue
+            group = ", ".join([self._col(table, c) for c in pk if self._col(table, c) != label] + [label])
+            sql = (f"SELECT {label}, {value} AS {self.quote(alias)} FROM {self.quote(table)} "
+                   f"JOIN {self.quote(other)} ON {self._col(other, other_column)} = {self._col(table, ref_column)}"
+                   f"{other_where[0]} GROUP BY {group} ORDER BY {self.quote(alias)} {order} LIMIT {n}")
+            return ParsedQuery("top_n", sql, score * metric_score * other_where[1], [table, other])
+        return None
+
+    def _count(self, match, time_filter, per_group: bool) -> Optional[ParsedQuery]:
+        entity = self._link_table(match["entity"])
+        if entity is None:
+            return None
+        table, score = entity
+        where = self._where(table, time_filter)
+        if where is None:
+            return None
+        alias = self.quote(f"{table}_count")
+        if not per_group:
+            sql = f"SELECT COUNT(*) AS {alias} FROM {self.quote(table)}{where[0]}"
+            return ParsedQuery("count", sql, score * where[1], [table])
+        group = self._group(table, match["group"])
+        if group is None:
+            return None
+        expression, join, group_by, group_score = group
+        sql = (f"SELECT {expression}, COUNT(*) AS {alias} FROM {self.quote(table)}{join}{where[0]} "
+               f"GROUP BY {group_by} ORDER BY {alias} DESC LIMIT {FAST_PATH_ROW_LIMIT}")
+        return ParsedQuery("count_per_group", sql, score * group_score * where[1], [table])
+
+    def _aggregate(self, match, time_filter) -> Optional[ParsedQuery]:
+        agg_word, metric_phrase = match["agg"], match["metric"]
+        if match["entity"]:
+            entity = self._link_table(match["entity"])
+            if entity is None:
+                return None
+            candidates = [entity]
+        else:
+            # "average unit price": any table with a matching column
+            candidates = [(table, 0.95) for table in self.snapshot.tables]
+
+        best = None
+        for table, table_score in candidates:
+            # "total amount" may itself be the column (total_amount)
+            for phrase, function in ((f"{agg_word} {metric_phrase}", "SUM" if agg_word == "total" else AGGREGATES[agg_word]),
+                                     (metric_phrase, AGGREGATES[agg_word])):
+                linked = self._link_column(table, phrase, is_numeric_type)
+                if linked and (best is None or table_score * linked[1] > best[3]):
+                    best = (table, linked[0], function, table_score * linked[1])
+                if linked and linked[1] == 1.0:
+                    break
+        if best is None:
+            return None
+        if not match["entity"] and sum(1 for t in self.snapshot.tables if self._link_column(t, metric_phrase, is_numeric_type)) > 1:
+            return None  # metric exists in several tables and none was named
+
+        table, column, function, score = best
+        where = self._where(table, time_filter)
+        if where is None:
+            return None
+        value = f"{function}({self._col(table, column)})"
+        alias = self.quote(f"{function.lower()}_{column}")
+        if not match["group"]:
+            sql = f"SELECT {value} AS {alias} FROM {self.quote(table)}{where[0]}"
+            return ParsedQuery("aggregate", sql, score * where[1], [table])
+        group = self._group(table, match["group"])
+        if group is None:
+            return None
+        expression, join, group_by, group_score = group
+        sql = (f"SELECT {expression}, {value} AS {alias} FROM {self.quote(table)}{join}{where[0]} "
+               f"GROUP BY {group_by} ORDER BY {alias} DESC LIMIT {FAST_PATH_ROW_LIMIT}")
+        return ParsedQuery("aggregate_per_group", sql, score * group_score * where[1], [table])
+
+    def _list(self, phrase: str, time_filter) -> Optional[ParsedQuery]:
+        entity = self._link_table(re.sub(r"^(?:all|every) ", "", phrase))
+        if entity is None:
+            return None
+        table, score = entity
+        if not time_filter:
+            return ParsedQuery("list", f"SELECT * FROM {self.quote(table)} LIMIT {FAST_PATH_ROW_LIMIT}", score * 0.95, [table])
+        temporal = self._temporal_column(table)
+        if temporal is None:
+            return None
+        column = self._col(table, temporal[0])
+        sql = (f"SELECT * FROM {self.quote(table)} WHERE {self._time_condition(column, *time_filter)} "
+               f"ORDER BY {column} DESC LIMIT {FAST_PATH_ROW_LIMIT}")
+        return ParsedQuery("recent", sql, score * temporal[1], [table])
+
+    def parse(self, question: str) -> Optional[ParsedQuery]:
+        """Parse a question into SQL, None if it matches no supported shape"""
+        text_value = normalize_question(question)
+        leading = LEADING_PHRASES.match(text_value)
+        verb = leading.group("verb") if leading else None
+        text_value = text_value[leading.end():] if leading else text_value
+
+        time_filter = None
+        filter_match = _TIME_FILTER.search(text_value)
+        if filter_match:
+            time_filter = (int(filter_match["n"] or 1), filter_match["unit"])
+            text_value = text_value[:filter_match.start()]
+
+        match = _TOP.match(text_value)
+        if match:
+            return self._top(match, time_filter)
+        for pattern in _COUNT_PER:
+            match = pattern.match(text_value)
+            if match:
+                parsed = self._count(match, time_filter, per_group=True)
+                if parsed:
+                    return parsed
+        for pattern in _COUNT:
+            match = pattern.match(text_value)
+            if match:
+                return self._count(match, time_filter, per_group=False)
+        match = _AGGREGATE.match(text_value)
+        if match:
+            return self._aggregate(match, time_filter)
+        if verb in ("show me", "show", "list", "get", "find", "display", "give me", "what are") or time_filter:
+            return self._list(text_value, time_filter)
+        return None
+
+
+class SemanticParser:
+    def __init__(self, min_confidence: float = FAST_PATH_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self._parsers: Dict[str, RuleBasedParser] = {}
+        self._lock = threading.Lock()
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: rebuild the linking lexicon of a database"""
+        engine = get_schema_catalog().engine(snapshot.key)
+        quote = engine.dialect.identifier_preparer.quote if engine is not None else None
+        parser = RuleBasedParser(snapshot, quote)
+        with self._lock:
+            self._parsers[snapshot.key] = parser
+        logger.info(f"🧭 Rule-based parser ready for {snapshot.key}")
+
+    def parse(self, database_config: Dict[str, Any], question: str) -> Optional[ParsedQuery]:
+        """Parse a question against a database's current schema, whatever the confidence"""
+        if not database_config:
+            return None
+        key = database_key_from_config(database_config)
+        parser = self._parsers.get(key)
+        current = get_schema_catalog().get(key)
+        if parser is None or current is None or current.fingerprint != parser.snapshot.fingerprint:
+            return None
+        try:
+            return parser.parse(question)
+        except Exception as e:
+            logger.warning(f"⚠️ Rule-based parse failed for '{question}': {e}")
+            return None
+
+    def fast_path(self, database_config: Dict[str, Any], question: str) -> Optional[ParsedQuery]:
+        """Parse only if confident enough to skip the LLM"""
+        parsed = self.parse(database_config, question)
+        if parsed is not None and parsed.confidence >= self.min_confidence:
+            return parsed
+        return None
+
+
+# Global semantic parser instance
+_semantic_parser = None
+
+def get_semantic_parser() -> SemanticParser:
+    """Get or create the global semantic parser and subscribe it to schema changes"""
+    global _semantic_parser
+    if _semantic_parser is None:
+        _semantic_parser = SemanticParser()
+        get_schema_catalog().add_listener(_semantic_parser.on_schema_snapshot)
+    return _semantic_parser
@@ -1,77 +1,53 @@
-# Add to your FastAPI service
-from typing import List, Dict
-import json
-from fastapi import HTTPException
-from sqlalchemy import inspect
-from db import configure_db  # Import your existing configure_db function
-
-# This would be added to your main api.py file
-# @api.post("/smart-suggestions")
-async def get_smart_suggestions(request_data: dict):
-    """
-    AI-powered query suggestions based on:
-    - Database schema analysis
-    - User's query history
-    - Common business questions
-    - Industry best practices
-    """
-    try:
-        db_config = request_data.get('database_config')
-        user_history = request_data.get('user_history', [])
-        current_context = request_data.get('current_context', '')
-        
-        # Analyze database schema to understand available data
-        schema_analysis = await analyze_database_schema(db_config)
-        
-        # Generate context-aware suggestions
-        suggestions = await generate_smart_suggestions(
-            schema_analysis, 
-            user_history, 
-            current_context
-        )
-        
-        return {
-            "suggestions": suggestions,
-            "categories": categorize_suggestions(suggestions),
-            "trending_queries": get_trending_queries(schema_analysis),
-            "business_insights": generate_business_insight_suggestions(schema_analysis)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Smart suggestions failed: {str(e)}")
-
-async def analyze_database_schema(db_config):
-    """Analyze database schema to understand data structure"""
-    try:
-        db, engine = configure_db(
-            db_config['dbtype'], db_config['host'], db_config['user'],
-            db_config['password'], db_config['dbname']
-        )
-        
-        # Get table information
-        inspector = inspect(engine)
-        tables = inspector.get_table_names()
-        
-        schema_info = {}
-        for table in tables:
-            columns = inspector.get_columns(table)
-            schema_info[table] = {
-                'columns': [col['name'] for col in columns],
-                'types': {col['name']: str(col['type']) for col in columns},
-                'nullable': {col['name']: col['nullable'] for col in columns}
-            }
-        
-        return schema_info
-        
-    except Exception as e:
-        return {}
-
-async def generate_smart_suggestions(schema_analysis, user_history, current_context):
-    """Generate intelligent query suggestions"""
+"""
+Smart Suggestions Index
+Serves /smart-suggestions from memory. A per-database suggestion index is built
+in the background whenever the schema catalog (re)builds a snapshot, i.e. when a
+database is first connected or its schema fingerprint changes. It holds:
+1. Schema-based exploration, aggregation and temporal suggestions
+2. History-derived suggestions ranked by frequency and recency
+Requests only merge these precomputed lists with the caller's context.
+"""
+
+import time
+import logging
+import threading
+from collections import Counter
+from typing import List, Dict, Optional, Any
+
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, database_key_from_config, is_numeric_type, is_temporal_type
+from utils.rag_service import get_rag_service
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TTL_SECONDS = 300
+MAX_SUGGESTIONS = 15
+
+BUSINESS_SUGGESTIONS = [
+    {
+        "query": "What are the top 10 records by value?",
+        "type": "business",
+        "confidence": 0.7,
+        "description": "Find highest performing records"
+    },
+    {
+        "query": "Show me records from the last 30 days",
+        "type": "business",
+        "confidence": 0.75,
+        "description": "Recent activity analysis"
+    },
+    {
+        "query": "Which categories have the most entries?",
+        "type": "business",
+        "confidence": 0.8,
+        "description": "Distribution analysis"
+    }
+]
+
+
+def build_schema_suggestions(snapshot: SchemaSnapshot) -> List[Dict[str, Any]]:
+    """Exploration, aggregation and temporal suggestions for every table in a snapshot"""
     suggestions = []
-    
-    # Category 1: Schema-based suggestions
-    for table, info in schema_analysis.items():
+    for table, columns in snapshot.tables.items():
         # Basic exploration queries
         suggestions.append({
             "query": f"Show me an overview of the {table} data",
@@ -79,64 +55,136 @@ async def generate_smart_suggestions(schema_analysis, user_history, current_cont
             "confidence": 0.9,
             "description": f"Get a sample of data from {table} table"
         })
-        
-        # Aggregation suggestions for numeric columns
-        numeric_cols = [col for col, type_info in info['types'].items() 
-                       if 'int' in type_info.lower() or 'float' in type_info.lower() or 'decimal' in type_info.lower()]
-        
-        for col in numeric_cols:
-            suggestions.append({
-                "query": f"What is the average {col} in {table}?",
-                "type": "aggregation",
-                "confidence": 0.8,
-                "description": f"Calculate statistics for {col}"
-            })
-            
+
+        # Aggregation suggestions for numeric columns (keys are rarely worth averaging)
+        primary_keys = set(snapshot.primary_keys.get(table, []))
+        for col in columns:
+            if is_numeric_type(col["type"]) and col["name"] not in primary_keys and not col["name"].lower().endswith("_id"):
+                suggestions.append({
+                    "query": f"What is the average {col['name']} in {table}?",
+                    "type": "aggregation",
+                    "confidence": 0.8,
+                    "description": f"Calculate statistics for {col['name']}"
+                })
+
         # Time-based suggestions if date columns exist
-        date_cols = [col for col, type_info in info['types'].items() 
-                    if 'date' in type_info.lower() or 'time' in type_info.lower()]
-        
-        for date_col in date_cols:
-            suggestions.append({
-                "query": f"Show me {table} trends over time by {date_col}",
-                "type": "temporal",
-                "confidence": 0.85,
-                "description": f"Analyze trends over {date_col}"
-            })
-    
-    # Category 2: Business intelligence suggestions
-    business_suggestions = [
-        {
-            "query": "What are the top 10 records by value?",
-            "type": "business",
-            "confidence": 0.7,
-            "description": "Find highest performing records"
-        },
-        {
-            "query": "Show me records from the last 30 days",
-            "type": "business", 
-            "confidence": 0.75,
-            "description": "Recent activity analysis"
-        },
-        {
-            "query": "Which categories have the most entries?",
-            "type": "business",
-            "confidence": 0.8,
-            "description": "Distribution analysis"
+        for col in columns:
+            if is_temporal_type(col["type"]):
+                suggestions.append({
+                    "query": f"Show me {table} trends over time by {col['name']}",
+                    "type": "temporal",
+                    "confidence": 0.85,
+                    "description": f"Analyze trends over {col['name']}"
+                })
+    return suggestions
+
+
+class SmartSuggestionIndex:
+    def __init__(self, history_ttl: int = HISTORY_TTL_SECONDS):
+        self.history_ttl = history_ttl
+        self._schema_suggestions: Dict[str, Dict[str, Any]] = {}
+        self._history: Dict[str, Dict[str, Any]] = {}
+        self._history_refreshing = set()
+        self._lock = threading.Lock()
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: rebuild the schema part of the index"""
+        suggestions = build_schema_suggestions(snapshot)
+        suggestions.sort(key=lambda x: x['confidence'], reverse=True)
+        with self._lock:
+            self._schema_suggestions[snapshot.key] = {
+                "fingerprint": snapshot.fingerprint,
+                "suggestions": suggestions,
+                "built_at": time.time(),
+            }
+        logger.info(f"💡 Suggestion index built for {snapshot.key}: {len(suggestions)} schema suggestions")
+
+    def _refresh_history(self, key: str, database_config: Dict[str, Any]):
+        try:
+            popular = get_rag_service().get_popular_queries(database_config, limit=50)
+            top_score = popular[0]["score"] if popular else 1.0
+            suggestions = [
+                {
+                    "query": item["query"],
+                    "type": "history",
+                    # Scale the frequency/recency score into the confidence range of the other suggestions
+                    "confidence": round(0.6 + 0.35 * item["score"] / top_score, 3),
+                    "description": f"Asked {item['count']} time{'s' if item['count'] != 1 else ''} recently"
+                }
+                for item in popular
+            ]
+            with self._lock:
+                self._history[key] = {"suggestions": suggestions, "fetched_at": time.time()}
+        finally:
+            with self._lock:
+                self._history_refreshing.discard(key)
+
+    def _history_suggestions(self, key: str, database_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Cached history suggestions; a stale cache is refreshed in the background"""
+        with self._lock:
+            cached = self._history.get(key)
+            stale = cached is None or time.time() - cached["fetched_at"] > self.history_ttl
+            if stale and key not in self._history_refreshing:
+                self._history_refreshing.add(key)
+                threading.Thread(target=self._refresh_history, args=(key, database_config), daemon=True).start()
+        return cached["suggestions"] if cached else []
+
+    def get_suggestions(self, database_config: Dict[str, Any], user_history: Optional[List[str]] = None,
+                        current_context: str = "") -> Dict[str, Any]:
+        """Assemble the /smart-suggestions response from the precomputed index"""
+        key = database_key_from_config(database_config)
+        snapshot = get_schema_catalog().ensure(database_config)
+        with self._lock:
+            entry = self._schema_suggestions.get(key)
+        if entry is None and snapshot is not None:
+            # Snapshot finished before the listener was registered
+            self.on_schema_snapshot(snapshot)
+            entry = self._schema_suggestions.get(key)
+
+        suggestions = list(entry["suggestions"]) if entry else []
+        suggestions.extend(BUSINESS_SUGGESTIONS)
+        suggestions.extend(self._history_suggestions(key, database_config))
+        suggestions.extend(rank_user_history(user_history or []))
+        if current_context:
+            suggestions.extend(generate_follow_up_suggestions(current_context))
+
+        # Sort by confidence and relevance, keeping the first occurrence of each question
+        seen = set()
+        unique = []
+        for suggestion in sorted(suggestions, key=lambda x: x['confidence'], reverse=True):
+            normalized = suggestion["query"].strip().lower()
+            if normalized not in seen:
+                seen.add(normalized)
+                unique.append(suggestion)
+        top = unique[:MAX_SUGGESTIONS]
+
+        return {
+            "suggestions": top,
+            "categories": categorize_suggestions(top),
+            "trending_queries": get_trending_queries(entry),
+            "business_insights": generate_business_insight_suggestions(entry),
+            "index_ready": entry is not None,
+            "schema_fingerprint": entry["fingerprint"] if entry else None
         }
-    ]
-    
-    suggestions.extend(business_suggestions)
-    
-    # Category 3: Follow-up suggestions based on context
-    if current_context:
-        follow_up_suggestions = generate_follow_up_suggestions(current_context)
-        suggestions.extend(follow_up_suggestions)
-    
-    # Sort by confidence and relevance
-    suggestions.sort(key=lambda x: x['confidence'], reverse=True)
-    
-    return suggestions[:15]  # Return top 15 suggestions
+
+
+def rank_user_history(user_history: List[str]) -> List[Dict[str, Any]]:
+    """Rank the caller's own recent questions; later entries are more recent"""
+    if not user_history:
+        return []
+    counts = Counter(q.strip() for q in user_history if q and q.strip())
+    last_seen = {q.strip(): i for i, q in enumerate(user_history) if q and q.strip()}
+    total = len(user_history)
+    ranked = []
+    for query, count in counts.items():
+        recency = (last_seen[query] + 1) / total
+        ranked.append({
+            "query": query,
+            "type": "history",
+            "confidence": round(min(0.6 + 0.1 * count + 0.2 * recency, 0.95), 3),
+            "description": "From your recent questions"
+        })
+    return ranked
 
 def categorize_suggestions(suggestions):
     """Categorize suggestions for better UX"""
@@ -144,9 +192,10 @@ def categorize_suggestions(suggestions):
         "🔍 Data Exploration": [s for s in suggestions if s['type'] == 'exploration'],
         "📊 Analytics": [s for s in suggestions if s['type'] == 'aggregation'],
         "📈 Trends": [s for s in suggestions if s['type'] == 'temporal'],
+        "🕘 Popular": [s for s in suggestions if s['type'] == 'history'],
         "💼 Business Insights": [s for s in suggestions if s['type'] == 'business']
     }
-    
+
     return {k: v for k, v in categories.items() if v}  # Remove empty categories
 
 def get_trending_queries(schema_analysis):
@@ -157,7 +206,7 @@ def get_trending_queries(schema_analysis):
         "Compare performance metrics across time periods",
         "Identify any unusual or outlier records"
     ]
-    
+
     return trending
 
 def generate_business_insight_suggestions(schema_analysis):
@@ -174,7 +223,7 @@ def generate_business_insight_suggestions(schema_analysis):
         },
         {
             "title": "Customer Behavior",
-            "description": "Understand customer patterns and preferences", 
+            "description": "Understand customer patterns and preferences",
             "queries": [
                 "Who are our top customers by value?",
                 "What is the average customer lifetime value?",
@@ -191,15 +240,15 @@ def generate_business_insight_suggestions(schema_analysis):
             ]
         }
     ]
-    
+
     return insights
 
 def generate_follow_up_suggestions(context):
     """Generate follow-up questions based on current context"""
     follow_ups = []
-    
+
     context_lower = context.lower()
-    
+
     if 'revenue' in context_lower or 'sales' in context_lower:
         follow_ups.extend([
             {
@@ -210,12 +259,12 @@ def generate_follow_up_suggestions(context):
             },
             {
                 "query": "How does this compare to previous periods?",
-                "type": "follow_up", 
+                "type": "follow_up",
                 "confidence": 0.85,
                 "description": "Historical comparison"
             }
         ])
-    
+
     if 'top' in context_lower or 'highest' in context_lower:
         follow_ups.extend([
             {
@@ -231,5 +280,17 @@ def generate_follow_up_suggestions(context):
                 "description": "Comparative analysis"
             }
         ])
-    
+
     return follow_ups
+
+
+# Global suggestion index instance
+_suggestion_index = None
+
+def get_suggestion_index() -> SmartSuggestionIndex:
+    """Get or create the global suggestion index and subscribe it to schema changes"""
+    global _suggestion_index
+    if _suggestion_index is None:
+        _suggestion_index = SmartSuggestionIndex()
+        get_schema_catalog().add_listener(_suggestion_index.on_schema_snapshot)
+    return _suggestion_index
@@ -0,0 +1,237 @@
+"""
+Caching SQL Toolkit
+Drop-in replacement for LangChain's SQLDatabaseToolkit whose tools stop paying
+for work that does not change between agent runs:
+1. sql_db_list_tables is answered from the schema catalog snapshot
+2. sql_db_schema builds CREATE TABLE text from the snapshot; the sample rows it
+   shows are read once per table and schema fingerprint, then reused
+3. sql_db_query_checker verdicts are memoized by a hash of the dialect and the
+   whitespace-normalized SQL, so a query is only sent to the LLM once; queries
+   the local SQL validator rejects (unknown tables or columns, writes) get its
+   issues back without an LLM call
+sql_db_query itself always runs against the database, after the validator and
+the cost guard checked it: invalid queries and too expensive plans go back to
+the agent as an error to rewrite the query from.
+"""
+
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import (
+    InfoSQLDatabaseTool,
+    ListSQLDatabaseTool,
+    QuerySQLCheckerTool,
+    QuerySQLDatabaseTool,
+)
+from langchain_core.tools import BaseTool
+from sqlalchemy import text
+
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_ROWS = 3
+SAMPLE_ROWS_TTL_SECONDS = 3600
+SAMPLE_VALUE_LENGTH = 100
+CHECKER_CACHE_SIZE = 1024
+
+
+def sql_fingerprint(dialect: str, sql: str) -> str:
+    """Hash of a query that ignores whitespace and trailing semicolons (case is kept, literals may depend on it)"""
+    normalized = re.sub(r"\s+", " ", sql.strip().rstrip(";")).strip()
+    return hashlib.sha1(f"{dialect}\n{normalized}".encode()).hexdigest()
+
+
+class ToolResultCache:
+    def __init__(self, sample_ttl: int = SAMPLE_ROWS_TTL_SECONDS, checker_size: int = CHECKER_CACHE_SIZE):
+        self.sample_ttl = sample_ttl
+        self.checker_size = checker_size
+        # (database key, schema fingerprint, table) -> (read at, sample rows text)
+        self._samples: Dict[Tuple[str, str, str], Tuple[float, str]] = {}
+        # hash of dialect + SQL -> checker output
+        self._verdicts: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: drop sample rows of an older schema"""
+        with self._lock:
+            for cache_key in [k for k in self._samples if k[0] == snapshot.key and k[1] != snapshot.fingerprint]:
+                del self._samples[cache_key]
+
+    def _sample_rows(self, snapshot: SchemaSnapshot, table: str, engine) -> str:
+        cache_key = (snapshot.key, snapshot.fingerprint, table)
+        cached = self._samples.get(cache_key)
+        if cached and time.time() - cached[0] < self.sample_ttl:
+            return cached[1]
+
+        quote = engine.dialect.identifier_preparer.quote
+        columns = [col["name"] for col in snapshot.columns(table)]
+        try:
+            with engine.connect() as connection:
+                rows = connection.execute(text(
+                    f"SELECT {', '.join(quote(c) for c in columns)} FROM {quote(table)} LIMIT {SAMPLE_ROWS}"
+                )).fetchall()
+            lines = ["\t".join(str(value)[:SAMPLE_VALUE_LENGTH] for value in row) for row in rows]
+            sample = f"{SAMPLE_ROWS} rows from {table} table:\n" + "\t".join(columns) + "\n" + "\n".join(lines)
+        except Exception as e:
+            # Same fallback as SQLDatabase: the schema is still useful without samples
+            logger.debug(f"Could not sample rows of {table}: {e}")
+            sample = ""
+        with self._lock:
+            self._samples[cache_key] = (time.time(), sample)
+        return sample
+
+    def table_info(self, snapshot: SchemaSnapshot, table: str, engine) -> str:
+        """CREATE TABLE text plus sample rows (read through the request's engine), in the format of SQLDatabase.get_table_info"""
+        primary_keys = snapshot.primary_keys.get(table, [])
+        lines = [
+            f"\t{col['name']} {col['type'].upper()}{'' if col['nullable'] else ' NOT NULL'}"
+            for col in snapshot.columns(table)
+        ]
+        if primary_keys:
+            lines.append(f"\tPRIMARY KEY ({', '.join(primary_keys)})")
+        for fk in snapshot.foreign_keys.get(table, []):
+            lines.append(
+                f"\tFOREIGN KEY({', '.join(fk['columns'])}) REFERENCES "
+                f"{fk['referred_table']} ({', '.join(fk['referred_columns'])})"
+            )
+        info = f"CREATE TABLE {table} (\n" + ",\n".join(lines) + "\n)"
+        sample = self._sample_rows(snapshot, table, engine)
+        return f"{info}\n\n/*\n{sample}\n*/" if sample else info
+
+    def verdict(self, dialect: str, sql: str) -> Optional[str]:
+        fingerprint = sql_fingerprint(dialect, sql)
+        with self._lock:
+            verdict = self._verdicts.get(fingerprint)
+            if verdict is not None:
+                self._verdicts.move_to_end(fingerprint)
+        return verdict
+
+    def store_verdict(self, dialect: str, sql: str, verdict: str):
+        with self._lock:
+            self._verdicts[sql_fingerprint(dialect, sql)] = verdict
+            while len(self._verdicts) > self.checker_size:
+                self._verdicts.popitem(last=False)
+
+
+class CachedListSQLDatabaseTool(ListSQLDatabaseTool):
+    database_key: str
+
+    def _run(self, tool_input: str = "", run_manager=None) -> str:
+        snapshot = get_schema_catalog().get(self.database_key)
+        if snapshot is None:
+            return super()._run(tool_input, run_manager)
+        # Agents restricted to linked tables only see those
+        usable = set(self.db.get_usable_table_names())
+        return ", ".join(sorted(table for table in snapshot.tables if table in usable))
+
+
+class CachedInfoSQLDatabaseTool(InfoSQLDatabaseTool):
+    database_key: str
+
+    def _run(self, table_names: str, run_manager=None) -> str:
+        snapshot = get_schema_catalog().get(self.database_key)
+        if snapshot is None:
+            return super()._run(table_names, run_manager)
+        requested = [t.strip() for t in table_names.split(",") if t.strip()]
+        usable = set(self.db.get_usable_table_names())
+        missing = [t for t in requested if t not in snapshot.tables or t not in usable]
+        if missing:
+            return f"Error: table_names {set(missing)} not found in database"
+        cache = get_tool_cache()
+        return "\n\n".join(cache.table_info(snapshot, table, self.db._engine) for table in requested)
+
+
+def _validation_errors(db, database_key: str, query: str) -> Optional[str]:
+    """Feedback of the local SQL validator for an invalid query, None when it passes"""
+    # Imported here: the validator uses sql_fingerprint from this module
+    from utils.sql_validator import get_sql_validator
+
+    result = get_sql_validator().validate(query, db.dialect, get_schema_catalog().get(database_key))
+    return None if result.valid else result.feedback()
+
+
+class CachedQuerySQLCheckerTool(QuerySQLCheckerTool):
+    database_key: str
+
+    def _run(self, query: str, run_manager=None) -> str:
+        errors = _validation_errors(self.db, self.database_key, query)
+        if errors is not None:
+            return errors
+        cache = get_tool_cache()
+        verdict = cache.verdict(self.db.dialect, query)
+        if verdict is None:
+            verdict = super()._run(query, run_manager)
+            cache.store_verdict(self.db.dialect, query, verdict)
+        return verdict
+
+    async def _arun(self, query: str, run_manager=None) -> str:
+        errors = _validation_errors(self.db, self.database_key, query)
+        if errors is not None:
+            return errors
+        cache = get_tool_cache()
+        verdict = cache.verdict(self.db.dialect, query)
+        if verdict is None:
+            verdict = await super()._arun(query, run_manager)
+            cache.store_verdict(self.db.dialect, query, verdict)
+        return verdict
+
+
+class GuardedQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    database_key: str
+
+    def _run(self, query: str, run_manager=None):
+        # Imported here: the cost guard uses sql_fingerprint from this module
+        from utils.cost_guard import get_cost_guard
+
+        errors = _validation_errors(self.db, self.database_key, query)
+        if errors is not None:
+            return f"Error: {errors}"
+        try:
+            with self.db._engine.connect() as connection:
+                verdict = get_cost_guard().check(connection, query)
+        except Exception as e:
+            logger.debug(f"Cost guard unavailable: {e}")
+            return super()._run(query, run_manager)
+        if verdict.rejected:
+            return f"Error: {verdict.feedback()}"
+        return super()._run(verdict.sql, run_manager)
+
+
+class CachingSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """SQLDatabaseToolkit whose metadata and checker tools are served from caches and whose queries are cost-guarded"""
+
+    database_key: str
+
+    def get_tools(self) -> List[BaseTool]:
+        cached = {
+            ListSQLDatabaseTool: lambda tool: CachedListSQLDatabaseTool(
+                db=self.db, database_key=self.database_key, description=tool.description),
+            InfoSQLDatabaseTool: lambda tool: CachedInfoSQLDatabaseTool(
+                db=self.db, database_key=self.database_key, description=tool.description),
+            QuerySQLCheckerTool: lambda tool: CachedQuerySQLCheckerTool(
+                db=self.db, llm=self.llm, llm_chain=tool.llm_chain, database_key=self.database_key,
+                description=tool.description),
+            QuerySQLDatabaseTool: lambda tool: GuardedQuerySQLDatabaseTool(
+                db=self.db, database_key=self.database_key, description=tool.description),
+        }
+        # Same tools, names and descriptions as the parent toolkit, so agent prompts are unchanged
+        return [cached[type(tool)](tool) if type(tool) in cached else tool for tool in super().get_tools()]
+
+
+# Global tool result cache instance
+_tool_cache = None
+
+def get_tool_cache() -> ToolResultCache:
+    """Get or create the global tool result cache and subscribe it to schema changes"""
+    global _tool_cache
+    if _tool_cache is None:
+        _tool_cache = ToolResultCache()
+        get_schema_catalog().add_listener(_tool_cache.on_schema_snapshot)
+    return _tool_cache
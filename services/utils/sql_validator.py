@@ -0,0 +1,344 @@
+"""
+SQL Validator
+Local validation of generated SQL against the schema catalog, before any round trip:
+1. The SQL is parsed into an AST with sqlglot in the database's dialect
+   (PostgreSQL or MySQL); syntax errors carry line and column
+2. Read-only enforcement: a single SELECT (or set operation of SELECTs) without
+   data-modifying CTEs, SELECT INTO, row locks or side-effecting functions
+3. Every table and column reference is resolved scope by scope (CTEs, derived
+   tables, correlated subqueries, select aliases) against the snapshot
+4. Problems come back as structured issues with close-match suggestions, and as
+   feedback text that can be put straight into a regeneration prompt
+Results are cached by schema fingerprint and SQL fingerprint.
+"""
+
+import re
+import difflib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+from utils.schema_cache import SchemaSnapshot
+from utils.sql_toolkit import sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DIALECTS = {"postgresql": "postgres", "mysql": "mysql"}
+VALIDATION_CACHE_SIZE = 2048
+MAX_SUGGESTIONS = 3
+TOKEN_REPR = re.compile(r"<Token token_type: [^,]*, text: ([^,]*),[^>]*>")
+
+# Tables in these schemas are not in the snapshot (base tables of the current schema) and are not resolved
+SYSTEM_SCHEMAS = {"information_schema", "pg_catalog", "mysql", "performance_schema", "sys"}
+READ_ONLY_ROOTS = (exp.Select, exp.Union, exp.Intersect, exp.Except, exp.Subquery)
+WRITE_NODES = tuple(
+    getattr(exp, name) for name in (
+        "Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "AlterTable", "TruncateTable",
+        "Command", "Set", "Grant", "Copy", "Into", "Lock",
+    ) if hasattr(exp, name)
+)
+# Functions that sleep, lock, read files, signal backends or change state
+DISALLOWED_FUNCTIONS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "sleep", "benchmark", "load_file", "pg_read_file",
+    "pg_read_binary_file", "pg_ls_dir", "lo_import", "lo_export", "pg_terminate_backend", "pg_cancel_backend",
+    "pg_reload_conf", "set_config", "dblink", "dblink_exec", "pg_advisory_lock", "pg_advisory_xact_lock",
+    "get_lock", "nextval", "setval", "txid_current",
+}
+
+
+class ValidationIssue:
+    def __init__(self, code: str, message: str, table: Optional[str] = None, column: Optional[str] = None,
+                 suggestions: Optional[List[str]] = None):
+        self.code = code
+        self.message = message
+        self.table = table
+        self.column = column
+        self.suggestions = suggestions or []
+
+    def to_dict(self) -> Dict[str, Any]:
+        issue = {"code": self.code, "message": self.message}
+        if self.table is not None:
+            issue["table"] = self.table
+        if self.column is not None:
+            issue["column"] = self.column
+        if self.suggestions:
+            issue["suggestions"] = self.suggestions
+        return issue
+
+
+class ValidationResult:
+    def __init__(self, issues: List[ValidationIssue], tables: Optional[List[str]] = None, checked_schema: bool = False):
+        self.issues = issues
+        self.tables = tables or []          # schema tables the query reads
+        self.checked_schema = checked_schema
+
+    @property
+    def valid(self) -> bool:
+        return not self.issues
+
+    def feedback(self) -> str:
+        """The issues as instructions for regenerating the query"""
+        lines = []
+        for issue in self.issues:
+            hint = f" Did you mean: {', '.join(issue.suggestions)}?" if issue.suggestions else ""
+            lines.append(f"- {issue.message}{hint}")
+        return ("The SQL query is invalid:\n" + "\n".join(lines) +
+                "\nRewrite it as a single read-only SELECT using only existing tables and columns.")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"valid": self.valid, "checked_schema": self.checked_schema,
+                "tables": self.tables, "issues": [issue.to_dict() for issue in self.issues]}
+
+
+def _match(name: str, candidates, case_sensitive: bool) -> Optional[str]:
+    """The candidate a reference resolves to (unquoted identifiers are case-insensitive)"""
+    if name in candidates:
+        return name
+    if case_sensitive:
+        return None
+    lowered = name.lower()
+    return next((candidate for candidate in candidates if candidate.lower() == lowered), None)
+
+
+def _suggest(name: str, candidates) -> List[str]:
+    by_lower = {candidate.lower(): candidate for candidate in candidates}
+    return [by_lower[m] for m in difflib.get_close_matches(name.lower(), list(by_lower), n=MAX_SUGGESTIONS, cutoff=0.6)]
+
+
+def _token_text(match: "re.Match") -> str:
+    return f"'{match.group(1)}'"
+
+
+def _function_name(node: exp.Func) -> str:
+    return (node.name if isinstance(node, exp.Anonymous) else node.sql_name()).lower()
+
+
+class _Resolver:
+    """Resolves the table and column references of one statement against one snapshot"""
+
+    def __init__(self, snapshot: SchemaSnapshot, dialect: str):
+        self.snapshot = snapshot
+        self.dialect = dialect
+        self.issues: List[ValidationIssue] = []
+        self.tables: List[str] = []
+
+    def table(self, table: exp.Table) -> Optional[str]:
+        """Snapshot table of a table reference; None (after recording an issue if unknown) otherwise"""
+        if not isinstance(table.this, exp.Identifier):
+            return None  # table functions such as generate_series
+        name, schema = table.name, table.db
+        if schema.lower() in SYSTEM_SCHEMAS or (self.dialect == "postgresql" and not schema and name.startswith("pg_")):
+            return None
+        # MySQL table names follow the server's filesystem; the snapshot has them as stored
+        case_sensitive = self.dialect == "postgresql" and table.this.quoted
+        resolved = _match(name, self.snapshot.tables, case_sensitive)
+        if resolved is None and schema:
+            return None  # the catalog covers the current schema only
+        if resolved is None:
+            self.issues.append(ValidationIssue(
+                "unknown_table", f"Table '{name}' does not exist.", table=name,
+                suggestions=_suggest(name, self.snapshot.tables),
+            ))
+        elif resolved not in self.tables:
+            self.tables.append(resolved)
+        return resolved
+
+    def source_columns(self, scope: Scope, alias: str) -> Tuple[bool, Optional[List[str]]]:
+        """(known source, its column names or None when they can't be listed)"""
+        source = scope.sources.get(alias)
+        if isinstance(source, exp.Table):
+            resolved = self.table(source) if source not in self._seen else self._seen[source]
+            self._seen[source] = resolved
+            return True, [column["name"] for column in self.snapshot.columns(resolved)] if resolved else None
+        if isinstance(source, Scope):
+            expression = source.expression
+            node = scope.selected_sources.get(alias, (None, None))[0]
+            aliases = node.alias_column_names if isinstance(node, exp.Subquery) else []
+            if not aliases and isinstance(expression.parent, exp.CTE):
+                aliases = expression.parent.alias_column_names
+            if aliases:
+                return True, list(aliases)
+            if not isinstance(expression, exp.Query) or expression.is_star:
+                return True, None
+            return True, list(expression.named_selects)
+        # Unnest, VALUES lists and the like
+        return source is not None, None
+
+    def resolve(self, expression: exp.Expression):
+        self._seen: Dict[exp.Table, Optional[str]] = {}
+        for scope in traverse_scope(expression):
+            for alias in scope.sources:
+                self.source_columns(scope, alias)
+            for column in scope.columns:
+                if column.name == "*" or isinstance(column.this, exp.Star):
+                    continue
+                # Outer references of correlated subqueries are listed in both scopes; checked in their own
+                if column.find_ancestor(exp.Select) is not scope.expression:
+                    continue
+                self.column(scope, column)
+
+    @staticmethod
+    def _select_alias(scope: Scope, column: exp.Column) -> bool:
+        """Whether a column outside the select list names one of its aliases (GROUP BY, HAVING, ORDER BY)"""
+        if not isinstance(scope.expression, exp.Select) or column.find_ancestor(exp.Group, exp.Having, exp.Order) is None:
+            return False
+        aliases = [projection.alias for projection in scope.expression.expressions if isinstance(projection, exp.Alias)]
+        return _match(column.name, aliases, False) is not None
+
+    def column(self, scope: Scope, column: exp.Column):
+        name, qualifier = column.name, column.table
+        case_sensitive = self.dialect == "postgresql" and column.this.quoted
+        if qualifier:
+            current = scope
+            while current is not None:
+                alias = _match(qualifier, current.sources, False)
+                if alias is not None:
+                    break
+                current = current.parent
+            if current is None:
+                self.issues.append(ValidationIssue(
+                    "unknown_table_reference", f"'{qualifier}.{name}' refers to '{qualifier}', which is not in the FROM clause.",
+                    table=qualifier, column=name,
+                ))
+                return
+            _, columns = self.source_columns(current, alias)
+            if columns is not None and _match(name, columns, case_sensitive) is None:
+                table = current.sources[alias].name if isinstance(current.sources[alias], exp.Table) else alias
+                self.issues.append(ValidationIssue(
+                    "unknown_column", f"Column '{name}' does not exist in '{table}'.", table=table, column=name,
+                    suggestions=_suggest(name, columns),
+                ))
+            return
+
+        # Unqualified: the innermost scope with a source holding the column, then select aliases
+        current = scope
+        candidates: List[str] = []
+        while current is not None:
+            owners, unknown = [], False
+            for alias in current.sources:
+                _, columns = self.source_columns(current, alias)
+                if columns is None:
+                    unknown = True
+                elif _match(name, columns, case_sensitive) is not None:
+                    owners.append(alias)
+                else:
+                    candidates.extend(columns)
+            if len(owners) > 1:
+                self.issues.append(ValidationIssue(
+                    "ambiguous_column", f"Column '{name}' is ambiguous; it exists in {', '.join(owners)}.",
+                    column=name, suggestions=[f"{owner}.{name}" for owner in owners],
+                ))
+                return
+            if owners or unknown:
+                return
+            if current is scope and self._select_alias(scope, column):
+                return
+            current = current.parent
+        self.issues.append(ValidationIssue(
+            "unknown_column", f"Column '{name}' does not exist in any table of the query.", column=name,
+            suggestions=_suggest(name, set(candidates)),
+        ))
+
+
+class SQLValidator:
+    def __init__(self, cache_size: int = VALIDATION_CACHE_SIZE):
+        self.cache_size = cache_size
+        # (database key, schema fingerprint, SQL fingerprint) -> result, least recently used first
+        self._results: "OrderedDict[Tuple[str, str, str], ValidationResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"validated": 0, "cached": 0, "invalid": 0}
+
+    def validate(self, sql: str, dialect: str, snapshot: Optional[SchemaSnapshot] = None) -> ValidationResult:
+        """
+        Parse and check a query; without a snapshot only syntax and read-only access are checked.
+
+        Args:
+            sql: Query text
+            dialect: "postgresql" or "mysql" (other dialects use sqlglot's generic parser)
+            snapshot: Schema catalog snapshot of the database the query runs on
+        """
+        cache_key = (snapshot.key if snapshot else "", snapshot.fingerprint if snapshot else "",
+                     sql_fingerprint(dialect, sql))
+        with self._lock:
+            cached = self._results.get(cache_key)
+            if cached is not None:
+                self._results.move_to_end(cache_key)
+                self.stats["cached"] += 1
+                return cached
+
+        result = self._validate(sql, dialect, snapshot)
+        with self._lock:
+            self.stats["validated"] += 1
+            if not result.valid:
+                self.stats["invalid"] += 1
+            self._results[cache_key] = result
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return result
+
+    def _validate(self, sql: str, dialect: str, snapshot: Optional[SchemaSnapshot]) -> ValidationResult:
+        try:
+            statements = [s for s in sqlglot.parse(sql, read=DIALECTS.get(dialect)) if s is not None]
+        except ParseError as e:
+            issues = [
+                ValidationIssue("syntax_error", f"Syntax error at line {error.get('line')}, column {error.get('col')}: "
+                                                f"{TOKEN_REPR.sub(_token_text, error.get('description', ''))}")
+                for error in e.errors[:MAX_SUGGESTIONS]
+            ] or [ValidationIssue("syntax_error", f"Syntax error: {e}")]
+            return ValidationResult(issues)
+
+        if len(statements) != 1:
+            return ValidationResult([ValidationIssue(
+                "statement_count", f"Expected exactly one statement, got {len(statements)}."
+            )])
+        statement = statements[0]
+
+        issues = self._read_only_issues(statement)
+        if issues or snapshot is None:
+            return ValidationResult(issues)
+
+        resolver = _Resolver(snapshot, dialect)
+        try:
+            resolver.resolve(statement)
+        except Exception as e:
+            # Constructs the scope walker does not support are left to the database
+            logger.debug(f"Could not resolve references: {e}")
+            return ValidationResult([], checked_schema=False)
+        return ValidationResult(resolver.issues, resolver.tables, checked_schema=True)
+
+    @staticmethod
+    def _read_only_issues(statement: exp.Expression) -> List[ValidationIssue]:
+        if not isinstance(statement, READ_ONLY_ROOTS):
+            return [ValidationIssue("not_read_only", f"Only SELECT queries are allowed, got {statement.key.upper()}.")]
+        issues = []
+        for node in statement.walk():
+            if isinstance(node, WRITE_NODES):
+                kind = "SELECT ... INTO" if isinstance(node, exp.Into) else (
+                    "row locking (FOR UPDATE/SHARE)" if isinstance(node, exp.Lock) else node.key.upper())
+                issues.append(ValidationIssue("not_read_only", f"{kind} is not allowed in a read-only query."))
+            elif isinstance(node, exp.Func) and _function_name(node) in DISALLOWED_FUNCTIONS:
+                issues.append(ValidationIssue(
+                    "disallowed_function", f"Function {_function_name(node)}() is not allowed in a read-only query."
+                ))
+        return issues
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"cached_results": len(self._results), **self.stats}
+
+
+# Global SQL validator instance
+_sql_validator = None
+
+def get_sql_validator() -> SQLValidator:
+    """Get or create global SQL validator instance"""
+    global _sql_validator
+    if _sql_validator is None:
+        _sql_validator = SQLValidator()
+    return _sql_validator
@@ -0,0 +1,330 @@
+"""
+Column Value Index
+Resolves literals in questions ("New York", "Electronics") to the table and
+column holding them, without exploratory SELECT DISTINCT queries at question time:
+1. Built in the background per database over low/medium-cardinality text columns
+   (distinct values and counts from a bounded row sample per column)
+2. Stored compactly as memory-mapped numpy arrays sorted by normalized value,
+   looked up with binary search
+3. Refreshed incrementally: schema changes only sample new columns, and on a
+   schedule the stalest columns are re-sampled in small batches
+4. At question time word n-grams resolve to (table, column, canonical value)
+   hints for the SQL generator
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import unicodedata
+from pathlib import Path
+from typing import List, Dict, Optional, Any, Callable, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from utils.schema_cache import SchemaSnapshot, get_schema_catalog, database_key_from_config, is_text_type
+from utils.semantic_parser import singular
+
+logger = logging.getLogger(__name__)
+
+VALUE_INDEX_DIR = os.getenv("VALUE_INDEX_DIR", "value_index")
+VALUE_INDEX_TTL_SECONDS = 3600
+REFRESH_BATCH_COLUMNS = 20
+VALUE_SAMPLE_ROWS = 100000
+MAX_DISTINCT_VALUES = 10000
+MAX_VALUE_LENGTH = 64
+MAX_NGRAM = 4
+
+QUESTION_STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "at", "from", "by", "for", "with", "to", "and", "or", "is", "are",
+    "was", "were", "what", "which", "who", "how", "many", "much", "show", "me", "list", "all", "top", "per",
+    "each", "every", "our", "my", "give", "find", "get", "than", "more", "less", "last", "this", "that",
+}
+
+
+def normalize_value(value: str) -> str:
+    """Accent, case and punctuation insensitive form of a value"""
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return re.sub(r"[^\w]+", " ", value.lower()).strip()
+
+
+class ValueArrays:
+    """One immutable, memory-mapped version of a database's value index"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.columns: List[Dict[str, Any]] = json.loads((path / "columns.json").read_text())
+        self.normalized = np.load(path / "normalized.npy", mmap_mode="r")
+        self.canonical = np.load(path / "canonical.npy", mmap_mode="r")
+        self.column_ids = np.load(path / "column_ids.npy", mmap_mode="r")
+        self.counts = np.load(path / "counts.npy", mmap_mode="r")
+
+    @classmethod
+    def write(cls, path: Path, columns: List[Dict[str, Any]], rows: List[Tuple[str, str, int, int]]) -> "ValueArrays":
+        """Write (normalized, canonical, column id, count) rows sorted by normalized value"""
+        path.mkdir(parents=True, exist_ok=True)
+        rows.sort(key=lambda row: row[0])
+        width = max([len(r[0]) for r in rows] + [len(r[1]) for r in rows] + [1])
+        np.save(path / "normalized.npy", np.array([r[0] for r in rows], dtype=f"<U{width}"))
+        np.save(path / "canonical.npy", np.array([r[1] for r in rows], dtype=f"<U{width}"))
+        np.save(path / "column_ids.npy", np.array([r[2] for r in rows], dtype=np.int32))
+        np.save(path / "counts.npy", np.array([r[3] for r in rows], dtype=np.int64))
+        (path / "columns.json").write_text(json.dumps(columns))
+        return cls(path)
+
+    def rows(self, keep: Callable[[int], bool] = lambda _: True) -> List[Tuple[str, str, int, int]]:
+        return [
+            (str(n), str(c), int(i), int(k))
+            for n, c, i, k in zip(self.normalized, self.canonical, self.column_ids, self.counts) if keep(int(i))
+        ]
+
+    def lookup(self, normalized: str) -> List[Dict[str, Any]]:
+        """All columns holding exactly this normalized value"""
+        start = int(np.searchsorted(self.normalized, normalized, side="left"))
+        end = int(np.searchsorted(self.normalized, normalized, side="right"))
+        return [
+            {
+                "table": self.columns[int(self.column_ids[i])]["table"],
+                "column": self.columns[int(self.column_ids[i])]["column"],
+                "value": str(self.canonical[i]),
+                "count": int(self.counts[i]),
+            }
+            for i in range(start, end)
+        ]
+
+    def top_values(self, limit: int) -> List[Tuple[str, int]]:
+        """Most frequent canonical values across all columns"""
+        if not len(self.counts):
+            return []
+        top: Dict[str, int] = {}
+        for i in np.argsort(-np.asarray(self.counts), kind="stable"):
+            value = str(self.canonical[i])
+            if value not in top:
+                top[value] = int(self.counts[i])
+                if len(top) >= limit:
+                    break
+        return list(top.items())
+
+
+class ValueIndex:
+    def __init__(self, base_dir: str = VALUE_INDEX_DIR, ttl: int = VALUE_INDEX_TTL_SECONDS):
+        self.base_dir = Path(base_dir)
+        self.ttl = ttl
+        self._arrays: Dict[str, ValueArrays] = {}
+        self._schema_words: Dict[str, set] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._update_locks: Dict[str, threading.Lock] = {}
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Register a callback run with the database key after every index update"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _update_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._update_locks.setdefault(key, threading.Lock())
+
+    def _database_dir(self, key: str) -> Path:
+        return self.base_dir / hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def _sample_column(self, connection, quote, table: str, column: str) -> Optional[List[Tuple[str, int]]]:
+        """Distinct values with counts from a row sample, None for high-cardinality columns"""
+        sql = (
+            f"SELECT v, COUNT(*) AS n FROM (SELECT {quote(column)} AS v FROM {quote(table)} "
+            f"LIMIT {VALUE_SAMPLE_ROWS}) AS sampled WHERE v IS NOT NULL "
+            f"GROUP BY v ORDER BY n DESC LIMIT {MAX_DISTINCT_VALUES + 1}"
+        )
+        values = [(str(v).strip(), int(n)) for v, n in connection.execute(text(sql))]
+        sampled = sum(n for _, n in values)
+        # Identifiers and free text are (nearly) unique per row and make poor entities
+        if len(values) > MAX_DISTINCT_VALUES or (sampled > 200 and len(values) > 0.5 * sampled):
+            return None
+        return [(v, n) for v, n in values if v and len(v) <= MAX_VALUE_LENGTH]
+
+    def _update(self, snapshot: SchemaSnapshot, stale: Callable[[Dict[str, Any]], bool]):
+        """Re-sample columns selected by stale(meta) and keep the rows of all others"""
+        # One update per database at a time: concurrent ones would drop each other's re-sampled columns
+        with self._update_lock(snapshot.key):
+            if not self._resample(snapshot, stale):
+                return
+
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot.key)
+            except Exception as e:
+                logger.warning(f"⚠️ Value index listener failed for {snapshot.key}: {e}")
+
+    def _resample(self, snapshot: SchemaSnapshot, stale: Callable[[Dict[str, Any]], bool]) -> bool:
+        """Write and install a new version of a database's index; False when it has no engine"""
+        engine = get_schema_catalog().engine(snapshot.key)
+        if engine is None:
+            return False
+        quote = engine.dialect.identifier_preparer.quote
+        current = self._arrays.get(snapshot.key)
+        previous = {(c["table"], c["column"]): (i, c) for i, c in enumerate(current.columns)} if current else {}
+
+        columns, rows, kept_ids, resampled = [], [], {}, 0
+        with engine.connect() as connection:
+            for table, table_columns in snapshot.tables.items():
+                for col in table_columns:
+                    if not is_text_type(col["type"]):
+                        continue
+                    old = previous.get((table, col["name"]))
+                    column_id = len(columns)
+                    if old is not None and not stale(old[1]):
+                        kept_ids[old[0]] = column_id
+                        columns.append(old[1])
+                        continue
+                    meta = {"table": table, "column": col["name"], "refreshed_at": time.time(), "indexed": False}
+                    try:
+                        # In a savepoint: one failing column must not abort the transaction for the others
+                        with connection.begin_nested():
+                            values = self._sample_column(connection, quote, table, col["name"])
+                    except Exception as e:
+                        logger.warning(f"⚠️ Could not sample values of {table}.{col['name']}: {e}")
+                        values = None
+                    if values is not None:
+                        meta["indexed"] = True
+                        rows.extend((normalize_value(v), v, column_id, n) for v, n in values if normalize_value(v))
+                    columns.append(meta)
+                    resampled += 1
+
+        if current is not None:
+            rows.extend((n, c, kept_ids[i], k) for n, c, i, k in current.rows(lambda i: i in kept_ids))
+
+        version = self._database_dir(snapshot.key) / str(time.time_ns())
+        arrays = ValueArrays.write(version, columns, rows)
+        with self._lock:
+            self._arrays[snapshot.key] = arrays
+            self._schema_words[snapshot.key] = {
+                singular(word) for table, cols in snapshot.tables.items()
+                for name in [table] + [c["name"] for c in cols] for word in normalize_value(name).replace("_", " ").split()
+            }
+        # Older versions are no longer referenced once the new one is swapped in
+        for old_version in version.parent.iterdir():
+            if old_version.name.isdigit() and int(old_version.name) < int(version.name):
+                shutil.rmtree(old_version, ignore_errors=True)
+        logger.info(f"🔤 Value index for {snapshot.key}: {len(rows)} values, {resampled} columns sampled")
+        return True
+
+    def _load(self, key: str) -> Optional[ValueArrays]:
+        """Latest version persisted by a previous process, so restarts only sample new columns"""
+        database_dir = self._database_dir(key)
+        if not database_dir.exists():
+            return None
+        versions = sorted((p for p in database_dir.iterdir() if (p / "columns.json").exists()), key=lambda p: int(p.name))
+        if not versions:
+            return None
+        try:
+            return ValueArrays(versions[-1])
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load value index for {key}: {e}")
+            return None
+
+    def on_schema_snapshot(self, snapshot: SchemaSnapshot):
+        """Schema catalog listener: sample columns that are new since the last build"""
+        with self._update_lock(snapshot.key):
+            if snapshot.key not in self._arrays:
+                persisted = self._load(snapshot.key)
+                if persisted is not None:
+                    self._arrays[snapshot.key] = persisted
+        self._update(snapshot, stale=lambda meta: False)
+
+    def refresh(self, key: str):
+        """Re-sample the stalest batch of columns of one database"""
+        try:
+            snapshot = get_schema_catalog().get(key)
+            arrays = self._arrays.get(key)
+            if snapshot is None or arrays is None:
+                return
+            stalest = sorted(arrays.columns, key=lambda meta: meta["refreshed_at"])[:REFRESH_BATCH_COLUMNS]
+            due = {(m["table"], m["column"]) for m in stalest if time.time() - m["refreshed_at"] > self.ttl}
+            if due:
+                self._update(snapshot, stale=lambda meta: (meta["table"], meta["column"]) in due)
+        except Exception as e:
+            # Runs on a daemon thread: the batch is retried by a later lookup while its columns are still due
+            logger.warning(f"⚠️ Value index refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def arrays(self, key: str) -> Optional[ValueArrays]:
+        """Current index of a database; schedules a background refresh when columns are due"""
+        arrays = self._arrays.get(key)
+        if arrays is None:
+            return None
+        oldest = min((meta["refreshed_at"] for meta in arrays.columns), default=time.time())
+        with self._lock:
+            if time.time() - oldest > self.ttl and key not in self._refreshing:
+                self._refreshing.add(key)
+                threading.Thread(target=self.refresh, args=(key,), daemon=True).start()
+        return arrays
+
+    def hints(self, database_config: Dict[str, Any], question: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Resolve literals in a question to the columns holding them.
+
+        Returns:
+            [{"literal", "table", "column", "value", "count"}], longest literals first
+        """
+        if not database_config:
+            return []
+        key = database_key_from_config(database_config)
+        arrays = self.arrays(key)
+        if arrays is None:
+            return []
+        schema_words = self._schema_words.get(key, set())
+
+        words = normalize_value(question).split()
+        taken = [False] * len(words)
+        hints = []
+        for n in range(min(MAX_NGRAM, len(words)), 0, -1):
+            for start in range(len(words) - n + 1):
+                if any(taken[start:start + n]):
+                    continue
+                gram = words[start:start + n]
+                if all(w in QUESTION_STOPWORDS or w.isdigit() for w in gram):
+                    continue
+                # Single words naming tables/columns are schema references, not literals
+                if n == 1 and singular(gram[0]) in schema_words:
+                    continue
+                matches = arrays.lookup(" ".join(gram))
+                if not matches:
+                    continue
+                for i in range(start, start + n):
+                    taken[i] = True
+                for match in sorted(matches, key=lambda m: m["count"], reverse=True):
+                    hints.append({"literal": " ".join(gram), **match})
+        return hints[:limit]
+
+    def top_values(self, key: str, limit: int = 500) -> List[Tuple[str, int]]:
+        arrays = self._arrays.get(key)
+        return arrays.top_values(limit) if arrays is not None else []
+
+
+def format_value_hints(hints: List[Dict[str, Any]]) -> str:
+    """Prompt lines telling the SQL generator where question literals live"""
+    return "\n".join(
+        f"- '{hint['literal']}' matches {hint['table']}.{hint['column']} = '{hint['value']}' ({hint['count']} rows sampled)"
+        for hint in hints
+    )
+
+
+# Global value index instance
+_value_index = None
+
+def get_value_index() -> ValueIndex:
+    """Get or create the global value index and subscribe it to schema changes"""
+    global _value_index
+    if _value_index is None:
+        _value_index = ValueIndex()
+        get_schema_catalog().add_listener(_value_index.on_schema_snapshot)
+    return _value_index
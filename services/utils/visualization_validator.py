@@ -10,7 +10,8 @@ import json
 from typing import List, Dict, Optional, Any
 from dotenv import load_dotenv
 import logging
-import google.generativeai as genai
+
+from utils.llm_gateway import get_llm_gateway
 
 load_dotenv()
 
@@ -26,14 +27,9 @@ class VisualizationValidator:
             self.logger.warning("⚠️ Google Gemini API key not configured. Visualization validation will use fallback logic.")
             self.model = None
         else:
-            try:
-                genai.configure(api_key=self.api_key)
-                # Use Gemini 2.5 Flash
-                self.model = genai.GenerativeModel('gemini-2.5-flash')
-                self.logger.info("✅ Google Gemini client initialized for visualization validation (gemini-2.5-flash)")
-            except Exception as e:
-                self.logger.error(f"❌ Failed to initialize Google Gemini: {e}")
-                self.model = None
+            # Gemini 2.5 Flash over the LLM gateway's pooled REST client
+            self.model = "gemini-2.5-flash"
+            self.logger.info("✅ Google Gemini configured for visualization validation (gemini-2.5-flash)")
     
     def should_visualize(
         self, 
@@ -82,10 +78,9 @@ class VisualizationValidator:
             prompt = self._create_validation_prompt(user_query, sql_query, data_summary)
             
             # Call Google Gemini
-            response = self.model.generate_content(prompt)
-            
-            # Parse response
-            content = response.text
+            content = get_llm_gateway().complete(
+                [{"role": "user", "content": prompt}], model=self.model, provider="gemini", temperature=0.2
+            )
             
             # Extract JSON from response (Gemini might wrap it in markdown)
             content = content.strip()
@@ -0,0 +1,316 @@
+"""
+Visualization Query Planner
+Pushes chart aggregation down to the database for large results. Instead of
+pulling raw rows into Python, the generated SQL is wrapped in a bucketing query:
+1. Time trends (line/area) are grouped by a date bucket sized from the column's min/max
+   (read from the column statistics catalog for plain table projections)
+2. Distributions (bar/scatter/heatmap over a numeric column) become histogram buckets
+3. Categorical bar/pie charts are grouped and capped to the largest categories
+The database then returns at most a few hundred aggregated points. The SQL
+must pass the local validator (one read-only SELECT) before it is wrapped, and
+every statement runs under the request's statement timeout and the cost guard.
+"""
+
+import re
+import math
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import List, Dict, Optional, Any, Tuple
+
+from sqlalchemy import text
+
+from utils.column_stats import get_statistics_catalog
+from utils.cost_guard import get_cost_guard
+from utils.deadline import statement_timeout
+from utils.schema_cache import get_schema_catalog
+from utils.sql_validator import get_sql_validator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_POINTS = 300
+SUPPORTED_AGGREGATES = ["sum", "avg", "min", "max", "count"]
+TREND_CHARTS = ["line", "area"]
+
+# SELECT <columns> FROM <table> without filters, whose bounds are the table column's statistics
+SIMPLE_PROJECTION = re.compile(
+    r"^select\s+(?P<columns>\*|[\w\"`]+(?:\s*,\s*[\w\"`]+)*)\s+from\s+(?P<table>[\w\"`]+)$", re.IGNORECASE
+)
+
+# Candidate time buckets from finest to coarsest, with their approximate length in seconds
+TIME_BUCKETS: List[Tuple[str, int]] = [
+    ("second", 1),
+    ("minute", 60),
+    ("hour", 3600),
+    ("day", 86400),
+    ("week", 7 * 86400),
+    ("month", 30 * 86400),
+    ("quarter", 91 * 86400),
+    ("year", 365 * 86400),
+]
+
+# MySQL has no date_trunc, so every bucket is spelled out with its own functions
+MYSQL_TIME_BUCKETS = {
+    "second": "DATE_FORMAT({col}, '%Y-%m-%d %H:%i:%s')",
+    "minute": "DATE_FORMAT({col}, '%Y-%m-%d %H:%i:00')",
+    "hour": "DATE_FORMAT({col}, '%Y-%m-%d %H:00:00')",
+    "day": "DATE({col})",
+    "week": "DATE_SUB(DATE({col}), INTERVAL WEEKDAY({col}) DAY)",
+    "month": "DATE_FORMAT({col}, '%Y-%m-01')",
+    "quarter": "MAKEDATE(YEAR({col}), 1) + INTERVAL (QUARTER({col}) - 1) QUARTER",
+    "year": "DATE_FORMAT({col}, '%Y-01-01')",
+}
+
+
+def choose_time_bucket(min_value: datetime, max_value: datetime, max_points: int) -> str:
+    """Pick the finest time bucket that keeps the number of points under max_points"""
+    span = (max_value - min_value).total_seconds()
+    for unit, seconds in TIME_BUCKETS:
+        if span / seconds <= max_points:
+            return unit
+    return TIME_BUCKETS[-1][0]
+
+
+def choose_bin_width(min_value: float, max_value: float, max_points: int) -> float:
+    """Pick a 1/2/5 x 10^n histogram bin width giving at most max_points bins"""
+    span = max_value - min_value
+    if span <= 0:
+        return 1.0
+    raw = span / max_points
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for step in (1, 2, 5, 10):
+        width = step * magnitude
+        if span / width <= max_points:
+            return width
+    return 10 * magnitude
+
+
+def time_bucket_expression(dbtype: str, column: str, unit: str) -> str:
+    """Dialect-specific expression truncating column to the given time bucket"""
+    if dbtype == "postgresql":
+        return f"date_trunc('{unit}', {column})"
+    if dbtype == "mysql":
+        return MYSQL_TIME_BUCKETS[unit].format(col=column)
+    raise ValueError(f"Unsupported database type for visualization planning: {dbtype}")
+
+
+def strip_sql(sql_query: str) -> str:
+    """Remove trailing semicolons so the query can be used as a subquery"""
+    return sql_query.strip().rstrip(";").strip()
+
+
+def _is_temporal(value: Any) -> bool:
+    return isinstance(value, (datetime, date))
+
+
+def _is_numeric(value: Any) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _to_datetime(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime(value.year, value.month, value.day)
+
+
+def _serialize(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if not isinstance(value, (str, int, float, bool, type(None))):
+        return str(value)
+    return value
+
+
+class VisualizationQueryPlanner:
+    def __init__(self, engine, dbtype: str, max_points: int = DEFAULT_MAX_POINTS, database_key: Optional[str] = None):
+        """
+        Args:
+            engine: SQLAlchemy engine for the target database
+            dbtype: 'postgresql' or 'mysql'
+            max_points: Upper bound on the number of aggregated points returned
+            database_key: Schema catalog key of the database, enables bounds from column statistics
+        """
+        if dbtype not in ("postgresql", "mysql"):
+            raise ValueError(f"Unsupported database type for visualization planning: {dbtype}")
+        self.engine = engine
+        self.dbtype = dbtype
+        self.max_points = max_points
+        self.database_key = database_key
+        self.quote = engine.dialect.identifier_preparer.quote
+
+    def _validated(self, sql_query: str) -> str:
+        """The query as a subquery, once the validator accepts it as a single read-only SELECT"""
+        snapshot = get_schema_catalog().get(self.database_key) if self.database_key else None
+        validation = get_sql_validator().validate(sql_query, self.dbtype, snapshot)
+        if not validation.valid:
+            raise ValueError(validation.feedback())
+        # A trailing line comment must not swallow the closing parenthesis of the wrapper
+        return strip_sql(sql_query) + "\n"
+
+    @staticmethod
+    def _execute(connection, sql: str):
+        # Plans too expensive to run are rejected like chat queries
+        verdict = get_cost_guard().check(connection, sql)
+        if verdict.rejected:
+            raise ValueError(verdict.feedback())
+        return connection.execute(text(verdict.sql))
+
+    def _fetch_one(self, sql: str) -> Optional[Dict[str, Any]]:
+        with self.engine.connect() as connection, statement_timeout(connection):
+            result = self._execute(connection, sql)
+            row = result.fetchone()
+            return dict(zip(result.keys(), row)) if row is not None else None
+
+    def _fetch_all(self, sql: str) -> List[Dict[str, Any]]:
+        with self.engine.connect() as connection, statement_timeout(connection):
+            result = self._execute(connection, sql)
+            columns = list(result.keys())
+            return [{col: _serialize(value) for col, value in zip(columns, row)} for row in result]
+
+    def _statistics_bounds(self, base_sql: str, x_key: str) -> Optional[Dict[str, Any]]:
+        """Min/max/row count of a plain table projection from the statistics catalog, without a scan"""
+        match = SIMPLE_PROJECTION.match(base_sql)
+        if not match or self.database_key is None:
+            return None
+        stats = get_statistics_catalog().get(self.database_key)
+        if stats is None:
+            return None
+        columns = [c.strip().strip('"`') for c in match.group("columns").split(",")]
+        table = match.group("table").strip('"`')
+        column = stats.column(table, x_key)
+        row_count = stats.row_count(table)
+        if (columns != ["*"] and x_key not in columns) or column is None or row_count is None or column["min"] is None:
+            return None
+        return {"min_value": column["min"], "max_value": column["max"], "row_count": row_count}
+
+    def _detect_columns(self, base_sql: str, x_key: Optional[str], y_keys: Optional[List[str]]) -> Tuple[str, List[str]]:
+        """Detect x (temporal first, then categorical) and numeric y columns from one sample row"""
+        sample = self._fetch_one(f"SELECT * FROM ({base_sql}) AS viz_src LIMIT 1")
+        if not sample:
+            raise ValueError("Query returned no rows to visualize")
+        if x_key and x_key not in sample:
+            raise ValueError(f"Column '{x_key}' not found in result")
+        numeric = [col for col, value in sample.items() if _is_numeric(value)]
+        if not x_key:
+            temporal = [col for col, value in sample.items() if _is_temporal(value)]
+            other = [col for col in sample if col not in numeric]
+            x_key = (temporal or other or numeric or [None])[0]
+        if y_keys is None:
+            y_keys = [col for col in numeric if col != x_key]
+        for key in y_keys:
+            if key not in sample:
+                raise ValueError(f"Column '{key}' not found in result")
+        return x_key, y_keys
+
+    def _measures(self, y_keys: List[str], agg: str) -> str:
+        measures = ["COUNT(*) AS " + self.quote("count")]
+        if agg != "count":
+            for key in y_keys:
+                if key == "count":
+                    continue
+                measures.append(f"{agg.upper()}({self.quote(key)}) AS {self.quote(key)}")
+        return ", ".join(measures)
+
+    def plan(
+        self,
+        sql_query: str,
+        chart_type: str,
+        x_key: Optional[str] = None,
+        y_keys: Optional[List[str]] = None,
+        agg: str = "sum",
+    ) -> Dict[str, Any]:
+        """
+        Build the aggregated query for a chart without executing it.
+
+        Returns:
+            {
+                "sql": str,              # query to run (the original SQL when no push-down applies)
+                "method": str,           # time_bucket | histogram | top_categories | passthrough
+                "bucket": str | float,   # time unit or numeric bin width
+                "x_key": str,
+                "y_keys": List[str],
+                "original_rows": int,    # estimated from statistics when bounds_source is "statistics"
+                "bounds_source": str     # statistics | query
+            }
+        """
+        agg = (agg or "sum").lower()
+        if agg not in SUPPORTED_AGGREGATES:
+            raise ValueError(f"Unsupported aggregate: {agg}. Choose one of {', '.join(SUPPORTED_AGGREGATES)}.")
+
+        base_sql = self._validated(sql_query)
+        x_key, y_keys = self._detect_columns(base_sql, x_key, y_keys)
+        x_col = self.quote(x_key)
+
+        bounds = self._statistics_bounds(base_sql, x_key)
+        bounds_source = "statistics"
+        if bounds is None:
+            bounds_source = "query"
+            bounds = self._fetch_one(
+                f"SELECT MIN({x_col}) AS min_value, MAX({x_col}) AS max_value, COUNT(*) AS row_count "
+                f"FROM ({base_sql}) AS viz_src"
+            )
+        plan = {
+            "sql": base_sql,
+            "method": "passthrough",
+            "bucket": None,
+            "x_key": x_key,
+            "y_keys": y_keys,
+            "original_rows": int(bounds["row_count"]),
+            "bounds_source": bounds_source,
+        }
+        if plan["original_rows"] <= self.max_points or bounds["min_value"] is None:
+            return plan
+
+        min_value, max_value = bounds["min_value"], bounds["max_value"]
+        measures = self._measures(y_keys, agg)
+
+        if _is_temporal(min_value):
+            unit = choose_time_bucket(_to_datetime(min_value), _to_datetime(max_value), self.max_points)
+            bucket = time_bucket_expression(self.dbtype, x_col, unit)
+            plan.update({
+                "sql": f"SELECT {bucket} AS {x_col}, {measures} FROM ({base_sql}) AS viz_src "
+                       f"WHERE {x_col} IS NOT NULL GROUP BY 1 ORDER BY 1",
+                "method": "time_bucket",
+                "bucket": unit,
+            })
+        elif _is_numeric(min_value):
+            low, high = float(min_value), float(max_value)
+            width = choose_bin_width(low, high, self.max_points)
+            last_bin = max(math.ceil((high - low) / width) - 1, 0)
+            # Statistics bounds are estimates, so values outside them are clamped into the edge bins
+            bucket = f"{low!r} + GREATEST(LEAST(FLOOR(({x_col} - {low!r}) / {width!r}), {last_bin}), 0) * {width!r}"
+            plan.update({
+                "sql": f"SELECT {bucket} AS {x_col}, {measures} FROM ({base_sql}) AS viz_src "
+                       f"WHERE {x_col} IS NOT NULL GROUP BY 1 ORDER BY 1",
+                "method": "histogram",
+                "bucket": width,
+            })
+        else:
+            # Trends over text labels keep their natural order, other charts keep the largest groups
+            if chart_type in TREND_CHARTS:
+                order_by = x_col
+            else:
+                order_by = (self.quote(y_keys[0]) if y_keys and agg != "count" else self.quote("count")) + " DESC"
+            plan.update({
+                "sql": f"SELECT {x_col}, {measures} FROM ({base_sql}) AS viz_src "
+                       f"GROUP BY {x_col} ORDER BY {order_by} LIMIT {self.max_points}",
+                "method": "top_categories",
+            })
+        if plan["method"] != "passthrough" and agg == "count":
+            plan["y_keys"] = ["count"]
+        return plan
+
+    def execute(self, sql_query: str, chart_type: str, x_key: Optional[str] = None,
+                y_keys: Optional[List[str]] = None, agg: str = "sum") -> Dict[str, Any]:
+        """Plan and run the aggregated query, returning the chart rows with the plan"""
+        plan = self.plan(sql_query, chart_type, x_key, y_keys, agg)
+        sql = plan["sql"]
+        if plan["method"] == "passthrough":
+            # Small enough already; still never return more than the original query would
+            sql = f"SELECT * FROM ({sql}) AS viz_src LIMIT {self.max_points}"
+        data = self._fetch_all(sql)
+        logger.info(f"📊 Visualization push-down ({plan['method']}, bucket={plan['bucket']}): "
+                    f"{plan['original_rows']} rows → {len(data)} points")
+        return {**plan, "data": data, "returned_points": len(data)}